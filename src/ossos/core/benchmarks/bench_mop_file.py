@@ -0,0 +1,89 @@
+"""
+Benchmark reading a large MOP catalogue with mop_file.MOPFile.
+
+Writes a synthetic .obj.jmp style file of three exposures and times the columnar parser
+against building the same table a row at a time with Table.add_row, as MOPDataParser used to.
+
+usage: python benchmarks/bench_mop_file.py [--nrecords N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy
+from astropy.table import Table
+
+from ossos import mop_file
+
+FILE_IDS = ['1616681p22', '1616692p22', '1616703p22']
+COLUMNS = ['X', 'Y', 'X_0', 'Y_0', 'FLUX', 'SIZE', 'MAX_INT', 'ELON']
+
+
+def make_catalogue(filename, nrecords):
+    """Write nrecords records, one line per exposure, to a MOP formatted file."""
+    with open(filename, 'w') as fobj:
+        for file_id in FILE_IDS:
+            fobj.write("# {}\n".format(file_id))
+        fobj.write("## MOPversion\n#  1.20\n")
+        fobj.write("##     RMIN    RMAX   ANGLE   AWIDTH\n#      0.3    15.0   -23.0    22.0\n")
+        fobj.write("##   {}\n\n".format("   ".join(COLUMNS)))
+        values = numpy.random.uniform(0, 4000, (nrecords, len(FILE_IDS), len(COLUMNS)))
+        for record in values:
+            for line in record:
+                fobj.write(" ".join("{:8.2f}".format(value) for value in line) + "\n")
+            fobj.write("\n")
+
+
+def row_parse(header, lines):
+    """Build the table a row at a time, the way MOPDataParser.parse used to."""
+    names = ["{}_{}".format(column, file_id) for file_id in header.file_ids for column in header.column_names + ['ZP']]
+    table = Table(names=names)
+    record = []
+    for line in lines:
+        if line.strip().startswith("#"):
+            continue
+        if len(line.strip()) != 0:
+            record.append(line)
+            continue
+        if len(record) == 0:
+            continue
+        values = []
+        for line in record:
+            values.extend([float(x) for x in line.split()])
+            values.append(0)
+        table.add_row(values)
+        record = []
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--nrecords', type=int, default=5000, help="number of records in the catalogue")
+    args = parser.parse_args()
+
+    handle, filename = tempfile.mkstemp(suffix='.obj.jmp')
+    os.close(handle)
+    try:
+        make_catalogue(filename, args.nrecords)
+
+        print("{:>10s} {:>15s}".format("parser", "records/s"))
+        start = time.time()
+        mopfile = mop_file.MOPFile(filename=filename)
+        print("{:>10s} {:15.0f}".format("columnar", args.nrecords / (time.time() - start)))
+
+        with open(filename) as fobj:
+            lines = fobj.read().split('\n')
+        start = time.time()
+        header = mop_file.MOPHeader('jmp').parser(lines)
+        table = row_parse(header, lines)
+        print("{:>10s} {:15.0f}".format("row", args.nrecords / (time.time() - start)))
+
+        print("max difference: {}".format(max(numpy.fabs(mopfile.data[name] - table[name]).max()
+                                              for name in mopfile.data.colnames)))
+    finally:
+        os.unlink(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark the IRAF and numpy aperture photometry backends of daophot.phot.
+
+Builds a synthetic image of Gaussian stars on a flat sky and measures all of them at
+once. The IRAF backend is only timed, and compared against, when pyraf is available.
+
+usage: python benchmarks/bench_phot.py [--npts N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy
+from astropy.io import fits
+
+from ossos import daophot
+
+NAXIS1 = 2112
+NAXIS2 = 4644
+SKY = 1000.0
+FWHM = 4.0
+
+
+def make_image(filename, npts):
+    """Write an image with npts Gaussian stars to filename and return their 1-based positions."""
+    x = numpy.random.uniform(40, NAXIS1 - 40, npts)
+    y = numpy.random.uniform(40, NAXIS2 - 40, npts)
+    flux = numpy.random.uniform(1e4, 1e5, npts)
+    data = numpy.random.normal(SKY, numpy.sqrt(SKY), (NAXIS2, NAXIS1)).astype('float32')
+    sigma = FWHM / 2.3548
+    offsets = numpy.arange(-12, 13)
+    for xc, yc, f in zip(x, y, flux):
+        cols = int(round(xc)) + offsets
+        rows = int(round(yc)) + offsets
+        stamp = numpy.exp(-((cols[None, :] - xc) ** 2 + (rows[:, None] - yc) ** 2) / (2 * sigma ** 2))
+        data[rows[0] - 1:rows[-1], cols[0] - 1:cols[-1]] += f * stamp / (2 * numpy.pi * sigma ** 2)
+    header = fits.Header()
+    header['PHOTZP'] = 30.0
+    fits.PrimaryHDU(data=data, header=header).writeto(filename)
+    return x, y
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--npts', type=int, default=2000, help="number of stars to measure")
+    args = parser.parse_args()
+
+    handle, filename = tempfile.mkstemp(suffix='.fits')
+    os.close(handle)
+    os.unlink(filename)
+    try:
+        x, y = make_image(filename, args.npts)
+        kwargs = dict(aperture=4, sky=11, swidth=4, apcor=0.0, zmag=30.0)
+
+        print("{:>10s} {:>15s}".format("backend", "stars/s"))
+        start = time.time()
+        numpy_table = daophot.phot(filename, x, y, backend=daophot.NUMPY, **kwargs)
+        print("{:>10s} {:15.0f}".format(daophot.NUMPY, args.npts / (time.time() - start)))
+
+        if daophot.iraf is None:
+            print("pyraf not available, skipping the iraf backend.")
+            return
+        start = time.time()
+        iraf_table = daophot.phot(filename, x, y, backend=daophot.IRAF, **kwargs)
+        print("{:>10s} {:15.0f}".format(daophot.IRAF, args.npts / (time.time() - start)))
+
+        good = (numpy_table['PIER'] == 0) & (iraf_table['PIER'] == 0)
+        print("max centroid difference: {:.3f} pixels".format(
+            max(numpy.fabs(numpy_table['XCENTER'][good] - iraf_table['XCENTER'][good]).max(),
+                numpy.fabs(numpy_table['YCENTER'][good] - iraf_table['YCENTER'][good]).max())))
+        print("max magnitude difference: {:.4f}".format(
+            numpy.fabs(numpy_table['MAG'][good] - iraf_table['MAG'][good]).max()))
+    finally:
+        if os.access(filename, os.F_OK):
+            os.unlink(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark the scalar and array PV WCS transformations.
+
+Uses the MegaPipe astrometric header of 821543p (CCD 00):
+http://www.cadc-ccda.hia-iha.nrc-cnrc.gc.ca/data/pub/CFHTSG/821543p.head
+
+usage: python benchmarks/bench_wcs.py [--npts N]
+"""
+import argparse
+import time
+
+import numpy
+from astropy.io import fits
+
+from ossos import wcs
+
+HEADER = {'NAXIS': 2, 'NAXIS1': 2112, 'NAXIS2': 4644,
+          'CTYPE1': 'RA---TAN', 'CTYPE2': 'DEC--TAN',
+          'CRPIX1': -7535.57493517, 'CRPIX2': 9808.40914361,
+          'CRVAL1': 176.486157083, 'CRVAL2': 8.03697351091,
+          'CD1_1': 5.115244026718E-05, 'CD1_2': 7.064503033578E-07,
+          'CD2_1': -1.280229655229E-07, 'CD2_2': -5.123112374523E-05,
+          'PV1_0': -7.030338745606E-03, 'PV1_1': 1.01755337222,
+          'PV1_2': 8.262429361142E-03, 'PV1_3': 0.00000000000,
+          'PV1_4': -5.910145454849E-04, 'PV1_5': -7.494178330178E-04,
+          'PV1_6': -3.470178516657E-04, 'PV1_7': -2.331150605755E-02,
+          'PV1_8': -8.187062772669E-06, 'PV1_9': -2.325429510806E-02,
+          'PV1_10': 1.135299506292E-04,
+          'PV2_0': -6.146513090656E-03, 'PV2_1': 1.01552885426,
+          'PV2_2': 8.259666421752E-03, 'PV2_3': 0.00000000000,
+          'PV2_4': -4.567030382243E-04, 'PV2_5': -6.978676921999E-04,
+          'PV2_6': -3.732572951216E-04, 'PV2_7': -2.332572754467E-02,
+          'PV2_8': -2.354317291723E-05, 'PV2_9': -2.329623852891E-02,
+          'PV2_10': 1.196394469003E-04,
+          'NORDFIT': 3}
+
+
+def rate(npts, func):
+    start = time.time()
+    func()
+    return npts / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--npts', type=int, default=10000, help="number of positions to transform")
+    args = parser.parse_args()
+
+    header = fits.Header()
+    for key, value in HEADER.items():
+        header[key] = value
+    this_wcs = wcs.WCS(header)
+
+    x = numpy.random.uniform(1, header['NAXIS1'], args.npts)
+    y = numpy.random.uniform(1, header['NAXIS2'], args.npts)
+    ra, dec = this_wcs.xy2sky(x, y)
+    ra = ra.value
+    dec = dec.value
+
+    print("{:>10s} {:>15s} {:>15s}".format("", "scalar pts/s", "array pts/s"))
+
+    scalar = rate(args.npts, lambda: [this_wcs.xy2sky(float(x[i]), float(y[i])) for i in range(args.npts)])
+    array = rate(args.npts, lambda: this_wcs.xy2sky(x, y))
+    print("{:>10s} {:15.0f} {:15.0f}".format("xy2sky", scalar, array))
+
+    scalar = rate(args.npts, lambda: [this_wcs.sky2xy(float(ra[i]), float(dec[i])) for i in range(args.npts)])
+    array = rate(args.npts, lambda: this_wcs.sky2xy(ra, dec))
+    print("{:>10s} {:15.0f} {:15.0f}".format("sky2xy", scalar, array))
+
+    x2, y2 = this_wcs.sky2xy(ra, dec)
+    print("max round trip error: {:.2e} pixels".format(max(numpy.fabs(x2 - x).max(), numpy.fabs(y2 - y).max())))
+
+
+if __name__ == '__main__':
+    main()
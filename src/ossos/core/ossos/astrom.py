@@ -10,8 +10,9 @@ import sys
 import traceback
 import cadcutils
 
+import numpy
 from astropy import units
-from astropy.coordinates import SkyCoord
+from astropy.coordinates import SkyCoord, angular_separation
 from astropy.units import Quantity
 from astropy.time import TimeDelta, Time
 import time
@@ -59,6 +60,9 @@ DETECTOR = "DETECTOR"
 PHADU = "PHADU"
 RDNOIS = "RDNOIS"
 
+# Bytes read at a time when streaming sources from a file.
+READ_CHUNK_SIZE = 1024 * 1024
+
 # System header keys
 RMIN = "RMIN"
 RMAX = "RMAX"
@@ -128,6 +132,7 @@ class AstromParser(object):
             "##\s+X\s+Y\s+X_0\s+Y_0\s+R.A.\s+DEC\s+(.*)",
             re.DOTALL
         )
+        self.source_header_reg = re.compile("##\s+X\s+Y\s+X_0\s+Y_0\s+R.A.\s+DEC\s*$")
         # Should we only load the discovery images during Candidate vetting?
         self.discovery_only = False
 
@@ -159,70 +164,100 @@ class AstromParser(object):
 
         assert source_list_match is not None, "Could not find the source list"
 
-        raw_source_list = (source_list_match.group(1)).split("\n\n")
+        return list(self._iter_source_data(source_list_match.group(1).split("\n"), observations))
 
-        sources = []
-        for raw_source in raw_source_list:
-            source = []
-            source_obs = raw_source.strip().split('\n')
-            assert len(source_obs) == len(
-                observations), ("Source doesn't have same number of observations"
-                                " ({0:d}) as in observations list ({1:d}).".format(len(source_obs), len(observations)))
-
-            x_0 = []
-            y_0 = []
-            x_ref = None
-            y_ref = None
-            for i, source_ob in enumerate(source_obs):
-                fields = [float(x) for x in source_ob.split()]
-                x_0.append(fields[2])
-                y_0.append(fields[3])
-                if i == 0:
-                    x_ref = fields[0]
-                    y_ref = fields[1]
-                fields.append(x_ref)
-                fields.append(y_ref)
-                # Find the observation corresponding to this reading
-                fields.append(observations[i])
-
-                source.append(SourceReading(*fields))
-
-            # Add an ra/dec reference to the source.
-            ref_index = int(math.ceil(len(source) / 2.0)) - 1
-            for reading in source:
-                assert isinstance(reading, SourceReading)
-                reading.reference_sky_coord = source[ref_index].sky_coord
-
-            # determine the smallest cutout that will include the reference coordinate and all the readings
-            min_cutout = 30 * units.arcsec
-            for reading in source:
-                sep = reading.reference_sky_coord.separation(reading.sky_coord)
-                if min_cutout < sep:
-                    min_cutout = sep
-            # Overload the 'uncertainty' criterion to ensure we get a large enough cutout.
-            for fields in source:
-                assert isinstance(fields, SourceReading)
-                fields.uncertainty_ellipse.a = sep/2.5
-                fields.uncertainty_ellipse.b = sep/2.5
-                fields.uncertainty_ellipse.pa = 0.0 * units.degree
-
-            sources.append(source)
+    def _iter_source_data(self, lines, observations):
+        """
+        Generate the readings of each source from the lines of the source list, sources are separated by blank lines.
 
-        return sources
+        Args:
+          lines: iterable(str)
+            The lines following the source list header.
+          observations: list(Observation)
+            The observations, in the order of the readings of each source.
 
-    def parse(self, filename):
+        Returns:
+          sources: generator(list(SourceReading))
+        """
+        source_obs = []
+        for line in lines:
+            if len(line.strip()) > 0:
+                source_obs.append(line)
+                continue
+            if len(source_obs) > 0:
+                yield self._build_source(source_obs, observations)
+                source_obs = []
+        if len(source_obs) > 0:
+            yield self._build_source(source_obs, observations)
+
+    def _build_source(self, source_obs, observations):
+        assert len(source_obs) == len(
+            observations), ("Source doesn't have same number of observations"
+                            " ({0:d}) as in observations list ({1:d}).".format(len(source_obs), len(observations)))
+
+        fields = numpy.array([source_ob.split() for source_ob in source_obs], dtype='f8')
+        x_ref, y_ref = fields[0, 0], fields[0, 1]
+
+        # Add an ra/dec reference to the source.
+        ref_index = int(math.ceil(len(source_obs) / 2.0)) - 1
+
+        # determine the smallest cutout that will include the reference coordinate and all the readings,
+        # from the separations of all the readings at once.
+        ra = numpy.radians(fields[:, 4])
+        dec = numpy.radians(fields[:, 5])
+        sep = numpy.degrees(angular_separation(ra[ref_index], dec[ref_index], ra, dec).max()) * units.degree
+        # Overload the 'uncertainty' criterion to ensure we get a large enough cutout.
+        size = sep / 2.5
+
+        source = []
+        for i, row in enumerate(fields.tolist()):
+            # Find the observation corresponding to this reading
+            source.append(SourceReading(*(row + [x_ref, y_ref, observations[i]]), dx=size, dy=size))
+        for reading in source:
+            # the reference coordinate is only built if it is asked for.
+            reading.reference_reading = source[ref_index]
+
+        return source
+
+    def _read_header(self, lines):
+        """
+        Read lines up to, and including, the source list header.
+
+        Args:
+          lines: iterator(str)
+            The lines of the file, left positioned at the first source.
+
+        Returns:
+          header: str
+            The header lines of the file.
+        """
+        header = []
+        for line in lines:
+            header.append(line)
+            if self.source_header_reg.match(line):
+                return "\n".join(header)
+        raise AstromFormatError("Could not find the source list")
+
+    def parse(self, filename, stream=False):
         """
         Parses a file into an AstromData structure.
 
         Args:
           filename: str
             The name of the file whose contents will be parsed.
+          stream: bool
+            If True, only the header is read here and the sources of the returned
+            AstromData are a SourceStream that reads the file one source at a time,
+            so memory stays flat however big the file is.
 
         Returns:
           data: AstromData
             The file contents extracted into a data structure for programmatic
             access.
         """
+        if stream:
+            return self._stream(filename)
+
         _loop_count = 0
         while _loop_count < 5:
             try:
@@ -251,6 +286,99 @@ class AstromParser(object):
 
         return AstromData(observations, sys_header, sources, discovery_only=self.discovery_only)
 
+    def _open(self, filename):
+        _loop_count = 0
+        while True:
+            try:
+                filehandle = storage.open_vos_or_local(filename, "rb")
+                assert filehandle is not None, "Failed to open file {} ".format(filename)
+                return filehandle
+            except cadcutils.exceptions.NotFoundException as ex:
+                logger.error(str(ex))
+                raise ex
+            except Exception as ex:
+                logger.warning(str(ex))
+                _loop_count += 1
+                if _loop_count >= 5:
+                    raise ex
+                time.sleep(3)
+
+    def _stream(self, filename):
+        filehandle = self._open(filename)
+        try:
+            header = self._read_header(read_lines(filehandle))
+        finally:
+            filehandle.close()
+        observations = self._parse_observation_list(header)
+        self._parse_observation_headers(header, observations)
+        sys_header = self._parse_system_header(header)
+
+        return AstromData(observations, sys_header,
+                          SourceStream(self, filename, observations, discovery_only=self.discovery_only))
+
+
+def read_lines(filehandle, chunk_size=READ_CHUNK_SIZE):
+    """
+    Generate the lines, without line endings, of a file opened in binary mode, reading chunk_size bytes at a time.
+
+    VOSpace file handles can't be iterated over, but they can be read a chunk at a time.
+    """
+    remainder = b""
+    while True:
+        chunk = filehandle.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8')
+    if len(remainder) > 0:
+        yield remainder.decode('utf-8')
+
+
+class SourceStream(object):
+    """
+    The sources of an astrom file, read from the file one source at a time.
+
+    Each iteration reads the file again, so the sources can be gone over more than once without
+    being held in memory; len() counts them without building their readings.
+    """
+
+    def __init__(self, parser, filename, observations, discovery_only=False):
+        self.parser = parser
+        self.filename = filename
+        self.observations = observations
+        self.discovery_only = discovery_only
+        self._count = None
+
+    def _lines(self):
+        """Generate the lines that follow the header, closing the file when they are exhausted."""
+        filehandle = self.parser._open(self.filename)
+        try:
+            lines = read_lines(filehandle)
+            self.parser._read_header(lines)
+            for line in lines:
+                yield line
+        finally:
+            filehandle.close()
+
+    def __iter__(self):
+        for reading_list in self.parser._iter_source_data(self._lines(), self.observations):
+            yield Source(reading_list, discovery_only=self.discovery_only)
+
+    def __len__(self):
+        if self._count is None:
+            count = 0
+            blank = True
+            for line in self._lines():
+                if len(line.strip()) == 0:
+                    blank = True
+                elif blank:
+                    count += 1
+                    blank = False
+            self._count = count
+        return self._count
+
 
 class StationaryParser(AstromParser):
 
@@ -264,6 +392,12 @@ class StationaryParser(AstromParser):
     def _parse_observation_list(self, filestr):
         pass
 
+    def parse(self, filename, stream=False):
+        """
+        Parses a vetting file into an AstromData structure, vetting files are small and always read whole.
+        """
+        return super(StationaryParser, self).parse(filename)
+
     def _parse_observation_headers(self, filestr, observations):
         """
         This should provide a list of headers that go with the given observation, as read from the input
@@ -502,15 +636,23 @@ class AstromData(object):
             of source readings, one for each observation in
             <code>observations</code>.  By convention the ordering of
             source readings must match the ordering of the observations.
+            If sources is a SourceStream, rather than a list, then so is self.sources and
+            the sources are only built as they are iterated over.
           discovery_only: bool
             should we only use the discovery images on the first pass?
         """
         self.observations = observations
         self.mpc_observations = {}
         self.sys_header = sys_header
-        self.sources = [Source(reading_list, discovery_only=discovery_only) for reading_list in sources]
+        if isinstance(sources, list):
+            self.sources = [Source(reading_list, discovery_only=discovery_only) for reading_list in sources]
+        else:
+            self.sources = sources
 
     def get_reading_count(self):
+        if isinstance(self.sources, SourceStream):
+            # every source has a reading for each observation.
+            return len(self.sources) * len(self.observations)
         count = 0
         for source in self.sources:
             count += source.num_readings()
@@ -640,6 +782,8 @@ class SourceReading(object):
     Data for a detected point source (which is a potential moving objects).
     """
 
+    min_cutout = 0.3 * units.arcminute
+
     def __init__(self, x, y, x0, y0, ra, dec, xref, yref, obs, ssos=False, from_input_file=False,
                  null_observation=False, discovery=False, dx=0, dy=0, pa=0):
         """
@@ -661,12 +805,15 @@ class SourceReading(object):
         """
         # print x, y, x0, y0, ra, dec, xref, yref
         self._pix_coord = None
+        self._pix_xy = None
         if x is not None and y is not None:
             self.pix_coord = x, y
         self._ref_coord = None
+        self._ref_xy = None
         if x0 is not None and y0 is not None:
             self.ref_coord = x0, y0
         self._sky_coord = None
+        self._ra_dec = None
         self.sky_coord = ra, dec
         self.xref = xref
         self.yref = yref
@@ -684,8 +831,8 @@ class SourceReading(object):
         self.discovery = discovery
         self.mpc_observation = None
         self.mpc_observations = {}
-        self.reference_sky_coord = self.sky_coord
-        self.min_cutout = 0.3 * units.arcminute
+        self._reference_sky_coord = None
+        self.reference_reading = None
 
     def _original_frame(self, x, y):
         """
@@ -734,6 +881,8 @@ class SourceReading(object):
         :return: The x,y pixel location of the source in the current frame.
         :rtype: (Quantity, Quantity)
         """
+        if self._pix_coord is None and self._pix_xy is not None:
+            self._pix_coord = self._pix_xy[0] * units.pix, self._pix_xy[1] * units.pix
         return self._pix_coord
 
     @pix_coord.setter
@@ -749,6 +898,11 @@ class SourceReading(object):
         if not isinstance(pix_coord, list) or len(pix_coord) != 2:
             raise ValueError("pix_coord needs to be set with an (x,y) coordinate pair, got {}".format(pix_coord))
         x, y = pix_coord
+        if not isinstance(x, Quantity) and not isinstance(y, Quantity):
+            # the Quantities are only built if pix_coord is asked for.
+            self._pix_xy = float(x), float(y)
+            self._pix_coord = None
+            return
         if not isinstance(x, Quantity):
             x = float(x) * units.pix
         if not isinstance(y, Quantity):
@@ -761,6 +915,8 @@ class SourceReading(object):
         :return: the x coordinate value
         :rtype: float
         """
+        if self._pix_coord is None:
+            return self._pix_xy[0]
         return self.pix_coord[0].value
 
     @property
@@ -769,6 +925,8 @@ class SourceReading(object):
         :return: the y coordinate value
         :rtype: float
         """
+        if self._pix_coord is None:
+            return self._pix_xy[1]
         return self.pix_coord[1].value
 
     @property
@@ -778,6 +936,8 @@ class SourceReading(object):
         :return: The x,y pixel location of the source in the reference frame.
         :rtype: (Quantity, Quantity)
         """
+        if self._ref_coord is None and self._ref_xy is not None:
+            self._ref_coord = self._ref_xy[0] * units.pix, self._ref_xy[1] * units.pix
         return self._ref_coord
 
     @ref_coord.setter
@@ -793,6 +953,10 @@ class SourceReading(object):
         if not isinstance(pix_coord, list) or len(pix_coord) != 2:
             raise ValueError("pix_coord needs to be set with an (x,y) coordinate pair, got {}".format(pix_coord))
         x, y = pix_coord
+        if not isinstance(x, Quantity) and not isinstance(y, Quantity):
+            self._ref_xy = float(x), float(y)
+            self._ref_coord = None
+            return
         if not isinstance(x, Quantity):
             x = float(x) * units.pix
         if not isinstance(y, Quantity):
@@ -801,27 +965,39 @@ class SourceReading(object):
 
     @property
     def x0(self):
+        if self._ref_coord is None:
+            return self._ref_xy[0]
         return self._ref_coord[0].value
 
     @property
     def y0(self):
+        if self._ref_coord is None:
+            return self._ref_xy[1]
         return self._ref_coord[1].value
 
     @property
     def sky_coord(self):
         """
+        Built from the RA/DEC the reading was given on first access, as most readings are never displayed.
 
         :return: the world coordinate longitude location.
         :rtype: astropy.coordinates.SkyCoord
         """
+        if self._sky_coord is None:
+            ra, dec = self._ra_dec
+            self._sky_coord = SkyCoord(ra * units.degree, dec * units.degree, 1)
         return self._sky_coord
 
     @property
     def ra(self):
+        if self._sky_coord is None:
+            return self._ra_dec[0]
         return self.sky_coord.ra.degree
 
     @property
     def dec(self):
+        if self._sky_coord is None:
+            return self._ra_dec[1]
         return self.sky_coord.dec.degree
 
     @sky_coord.setter
@@ -833,13 +1009,31 @@ class SourceReading(object):
         if isinstance(sky_coord, list):
             ra, dec = sky_coord
             if not isinstance(ra, Quantity):
-                ra = float(ra)*units.degree
-                dec = float(dec)*units.degree
+                self._ra_dec = float(ra), float(dec)
+                self._sky_coord = None
+                return
             sky_coord = SkyCoord(ra, dec, 1)
         if not isinstance(sky_coord, SkyCoord):
             raise ValueError("Failed to initialize coordinate using {}".format(sky_coord))
         self._sky_coord = sky_coord
 
+    @property
+    def reference_sky_coord(self):
+        """
+        The coordinate the cutout of this reading is centred on, that of the reference_reading unless set.
+
+        :rtype: astropy.coordinates.SkyCoord
+        """
+        if self._reference_sky_coord is not None:
+            return self._reference_sky_coord
+        if self.reference_reading is not None:
+            return self.reference_reading.sky_coord
+        return self.sky_coord
+
+    @reference_sky_coord.setter
+    def reference_sky_coord(self, sky_coord):
+        self._reference_sky_coord = sky_coord
+
     @property
     def uncertainty_ellipse(self):
         """
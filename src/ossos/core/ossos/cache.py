@@ -0,0 +1,390 @@
+"""
+Persistent, size bounded, caches indexed by an SQLite database.
+
+Used by ossos.storage to keep headers and other small bits of image metadata, and image cutouts, between processes
+so that pipeline steps and GUI sessions do not re-fetch the same values from VOSpace and CADC.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from astropy.io import fits
+
+from .gui import config
+from .gui import logger
+
+CACHE_FILENAME = "ossos_cache.sqlite"
+TILE_INDEX_FILENAME = "tiles.sqlite"
+
+
+class SQLiteStore(object):
+    """
+    Base for the caches, provides a per thread, per process, connection to an SQLite database.
+    """
+
+    schema = []
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.directory = os.path.dirname(filename)
+        self.enabled = True
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """
+        The connection to the cache database, one per thread and process.
+
+        @rtype: sqlite3.Connection
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+        connection = sqlite3.connect(self.filename, timeout=60, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        for statement in self.schema:
+            connection.execute(statement)
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def _execute(self, *args):
+        try:
+            return self.connection.execute(*args)
+        except (sqlite3.Error, OSError) as ex:
+            logger.warning("Disabling persistent cache {}: {}".format(self.filename, ex))
+            self.enabled = False
+            return None
+
+
+class PersistentCache(SQLiteStore):
+    """
+    A key/value store shared by all processes on a host.
+
+    Entries are evicted least-recently-used first once the total size of the stored values exceeds max_size bytes.
+    Entries whose caller provides a way to get the modification date of the source of the value are checked against
+    it on read, at most once every revalidate_interval seconds per key in each process, and dropped when the source
+    has changed.  Other entries, and those whose source can not be reached, are dropped once older than ttl seconds.
+    """
+
+    schema = ["CREATE TABLE IF NOT EXISTS cache ("
+              " key TEXT PRIMARY KEY,"
+              " value BLOB,"
+              " size INTEGER,"
+              " mtime TEXT,"
+              " created REAL,"
+              " accessed REAL)",
+              "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)"]
+
+    def __init__(self, directory=None, max_size=None, ttl=None, revalidate_interval=None):
+        """
+        @param directory: directory to hold the cache database, default is CACHE.DIRECTORY from the config.
+        @param max_size: maximum number of bytes of values to keep in the cache.
+        @param ttl: number of seconds after which an entry that can not be re-validated is dropped.
+        @param revalidate_interval: number of seconds a successful re-validation of an entry is trusted for.
+        """
+        if directory is None:
+            directory = config.read("CACHE.DIRECTORY")
+        if max_size is None:
+            max_size = int(config.read("CACHE.MAX_SIZE_MB")) * 1024 * 1024
+        if ttl is None:
+            ttl = float(config.read("CACHE.TTL"))
+        if revalidate_interval is None:
+            revalidate_interval = float(config.read("CACHE.REVALIDATE_INTERVAL"))
+        super(PersistentCache, self).__init__(os.path.join(os.path.expanduser(directory), CACHE_FILENAME))
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self.revalidate_interval = float(revalidate_interval)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> time the entry was last found to match the modification date of its source, by this process.
+        self._validated = {}
+
+    def get(self, key, default=None, revalidate=None):
+        """
+        Get the value stored in the cache for key.
+
+        @param key: the key the value was stored with, usually a URI.
+        @param default: returned when the key is not in the cache.
+        @param revalidate: callable that returns the current modification date of the source of the value.
+        @return: the cached value or default
+        """
+        if not self.enabled:
+            self.misses += 1
+            return default
+        cursor = self._execute("SELECT value, mtime, created FROM cache WHERE key=?", (key,))
+        row = cursor is not None and cursor.fetchone() or None
+        if row is None:
+            self.misses += 1
+            return default
+        value, mtime, created = row
+        now = time.time()
+        valid = now - created <= self.ttl
+        if revalidate is not None and mtime is not None:
+            if now - self._validated.get(key, 0) <= self.revalidate_interval:
+                valid = True
+            else:
+                current_mtime = None
+                try:
+                    current_mtime = revalidate()
+                except Exception as ex:
+                    logger.debug("Failed to revalidate {}: {}".format(key, ex))
+                if current_mtime is not None:
+                    valid = str(current_mtime) == mtime
+                    if valid:
+                        self._validated[key] = now
+        if not valid:
+            self.invalidate(key)
+            self.misses += 1
+            return default
+        if self._validated.get(key, None) == now:
+            self._execute("UPDATE cache SET created=?, accessed=? WHERE key=?", (now, now, key))
+        else:
+            self._execute("UPDATE cache SET accessed=? WHERE key=?", (now, key))
+        try:
+            value = pickle.loads(value)
+        except Exception as ex:
+            logger.debug("Failed to unpickle cached value for {}: {}".format(key, ex))
+            self.invalidate(key)
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value, mtime=None):
+        """
+        Store value in the cache.
+
+        @param key: the key to store the value under.
+        @param value: a picklable value.
+        @param mtime: the modification date of the source of the value, used to re-validate the entry later.
+        """
+        if not self.enabled:
+            return
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_size:
+            return
+        now = time.time()
+        self._execute("INSERT OR REPLACE INTO cache (key, value, size, mtime, created, accessed) "
+                      "VALUES (?, ?, ?, ?, ?, ?)",
+                      (key, sqlite3.Binary(blob), len(blob), mtime is not None and str(mtime) or None, now, now))
+        if mtime is not None:
+            self._validated[key] = now
+        self._evict()
+
+    def _evict(self):
+        """
+        Drop the least recently accessed entries until the cache is within max_size.
+        """
+        cursor = self._execute("SELECT COALESCE(SUM(size), 0) FROM cache")
+        if cursor is None:
+            return
+        total = cursor.fetchone()[0]
+        if total <= self.max_size:
+            return
+        cursor = self._execute("SELECT key, size FROM cache ORDER BY accessed ASC")
+        if cursor is None:
+            return
+        victims = []
+        for key, size in cursor.fetchall():
+            if total <= self.max_size:
+                break
+            victims.append((key,))
+            total -= size
+        self.connection.executemany("DELETE FROM cache WHERE key=?", victims)
+        self.evictions += len(victims)
+
+    def invalidate(self, key):
+        """
+        Remove key from the cache.
+        """
+        self._validated.pop(key, None)
+        if self.enabled:
+            self._execute("DELETE FROM cache WHERE key=?", (key,))
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        self._validated.clear()
+        if self.enabled:
+            self._execute("DELETE FROM cache")
+
+    def __contains__(self, key):
+        if not self.enabled:
+            return False
+        cursor = self._execute("SELECT 1 FROM cache WHERE key=?", (key,))
+        return cursor is not None and cursor.fetchone() is not None
+
+    def stats(self):
+        """
+        Counters describing the use of the cache by this process.
+
+        @return: dict with hits, misses, evictions, entries and size (bytes)
+        """
+        entries = size = 0
+        if self.enabled:
+            cursor = self._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache")
+            if cursor is not None:
+                entries, size = cursor.fetchone()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': entries,
+                'size': size}
+
+
+class TileCache(SQLiteStore):
+    """
+    An on-disk cache of image cutouts (tiles), evicted least-recently-used within a size budget.
+
+    Each tile is a single image extension cut from an image in VOSpace, stored as a FITS file named by the SHA1 of
+    the image URI, extension and pixel bounding box.  The index records the bounding box and header of each tile so
+    that callers can find a tile that contains the region they need without opening the FITS files.
+    """
+
+    schema = ["CREATE TABLE IF NOT EXISTS tiles ("
+              " key TEXT PRIMARY KEY,"
+              " image_uri TEXT,"
+              " extno INTEGER,"
+              " x1 INTEGER, x2 INTEGER, y1 INTEGER, y2 INTEGER,"
+              " header TEXT,"
+              " size INTEGER,"
+              " accessed REAL)",
+              "CREATE INDEX IF NOT EXISTS tiles_image_uri ON tiles (image_uri)",
+              "CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)"]
+
+    def __init__(self, directory=None, max_size=None):
+        """
+        @param directory: where to keep the tiles, default is CUTOUTS.TILE_CACHE.DIRECTORY from the config.
+        @param max_size: maximum number of bytes of tiles to keep.
+        """
+        if directory is None:
+            directory = config.read("CUTOUTS.TILE_CACHE.DIRECTORY")
+        if max_size is None:
+            max_size = int(config.read("CUTOUTS.TILE_CACHE.MAX_SIZE_MB")) * 1024 * 1024
+        super(TileCache, self).__init__(os.path.join(os.path.expanduser(directory), TILE_INDEX_FILENAME))
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _tile_filename(self, key):
+        return os.path.join(self.directory, "{}.fits".format(key))
+
+    def add(self, image_uri, hdu):
+        """
+        Store an image extension as a tile of image_uri.
+
+        The XOFFSET/YOFFSET keywords of the header give the position of the tile in the original image.
+
+        @param image_uri: the URI of the image the tile was cut from.
+        @param hdu: the cutout image extension.
+        @return: the key of the tile, None if the tile was not stored.
+        """
+        if not self.enabled or hdu.data is None:
+            return None
+        header = hdu.header
+        x1 = int(header.get('XOFFSET', 0)) + 1
+        y1 = int(header.get('YOFFSET', 0)) + 1
+        x2 = x1 + int(header['NAXIS1']) - 1
+        y2 = y1 + int(header['NAXIS2']) - 1
+        extno = int(header.get('EXTNO', 0))
+        key = hashlib.sha1("{}[{}][{}:{},{}:{}]".format(image_uri, extno, x1, x2, y1, y2).encode('utf-8')).hexdigest()
+        filename = self._tile_filename(key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, exist_ok=True)
+            partial = "{}.{}.part".format(filename, os.getpid())
+            fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data=hdu.data, header=header)]).writeto(partial,
+                                                                                                 overwrite=True)
+            os.rename(partial, filename)
+        except Exception as ex:
+            logger.warning("Failed to write cutout tile for {}: {}".format(image_uri, ex))
+            return None
+        self._execute("INSERT OR REPLACE INTO tiles (key, image_uri, extno, x1, x2, y1, y2, header, size, accessed) "
+                      "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                      (key, image_uri, extno, x1, x2, y1, y2, header.tostring(), os.path.getsize(filename),
+                       time.time()))
+        self._evict()
+        return key
+
+    def tiles(self, image_uri):
+        """
+        The tiles stored for image_uri, most recently used first.
+
+        @param image_uri: the URI of the image.
+        @return: list of (key, header) pairs.
+        """
+        if not self.enabled:
+            return []
+        cursor = self._execute("SELECT key, header FROM tiles WHERE image_uri=? ORDER BY accessed DESC",
+                               (image_uri,))
+        if cursor is None:
+            return []
+        return [(key, fits.Header.fromstring(header)) for key, header in cursor.fetchall()]
+
+    def open(self, key):
+        """
+        Open a stored tile, marking it as used.
+
+        @param key: the key of the tile, from tiles()
+        @return: the tile, None if it is no longer on disk.
+        @rtype: fits.HDUList
+        """
+        filename = self._tile_filename(key)
+        try:
+            hdulist = fits.open(filename, lazy_load_hdus=False)
+        except Exception as ex:
+            logger.debug("Tile {} unreadable, dropping: {}".format(key, ex))
+            self._execute("DELETE FROM tiles WHERE key=?", (key,))
+            return None
+        self._execute("UPDATE tiles SET accessed=? WHERE key=?", (time.time(), key))
+        return hdulist
+
+    def _evict(self):
+        """
+        Remove the least recently used tiles until the cache is within max_size.
+        """
+        cursor = self._execute("SELECT COALESCE(SUM(size), 0) FROM tiles")
+        if cursor is None:
+            return
+        total = cursor.fetchone()[0]
+        if total <= self.max_size:
+            return
+        cursor = self._execute("SELECT key, size FROM tiles ORDER BY accessed ASC")
+        if cursor is None:
+            return
+        for key, size in cursor.fetchall():
+            if total <= self.max_size:
+                break
+            self._execute("DELETE FROM tiles WHERE key=?", (key,))
+            try:
+                os.unlink(self._tile_filename(key))
+            except OSError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Counters describing the use of the tile cache by this process.
+
+        @return: dict with hits, misses, evictions, entries and size (bytes)
+        """
+        entries = size = 0
+        if self.enabled:
+            cursor = self._execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tiles")
+            if cursor is not None:
+                entries, size = cursor.fetchone()
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': entries,
+                'size': size}
@@ -1,6 +1,7 @@
 import math
 import Polygon
 import logging
+import numpy
 from matplotlib import pyplot
 
 from astropy import units
@@ -313,6 +314,43 @@ class Camera:
                 ccds.append([xcen, ycen, rad])
         return ccds
 
+    @classmethod
+    def coverage(cls, ra, dec, target_ra, target_dec, camera="MEGACAM_40"):
+        """
+        Which targets land on the camera for each of many pointings, computed with arrays rather than polygons.
+
+        The CCD rectangles are those of Camera.geometry for a camera with origin (ra, dec).
+
+        @param ra: RA of the origin of each pointing (degrees), shape (npointing,)
+        @param dec: DEC of the origin of each pointing (degrees), shape (npointing,)
+        @param target_ra: RA of each target (degrees), shape (ntarget,)
+        @param target_dec: DEC of each target (degrees), shape (ntarget,)
+        @param camera: name of the camera geometry to use.
+        @return: boolean array of shape (npointing, ntarget), True where the target is on a CCD.
+        """
+        geometry = cls._geometry[camera]
+        if any('rad' in geo for geo in geometry):
+            raise NotImplementedError("Coverage of circular fields is not supported: {}".format(camera))
+        offset_ra = numpy.array([geo['ra'] for geo in geometry])
+        offset_dec = numpy.array([geo['dec'] for geo in geometry])
+        width = numpy.array([geo['dra'] for geo in geometry])
+        height = numpy.array([geo['ddec'] for geo in geometry])
+
+        # corners of each CCD for each pointing, shape (npointing, nccd), computed as in geometry.
+        ycen = offset_dec + (numpy.asarray(dec, dtype='float64') + 45.0 / 3600.0)[:, None]
+        cos_ycen = numpy.cos(numpy.radians(ycen))
+        xcen = offset_ra / cos_ycen + numpy.asarray(ra, dtype='float64')[:, None]
+        dx = width / cos_ycen
+
+        target_ra = numpy.asarray(target_ra, dtype='float64')
+        target_dec = numpy.asarray(target_dec, dtype='float64')
+        # RA offset of each target from each CCD centre, wrapped into [-180, 180) so fields straddling RA=0 work.
+        dra = (target_ra - xcen[:, :, None] + 180.0) % 360.0 - 180.0
+        inside = ((numpy.fabs(dra) <= (dx / 2.0)[:, :, None]) &
+                  (target_dec >= (ycen - height / 2.0)[:, :, None]) &
+                  (target_dec <= (ycen + height / 2.0)[:, :, None]))
+        return inside.any(axis=1)
+
     def plot(self, facecolor='none', edgecolor='k', alpha=0.5):
         for ccd in self.geometry:
             print(ccd)
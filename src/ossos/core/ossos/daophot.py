@@ -1,16 +1,40 @@
 __author__ = "David Rusk <drusk@uvic.ca>"
 import logging
+import math
 import os
 os.environ['PYRAF_NO_CLCACHE'] = "True"
 import tempfile
 import warnings
 warnings.simplefilter("ignore")
+from .gui import config
 from .gui import logger
-from stsci.tools import capable
-capable.OF_GRAPHICS = False
-from pyraf import iraf
+try:
+    from stsci.tools import capable
+    capable.OF_GRAPHICS = False
+    from pyraf import iraf
+except ImportError:
+    # the numpy backend does not need IRAF.
+    iraf = None
+import numpy
 from astropy.io import fits
 from astropy.io import ascii
+from astropy.table import MaskedColumn, Table
+
+IRAF = 'iraf'
+NUMPY = 'numpy'
+
+# error codes reported in the CIER, SIER and PIER columns, as IRAF apphot.
+CTR_OUTOFBOUNDS = 102
+CTR_BADSHIFT = 106
+SKY_NOSKYAREA = 201
+SKY_OUTOFBOUNDS = 202
+APERT_OUTOFBOUNDS = 302
+APERT_BADDATA = 303
+APERT_NOSKYMODE = 304
+APERT_NEGMAG = 305
+
+# positions are measured in chunks of this many, to bound the memory used for the pixel stamps.
+CHUNK_SIZE = 1024
 
 
 class TaskError(Exception):
@@ -18,7 +42,7 @@ class TaskError(Exception):
 
 
 def phot(fits_filename, x_in, y_in, aperture=15, sky=20, swidth=10, apcor=0.3,
-         maxcount=30000.0, exptime=1.0, zmag=None, extno=0, centroid=True):
+         maxcount=30000.0, exptime=1.0, zmag=None, extno=0, centroid=True, backend=None):
     """
     Compute the centroids and magnitudes of a bunch sources  on fits image.
 
@@ -43,6 +67,7 @@ def phot(fits_filename, x_in, y_in, aperture=15, sky=20, swidth=10, apcor=0.3,
     :type exptime: float
     :param zmag: zeropoint magnitude
     :param extno: extension of fits_filename the x/y location refers to.
+    :param backend: 'iraf' to run IRAF phot or 'numpy' to measure in process, default is DAOPHOT.BACKEND from the config.
     """
     if not hasattr(x_in, '__iter__'):
         x_in = [x_in, ]
@@ -92,6 +117,38 @@ def phot(fits_filename, x_in, y_in, aperture=15, sky=20, swidth=10, apcor=0.3,
         logger.warning(("zmag sent to daophot: ({}) "
                         "doesn't match PHOTZP value in image header: ({})".format(zmag, photzp)))
 
+    if backend is None:
+        backend = config.read("DAOPHOT.BACKEND")
+    if backend == NUMPY:
+        pdump_out = phot_numpy(input_hdulist[extno].data, x_in, y_in, aperture=aperture, sky=sky, swidth=swidth,
+                               zmag=zmag, maxcount=maxcount, exptime=exptime, centroid=centroid)
+    elif backend == IRAF:
+        pdump_out = _phot_iraf(fits_filename, x_in, y_in, aperture=aperture, sky=sky, swidth=swidth,
+                               zmag=zmag, maxcount=maxcount, exptime=exptime, extno=extno, centroid=centroid)
+    else:
+        raise ValueError("Unknown photometry backend: {}".format(backend))
+
+    # apply the aperture correction
+    pdump_out['MAG'] -= apcor
+
+    # if pdump_out['PIER'][0] != 0 or pdump_out['SIER'][0] != 0 or pdump_out['CIER'][0] != 0:
+    #    raise ValueError("Photometry failed:\n {}".format(pdump_out))
+
+    logger.debug("Computed aperture photometry on {} objects in {}".format(len(pdump_out), fits_filename))
+
+    del input_hdulist
+    return pdump_out
+
+
+def _phot_iraf(fits_filename, x_in, y_in, aperture, sky, swidth, zmag, maxcount, exptime, extno, centroid):
+    """
+    Run the IRAF phot task on the given positions.
+
+    :rtype : astropy.table.Table
+    """
+    if iraf is None:
+        raise TaskError("pyraf is not available, use the numpy photometry backend.")
+
     # setup IRAF to do the magnitude/centroid measurements
     iraf.set(uparm="./")
     iraf.digiphot()
@@ -146,24 +203,317 @@ def phot(fits_filename, x_in, y_in, aperture=15, sky=20, swidth=10, apcor=0.3,
         mag_content = open(magfile.name).read()
         raise TaskError("photometry failed. {}".format(mag_content))
 
-    # apply the aperture correction
-    pdump_out['MAG'] -= apcor
-
-    # if pdump_out['PIER'][0] != 0 or pdump_out['SIER'][0] != 0 or pdump_out['CIER'][0] != 0:
-    #    raise ValueError("Photometry failed:\n {}".format(pdump_out))
-
     # Clean up temporary files generated by IRAF
     os.remove(coofile.name)
     os.remove(magfile.name)
-    logger.debug("Computed aperture photometry on {} objects in {}".format(len(pdump_out), fits_filename))
-
-    del input_hdulist
     return pdump_out
 
 
+def _stamps(data, x, y, half_width):
+    """
+    Cut a square box of pixels centred on the pixel nearest each position.
+
+    :param data: the image.
+    :param x: 1-based x pixel positions (numpy.array)
+    :param y: 1-based y pixel positions (numpy.array)
+    :param half_width: the boxes are 2 * half_width + 1 pixels on a side.
+    :return: values, inside, columns, rows; values of the pixels in each box (n, m, m), mask of which of those
+    are on the image and the 1-based pixel coordinates of the box columns (n, 1, m) and rows (n, m, 1).
+    """
+    offsets = numpy.arange(-half_width, half_width + 1)
+    columns = numpy.round(x).astype(int)[:, None, None] + offsets[None, None, :]
+    rows = numpy.round(y).astype(int)[:, None, None] + offsets[None, :, None]
+    inside = (columns >= 1) & (columns <= data.shape[1]) & (rows >= 1) & (rows <= data.shape[0])
+    values = data[numpy.clip(rows, 1, data.shape[0]) - 1, numpy.clip(columns, 1, data.shape[1]) - 1]
+    return numpy.where(inside, values, 0).astype('float64'), inside, columns, rows
+
+
+def _centroid(data, x, y, cbox, maxshift, maxiter=10):
+    """
+    Centroid each position with the mean of the marginal distributions above their mean, as IRAF 'centroid'.
+
+    :return: x, y, cier
+    """
+    half_width = int(cbox / 2)
+    xc = x.copy()
+    yc = y.copy()
+    cier = numpy.zeros(len(x), dtype=int)
+    for _ in range(maxiter):
+        values, inside, columns, rows = _stamps(data, xc, yc, half_width)
+        cier[~inside.all(axis=(1, 2))] = CTR_OUTOFBOUNDS
+        x_marginal = values.sum(axis=1)
+        y_marginal = values.sum(axis=2)
+        x_marginal = numpy.clip(x_marginal - x_marginal.mean(axis=1, keepdims=True), 0, None)
+        y_marginal = numpy.clip(y_marginal - y_marginal.mean(axis=1, keepdims=True), 0, None)
+        x_weight = x_marginal.sum(axis=1)
+        y_weight = y_marginal.sum(axis=1)
+        good = (x_weight > 0) & (y_weight > 0)
+        x_weight[~good] = 1
+        y_weight[~good] = 1
+        new_x = numpy.where(good, (x_marginal * columns[:, 0, :]).sum(axis=1) / x_weight, xc)
+        new_y = numpy.where(good, (y_marginal * rows[:, :, 0]).sum(axis=1) / y_weight, yc)
+        converged = (numpy.fabs(new_x - xc) < 0.01) & (numpy.fabs(new_y - yc) < 0.01)
+        xc, yc = new_x, new_y
+        if converged.all():
+            break
+    bad_shift = numpy.hypot(xc - x, yc - y) > maxshift
+    xc[bad_shift] = x[bad_shift]
+    yc[bad_shift] = y[bad_shift]
+    cier[bad_shift] = CTR_BADSHIFT
+    return xc, yc, cier
+
+
+def _sky(data, x, y, sky, swidth, datamin, datamax, loclip=5.0, hiclip=5.0, kreject=3.0, maxreject=50):
+    """
+    Estimate the sky in an annulus around each position as the mode (3 median - 2 mean) of the pixels
+    left after clipping the loclip/hiclip percent tails and rejecting kreject sigma outliers, as IRAF 'mode'.
+
+    :return: msky, stdev, nsky, nsrej, sier
+    """
+    values, inside, columns, rows = _stamps(data, x, y, int(math.ceil(sky + swidth)) + 1)
+    radius = numpy.hypot(columns - x[:, None, None], rows - y[:, None, None])
+    in_annulus = (radius >= sky) & (radius <= sky + swidth)
+    good = inside & in_annulus & (values >= datamin) & (values <= datamax)
+    sier = numpy.where((in_annulus & ~inside).any(axis=(1, 2)), SKY_OUTOFBOUNDS, 0)
+
+    pixels = numpy.sort(numpy.where(good, values, numpy.nan).reshape(len(x), -1), axis=1)
+    npix = good.reshape(len(x), -1).sum(axis=1)
+    index = numpy.arange(pixels.shape[1])[None, :]
+    low = numpy.floor(npix * loclip / 100.0)[:, None]
+    high = (npix - numpy.floor(npix * hiclip / 100.0))[:, None]
+    pixels[(index < low) | (index >= high)] = numpy.nan
+    nclipped = (~numpy.isnan(pixels)).sum(axis=1)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for _ in range(maxreject):
+            mean = numpy.nanmean(pixels, axis=1)
+            median = numpy.nanmedian(pixels, axis=1)
+            stdev = numpy.nanstd(pixels, axis=1)
+            msky = numpy.where(mean < median, mean, 3.0 * median - 2.0 * mean)
+            reject = numpy.fabs(pixels - msky[:, None]) > kreject * stdev[:, None]
+            if not reject.any():
+                break
+            pixels[reject] = numpy.nan
+    nsky = (~numpy.isnan(pixels)).sum(axis=1)
+    sier = numpy.where(nsky == 0, SKY_NOSKYAREA, sier)
+    return msky, stdev, nsky, nclipped - nsky, sier
+
+
+def phot_numpy(data, x_in, y_in, aperture=15, sky=20, swidth=10, zmag=26.0, maxcount=30000.0, exptime=1.0,
+               centroid=True, datamin=-100, epadu=1.0, cbox=5.0, maxshift=2.0):
+    """
+    Measure aperture photometry of many positions at once, following the algorithms of IRAF phot as
+    configured by phot(): centroid centering, mode sky and circular apertures with partial pixels.
+
+    :rtype : astropy.table.Table
+    :param data: the image, may be memory mapped, only the pixels around each source are read.
+    :param x_in: 1-based x locations of the sources.
+    :param y_in: 1-based y locations of the sources.
+    :param aperture: radius of circular aperture to use.
+    :param sky: radius of inner sky annulus
+    :param swidth: width of the sky annulus
+    :param zmag: zeropoint magnitude
+    :param maxcount: maximum linearity in the image.
+    :param exptime: exposure time, relative to zmag supplied
+    :param centroid: centroid the positions before measuring?
+    :param datamin: minimum good pixel value.
+    :param epadu: gain, electrons per ADU.
+    :return: table with the columns of the IRAF phot output (XCENTER, YCENTER, MSKY, MAG, MERR, PIER ...)
+    """
+    x_in = numpy.atleast_1d(numpy.array(x_in, dtype='float64'))
+    y_in = numpy.atleast_1d(numpy.array(y_in, dtype='float64'))
+    columns = dict((name, []) for name in ['XCENTER', 'YCENTER', 'CIER', 'MSKY', 'STDEV', 'NSKY', 'NSREJ',
+                                           'SIER', 'SUM', 'AREA', 'FLUX', 'MAG', 'MERR', 'PIER'])
+    for start in range(0, len(x_in), CHUNK_SIZE):
+        x = x_in[start:start + CHUNK_SIZE]
+        y = y_in[start:start + CHUNK_SIZE]
+        if centroid:
+            x, y, cier = _centroid(data, x, y, cbox, maxshift)
+        else:
+            cier = numpy.zeros(len(x), dtype=int)
+        msky, stdev, nsky, nsrej, sier = _sky(data, x, y, sky, swidth, datamin, maxcount)
+
+        values, inside, cols, rows = _stamps(data, x, y, int(math.ceil(aperture)) + 1)
+        radius = numpy.hypot(cols - x[:, None, None], rows - y[:, None, None])
+        weight = numpy.clip(aperture + 0.5 - radius, 0, 1)
+        in_aperture = weight > 0
+        weight = numpy.where(inside, weight, 0)
+        total = (weight * values).sum(axis=(1, 2))
+        area = weight.sum(axis=(1, 2))
+        flux = total - area * numpy.where(nsky > 0, msky, 0)
+
+        pier = numpy.zeros(len(x), dtype=int)
+        pier[(in_aperture & ~inside).any(axis=(1, 2))] = APERT_OUTOFBOUNDS
+        pier[(in_aperture & inside & ((values > maxcount) | (values < datamin))).any(axis=(1, 2))] = APERT_BADDATA
+        pier[nsky == 0] = APERT_NOSKYMODE
+        pier[(pier == 0) & (flux <= 0)] = APERT_NEGMAG
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mag = zmag - 2.5 * numpy.log10(flux / exptime)
+            error = numpy.sqrt(flux / epadu + area * stdev ** 2 + area ** 2 * stdev ** 2 / nsky)
+            merr = 1.0857 * error / flux
+
+        for name, value in (('XCENTER', x), ('YCENTER', y), ('CIER', cier), ('MSKY', msky), ('STDEV', stdev),
+                            ('NSKY', nsky), ('NSREJ', nsrej), ('SIER', sier), ('SUM', total), ('AREA', area),
+                            ('FLUX', flux), ('MAG', mag), ('MERR', merr), ('PIER', pier)):
+            columns[name].append(value)
+
+    table = Table()
+    table['ID'] = numpy.arange(1, len(x_in) + 1)
+    table['XINIT'] = x_in
+    table['YINIT'] = y_in
+    for name in ['XCENTER', 'YCENTER']:
+        table[name] = numpy.concatenate(columns[name])
+    table['XSHIFT'] = table['XCENTER'] - table['XINIT']
+    table['YSHIFT'] = table['YCENTER'] - table['YINIT']
+    for name in ['CIER', 'MSKY', 'STDEV', 'NSKY', 'NSREJ', 'SIER']:
+        table[name] = numpy.concatenate(columns[name])
+    table['ITIME'] = numpy.ones(len(x_in)) * exptime
+    table['RAPERT'] = numpy.ones(len(x_in)) * aperture
+    for name in ['SUM', 'AREA', 'FLUX']:
+        table[name] = numpy.concatenate(columns[name])
+    pier = numpy.concatenate(columns['PIER'])
+    # IRAF reports INDEF magnitudes for failed measurements.
+    for name in ['MAG', 'MERR']:
+        table[name] = MaskedColumn(numpy.concatenate(columns[name]), mask=pier != 0)
+    table['PIER'] = pier
+    return table
+
+
 def phot_mag(*args, **kwargs):
     """Wrapper around phot which only returns the computed magnitude directly."""
     try:
         return phot(*args, **kwargs)
     except IndexError:
         raise TaskError("No photometric records returned for {0}".format(kwargs))
+
+
+class PSF(object):
+    """
+    A PSF written by IRAF daophot.psf: an analytic function plus a lookup table of corrections,
+    sampled every half pixel, that may vary linearly or quadratically across the image.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the psf.fits file to read.
+        """
+        with fits.open(filename) as hdulist:
+            header = hdulist[0].header
+            table = numpy.array(hdulist[0].data, dtype='float64') if hdulist[0].data is not None else None
+        self.function = header['FUNCTION'].strip().lower()
+        self.height = float(header['PSFHEIGH'])
+        self.mag = float(header['PSFMAG'])
+        self.radius = float(header['PSFRAD'])
+        self.xpsf = float(header['XPSF'])
+        self.ypsf = float(header['YPSF'])
+        self.varorder = int(header.get('VARORDER', -1))
+        self.par = []
+        while 'PAR{}'.format(len(self.par) + 1) in header:
+            self.par.append(float(header['PAR{}'.format(len(self.par) + 1)]))
+        if self.varorder < 0 or table is None:
+            self.table = None
+        else:
+            self.table = table.reshape((-1,) + table.shape[-2:])
+
+    def profile(self, dx, dy):
+        """
+        Evaluate the analytic function, normalized to 1 at its peak, whose parameters PAR1 and PAR2 are
+        the half-width at half maximum in x and y.
+
+        For lorentz and the moffats PAR3 (if present) is the cross term. The penny functions are a
+        Gaussian core on Lorentzian wings: PAR3 is the fraction of the peak in the wings and PAR4 the
+        cross term of the core; penny2 also tilts the wings, by the cross term PAR5.
+        """
+        rsq = (dx / self.par[0]) ** 2 + (dy / self.par[1]) ** 2
+        if self.function in ['penny1', 'penny2']:
+            wings = rsq
+            if self.function == 'penny2':
+                wings = wings + dx * dy * self.par[4]
+            core = rsq + dx * dy * self.par[3]
+            return (1.0 - self.par[2]) * numpy.exp(-math.log(2.0) * core) + self.par[2] / (1.0 + wings)
+        if len(self.par) > 2:
+            rsq = rsq + dx * dy * self.par[2]
+        if self.function == 'gauss':
+            return numpy.exp(-math.log(2.0) * rsq)
+        if self.function == 'lorentz':
+            return 1.0 / (1.0 + rsq)
+        if self.function in ['moffat15', 'moffat25']:
+            beta = {'moffat15': 1.5, 'moffat25': 2.5}[self.function]
+            return (1.0 + (2.0 ** (1.0 / beta) - 1.0) * rsq) ** -beta
+        raise ValueError("Unsupported PSF function: {}".format(self.function))
+
+    def evaluate(self, dx, dy, x, y, nsub=4):
+        """
+        Compute the PSF of a star of magnitude PSFMAG in each pixel.
+
+        The analytic function is integrated over the pixel on an nsub x nsub grid, the lookup table
+        is interpolated bicubically at the pixel centre.
+
+        :param dx: offset of the pixel centres from the star in x, shape (n, m, m).
+        :param dy: offset of the pixel centres from the star in y, shape (n, m, m).
+        :param x: x location of each of the n stars, for a variable PSF.
+        :param y: y location of each of the n stars, for a variable PSF.
+        :param nsub: number of sub-pixel samples along each axis.
+        """
+        from scipy import ndimage
+
+        steps = (numpy.arange(nsub) + 0.5) / nsub - 0.5
+        value = numpy.zeros(numpy.broadcast(dx, dy).shape)
+        for sx in steps:
+            for sy in steps:
+                value += self.profile(dx + sx, dy + sy)
+        value *= self.height / nsub ** 2
+
+        if self.table is None:
+            return value
+        centre_y = (self.table.shape[1] - 1) / 2.0
+        centre_x = (self.table.shape[2] - 1) / 2.0
+        coordinates = numpy.array([centre_y + 2.0 * dy.ravel(), centre_x + 2.0 * dx.ravel()])
+        xn = (numpy.asarray(x, dtype='float64') - self.xpsf) / self.xpsf
+        yn = (numpy.asarray(y, dtype='float64') - self.ypsf) / self.ypsf
+        terms = [numpy.ones(len(xn)), xn, yn, xn ** 2, xn * yn, yn ** 2]
+        for plane, term in zip(self.table, terms):
+            correction = ndimage.map_coordinates(plane, coordinates, order=3, mode='constant', cval=0.0)
+            value += term[:, None, None] * correction.reshape(value.shape)
+        return value
+
+
+def add_stars(data, psf, x, y, mag, epadu=1.0, noise=True, chunk_size=256, rng=None):
+    """
+    Add stars to an image, as IRAF daophot.addstar.
+
+    :param data: the image (float), modified in place.
+    :param psf: the PSF to add.
+    :type psf: PSF
+    :param x: 1-based x locations of the stars.
+    :param y: 1-based y locations of the stars.
+    :param mag: magnitudes of the stars, on the same scale as the PSF magnitude.
+    :param epadu: gain used to compute the Poisson noise of the added flux.
+    :param noise: add Poisson noise to the added flux?
+    :param chunk_size: number of stars to evaluate at once.
+    :param rng: numpy.random.Generator used for the noise, default is an unseeded one.
+    :return: the image
+    """
+    if rng is None:
+        rng = numpy.random.default_rng()
+    x = numpy.atleast_1d(numpy.array(x, dtype='float64'))
+    y = numpy.atleast_1d(numpy.array(y, dtype='float64'))
+    scale = 10 ** (-0.4 * (numpy.atleast_1d(numpy.array(mag, dtype='float64')) - psf.mag))
+    half_width = int(psf.radius)
+    offsets = numpy.arange(-half_width, half_width + 1)
+    for start in range(0, len(x), chunk_size):
+        xc = x[start:start + chunk_size]
+        yc = y[start:start + chunk_size]
+        columns = numpy.round(xc).astype(int)[:, None, None] + offsets[None, None, :]
+        rows = numpy.round(yc).astype(int)[:, None, None] + offsets[None, :, None]
+        dx, dy = numpy.broadcast_arrays(columns - xc[:, None, None], rows - yc[:, None, None])
+        value = scale[start:start + chunk_size, None, None] * psf.evaluate(dx, dy, xc, yc)
+        inside = ((columns >= 1) & (columns <= data.shape[1]) & (rows >= 1) & (rows <= data.shape[0]) &
+                  (dx ** 2 + dy ** 2 <= psf.radius ** 2))
+        if noise:
+            value = numpy.where(value > 0, rng.poisson(numpy.clip(value, 0, None) * epadu) / epadu, value)
+        rows, columns = numpy.broadcast_arrays(rows, columns)
+        numpy.add.at(data, (rows[inside] - 1, columns[inside] - 1), value[inside])
+    return data
@@ -1,10 +1,24 @@
 __author__ = "David Rusk <drusk@uvic.ca>"
-import queue
+import bisect
+import heapq
+import itertools
 import threading
+import time
+
 from ..gui import logger
 from ..gui import config
 
-MAX_THREADS = config.read('APP.MAX_THREADS')
+MAX_THREADS = int(config.read('APP.MAX_THREADS'))
+# workers kept free of prefetching, so the source being looked at never waits behind it.
+RESERVED_THREADS = int(config.read('APP.RESERVED_THREADS'))
+
+# lower numbers are downloaded first.
+CURRENT_PRIORITY = 0
+PREFETCH_PRIORITY = 100
+
+# upper bounds of the histogram buckets.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
 
 
 class AsynchronousDownloadManager(object):
@@ -13,7 +27,7 @@ class AsynchronousDownloadManager(object):
     the application.
     """
 
-    def __init__(self, downloader, error_handler):
+    def __init__(self, downloader, error_handler, max_threads=None, reserved_threads=None):
         """
         Constructor.
 
@@ -22,26 +36,91 @@ class AsynchronousDownloadManager(object):
             Downloads images.
           error_handler:
             Handles errors that occur when trying to download resources.
+          max_threads: int
+            Number of download workers, defaults to APP.MAX_THREADS.
+          reserved_threads: int
+            Number of workers that only take requests at CURRENT_PRIORITY,
+            defaults to APP.RESERVED_THREADS.
         """
         self.downloader = downloader
         self.error_handler = error_handler
+        self.max_threads = max_threads is None and MAX_THREADS or max_threads
+        if reserved_threads is None:
+            reserved_threads = RESERVED_THREADS
 
-        self._work_queue = queue.PriorityQueue()
+        self._work_queue = DownloadQueue(max(1, self.max_threads - reserved_threads))
 
         self._workers = []
         self._maximize_workers()
 
-    def submit_request(self, request, priority=100):
-        self._work_queue.put((priority, request))
+    def submit_request(self, request, priority=PREFETCH_PRIORITY):
+        self._work_queue.put(request, priority)
+        self._maximize_workers()
+
+    def focus_on(self, readings, stale_readings=()):
+        """
+        Download the images of the readings being looked at before anything else.
+
+        Args:
+          readings: iterable(SourceReading)
+            Readings whose requests move up to CURRENT_PRIORITY, including any
+            that were cancelled as stale earlier.
+          stale_readings: iterable(SourceReading)
+            Readings the user has moved past, their queued requests are cancelled.
+        """
+        cancelled = self._work_queue.cancel(set(stale_readings))
+        if cancelled > 0:
+            logger.debug("Cancelled %d stale download requests" % cancelled)
+        self._work_queue.prioritize(set(readings), CURRENT_PRIORITY)
         self._maximize_workers()
 
+    def forget_cancelled(self):
+        """
+        Drop the requests cancelled as stale, once their readings won't be looked at again.
+        """
+        forgotten = self._work_queue.forget_cancelled()
+        if forgotten > 0:
+            logger.debug("Forgot %d cancelled download requests" % forgotten)
+
+    def get_statistics(self):
+        """
+        Returns:
+          statistics: dict
+            Current queue depth and number of downloads running, histograms of
+            the queue depth seen by each request and of the seconds requests
+            waited in the queue and took to download, and counts of cancelled
+            and de-duplicated requests.
+        """
+        return self._work_queue.get_statistics()
+
     def stop_download(self):
         for worker in self._workers:
             worker.stop()
+        self._work_queue.wake()
+
+    def wait_for_downloads_to_stop(self, timeout=None):
+        """
+        Block until the stopped workers have finished the downloads they were doing.
 
-    def wait_for_downloads_to_stop(self):
-        while not self._all_workers_stopped():
-            pass
+        Args:
+          timeout: float
+            Seconds to wait, None to wait as long as it takes.
+
+        Returns:
+          stopped: bool
+            True if all the workers have stopped.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for worker in self._workers:
+            if not worker.is_stopping():
+                continue
+            if deadline is None:
+                worker.join()
+            else:
+                worker.join(max(0, deadline - time.time()))
+        return self._all_workers_stopped()
 
     def refresh_vos_client(self):
         self.downloader.refresh_vos_client()
@@ -49,7 +128,8 @@ class AsynchronousDownloadManager(object):
     def _maximize_workers(self):
         self._prune_dead_workers()
 
-        while len(self._workers) < MAX_THREADS:
+        # workers that were stopped stay listed until they finish, so they can be waited for.
+        while len([worker for worker in self._workers if not worker.is_stopping()]) < self.max_threads:
             worker = DownloadThread(self._work_queue, self.downloader,
                                     self.error_handler)
             worker.daemon = True  # Thread quits when application does
@@ -70,6 +150,239 @@ class AsynchronousDownloadManager(object):
         return True
 
 
+class Histogram(object):
+    """
+    Counts of values in fixed buckets.
+    """
+
+    def __init__(self, bounds):
+        """
+        Args:
+          bounds: list(float)
+            Upper bounds of the buckets, values above the last go in an overflow bucket.
+        """
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """
+        Returns:
+          bound: float
+            Upper bound of the bucket holding the given fraction of the values, the
+            largest value seen if that is in the overflow bucket, None if nothing was recorded.
+        """
+        if self.total == 0:
+            return None
+        running = 0
+        for bound, count in zip(self.bounds, self.counts):
+            running += count
+            if running >= fraction * self.total:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        buckets = ["<={}".format(bound) for bound in self.bounds] + [">{}".format(self.bounds[-1])]
+        return {'buckets': dict(zip(buckets, self.counts)),
+                'count': self.total,
+                'mean': self.sum / self.total if self.total > 0 else None,
+                'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9),
+                'max': self.max}
+
+
+class DownloadQueue(object):
+    """
+    The requests waiting for a DownloadThread, highest priority first and in the
+    order they were submitted within a priority.
+
+    Requests for the same cutout as one already queued, or being downloaded, are
+    merged into it rather than downloaded twice.
+    """
+
+    def __init__(self, max_prefetch):
+        """
+        Args:
+          max_prefetch: int
+            Most requests below CURRENT_PRIORITY that are downloaded at once.
+        """
+        self.max_prefetch = max_prefetch
+
+        self._condition = threading.Condition()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._requests = {}  # request key -> request queued or being downloaded
+        self._cancelled = {}  # reading -> requests cancelled as stale
+        self._queued = 0
+        self._running = 0
+        self._running_prefetch = 0
+
+        self.depth = Histogram(DEPTH_BUCKETS)
+        self.wait = Histogram(LATENCY_BUCKETS)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.cancelled = 0
+        self.deduplicated = 0
+
+    def __len__(self):
+        return self._queued
+
+    def put(self, request, priority=PREFETCH_PRIORITY):
+        with self._condition:
+            key = request.key
+            existing = self._requests.get(key, None)
+            if existing is None or existing is request:
+                existing = None
+                self._requests[key] = request
+                request.submitted = time.time()
+                self.depth.record(self._queued)
+                self._push(request, priority)
+                self._queued += 1
+                self._condition.notify()
+            else:
+                self.deduplicated += 1
+                if existing.is_queued() and priority < existing.priority:
+                    self._push(existing, priority)
+                    self._condition.notify()
+        if existing is not None:
+            # outside the lock, as the cutout is handed straight over if existing has already been downloaded.
+            existing.merge(request)
+
+    def _push(self, request, priority):
+        # an entry that is replaced is left in the heap with no request, and skipped when it comes up.
+        if request.entry is not None:
+            request.entry[-1] = None
+        request.priority = priority
+        request.entry = [priority, next(self._sequence), request]
+        heapq.heappush(self._heap, request.entry)
+
+    def _peek(self):
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+        return self._heap and self._heap[0][-1] or None
+
+    def get(self, worker):
+        """
+        Take the next request to download, waiting until there is one the worker may take.
+
+        Args:
+          worker: DownloadThread
+            The worker asking, while it isn't stopping.
+
+        Returns:
+          request: DownloadRequest
+            The request, or None once the worker is stopping.
+        """
+        with self._condition:
+            while True:
+                if worker.is_stopping():
+                    return None
+                request = self._peek()
+                if request is not None and (request.priority <= CURRENT_PRIORITY or
+                                            self._running_prefetch < self.max_prefetch):
+                    heapq.heappop(self._heap)
+                    request.entry = None
+                    request.started = time.time()
+                    request.prefetching = request.priority > CURRENT_PRIORITY
+                    self.wait.record(request.started - request.submitted)
+                    self._queued -= 1
+                    self._running += 1
+                    if request.prefetching:
+                        self._running_prefetch += 1
+                    return request
+                self._condition.wait()
+
+    def task_done(self, request):
+        with self._condition:
+            self.latency.record(time.time() - request.started)
+            self._running -= 1
+            if request.prefetching:
+                self._running_prefetch -= 1
+            if self._requests.get(request.key, None) is request and not request.is_queued():
+                del self._requests[request.key]
+            self._condition.notify_all()
+
+    def cancel(self, readings):
+        """
+        Drop the queued requests for readings, they are kept to be queued again if the readings are prioritized.
+
+        Returns:
+          cancelled: int
+            Number of requests dropped.
+        """
+        count = 0
+        if len(readings) == 0:
+            return count
+        with self._condition:
+            for key, request in list(self._requests.items()):
+                if request.reading in readings and request.is_queued():
+                    request.entry[-1] = None
+                    request.entry = None
+                    del self._requests[key]
+                    self._cancelled.setdefault(request.reading, []).append(request)
+                    self._queued -= 1
+                    count += 1
+            self.cancelled += count
+        return count
+
+    def prioritize(self, readings, priority):
+        """
+        Move the queued, or cancelled, requests for readings up to priority.
+        """
+        merged = []
+        with self._condition:
+            for reading in readings:
+                for request in self._cancelled.pop(reading, []):
+                    if request.key in self._requests:
+                        merged.append((self._requests[request.key], request))
+                        continue
+                    self._requests[request.key] = request
+                    request.submitted = time.time()
+                    self._push(request, request.priority)
+                    self._queued += 1
+            for request in list(self._requests.values()):
+                if request.reading in readings and request.is_queued() and priority < request.priority:
+                    self._push(request, priority)
+            self._condition.notify_all()
+        for existing, request in merged:
+            existing.merge(request)
+
+    def forget_cancelled(self):
+        """
+        Drop the requests kept since they were cancelled, they won't be queued again.
+
+        Returns:
+          forgotten: int
+            Number of requests dropped.
+        """
+        with self._condition:
+            forgotten = sum(len(requests) for requests in self._cancelled.values())
+            self._cancelled.clear()
+        return forgotten
+
+    def wake(self):
+        """Wake the waiting workers, so stopped ones can quit."""
+        with self._condition:
+            self._condition.notify_all()
+
+    def get_statistics(self):
+        with self._condition:
+            return {'queued': self._queued,
+                    'running': self._running,
+                    'depth': self.depth.as_dict(),
+                    'wait': self.wait.as_dict(),
+                    'latency': self.latency.as_dict(),
+                    'cancelled': self.cancelled,
+                    'deduplicated': self.deduplicated}
+
+
 class DownloadRequest(object):
     """
     Specifies an item (image and potentially related files) to be downloaded.
@@ -109,8 +422,42 @@ class DownloadRequest(object):
         else:
             self.focus = focus
 
+        # set by the DownloadQueue
+        self.priority = PREFETCH_PRIORITY
+        self.entry = None
+        self.submitted = None
+        self.started = None
+        self.prefetching = False
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._cutout = None
+
+    @property
+    def key(self):
+        """Requests with the same key download the same cutout."""
+        return self.reading, tuple(self.focus), self.needs_apcor
+
+    def is_queued(self):
+        return self.entry is not None
+
+    def merge(self, other):
+        """
+        Have the cutout downloaded for this request passed to the callbacks of other too,
+        straight away if it has already been downloaded.
+        """
+        late = []
+        with self._lock:
+            for callback in [other.callback] + other._callbacks:
+                if callback is None or callback == self.callback or callback in self._callbacks:
+                    continue
+                self._callbacks.append(callback)
+                if self._cutout is not None:
+                    late.append(callback)
+        for callback in late:
+            callback(self._cutout)
+
     def __lt__(self, other):
-        self.reading.get_exposure_number() < other.reading.get_exposure_number()
+        return self.reading.get_exposure_number() < other.reading.get_exposure_number()
 
     def execute(self, downloader):
         cutout = downloader.download_cutout(self.reading,
@@ -119,6 +466,11 @@ class DownloadRequest(object):
         logger.debug("Got cutout: {}".format(cutout))
         if self.callback is not None:
             self.callback(cutout)
+        with self._lock:
+            self._cutout = cutout
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback(cutout)
 
 
 class DownloadThread(threading.Thread):
@@ -134,7 +486,9 @@ class DownloadThread(threading.Thread):
 
     def run(self):
         while not self._should_stop:
-            download_request = self.work_queue.get()
+            download_request = self.work_queue.get(self)
+            if download_request is None:
+                break
             self._idle = False
 
             try:
@@ -144,14 +498,17 @@ class DownloadThread(threading.Thread):
             finally:
                 # It is up to the error handler to requeue the downloadable
                 # item if needed.
-                self.work_queue.task_done()
+                self.work_queue.task_done(download_request)
                 self._idle = True
 
     def do_download(self, download_request):
-        download_request[1].execute(self.downloader)
+        download_request.execute(self.downloader)
 
     def stop(self):
         self._should_stop = True
 
+    def is_stopping(self):
+        return self._should_stop
+
     def is_stopped(self):
         return self._should_stop and self._idle
@@ -2,8 +2,6 @@ import os
 
 __author__ = "David Rusk <drusk@uvic.ca>"
 
-from astropy.io import fits
-import io
 from ossos.gui import logger
 from .. import storage
 import sys
@@ -34,17 +32,7 @@ class Downloader(object):
         logger.debug(str(kwargs))
         hdulist = None
         try:
-            vobj = storage.vofile(uri, **kwargs)
-            try:
-                fobj = io.StringIO(vobj.read())
-                fobj.seek(0)
-                hdulist = fits.open(fobj)
-            except Exception as e:
-                sys.stderr.write("ERROR: {}\n".format(str(e)))
-                sys.stderr.write("While loading {} {}\n".format(uri, kwargs))
-                pass
-            finally:
-                vobj.close()
+            hdulist = storage.stream_hdulist(uri, **kwargs)
         except Exception as e:
             sys.stderr.write(str(e)+"\n")
             sys.stderr.write("While opening connection to {}.\n".format(uri))
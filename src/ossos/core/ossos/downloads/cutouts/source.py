@@ -15,7 +15,7 @@ from astropy.time import Time
 from astropy.units import Quantity
 
 from ossos.gui import config
-from .downloader import Downloader, ApcorData
+from ..core import Downloader, ApcorData
 from ... import storage
 from ...astrom import SourceReading, Observation
 from ...gui import logger
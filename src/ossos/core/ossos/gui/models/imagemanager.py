@@ -1,7 +1,7 @@
 __author__ = "David Rusk <drusk@uvic.ca>"
 
 from ...gui import events, logger
-from ...downloads.async_download import DownloadRequest
+from ...downloads.async_download import DownloadRequest, PREFETCH_PRIORITY
 from ...downloads.cutouts.focus import (SingletFocusCalculator,
                                         TripletFocusCalculator)
 from ...downloads.cutouts.grid import CutoutGrid
@@ -42,7 +42,7 @@ class ImageManager(object):
         for source in workunit.get_unprocessed_sources():
             self.download_singlets_for_source(source, needs_apcor=needs_apcor)
 
-    def download_singlets_for_source(self, source, needs_apcor=False, priority=100):
+    def download_singlets_for_source(self, source, needs_apcor=False, priority=PREFETCH_PRIORITY):
         focus_calculator = SingletFocusCalculator(source)
         logger.debug("Got focus calculator {} for source {}".format(focus_calculator, source))
 
@@ -116,6 +116,28 @@ class ImageManager(object):
                                     callback=callback)
                 )
 
+    def prioritize_source(self, source, stale_sources=()):
+        """
+        Download the images of the source being looked at ahead of the prefetching, and drop
+        the queued downloads of the sources the user has finished with.
+        """
+        readings = source.get_readings()
+        stale_readings = [reading for stale_source in stale_sources if stale_source is not source
+                          for reading in stale_source.get_readings()]
+        self._singlet_download_manager.focus_on(readings, stale_readings)
+        self._triplet_download_manager.focus_on(readings, stale_readings)
+
+    def forget_cancelled_downloads(self):
+        """
+        Drop the downloads cancelled for the sources of a workunit that is finished with.
+        """
+        self._singlet_download_manager.forget_cancelled()
+        self._triplet_download_manager.forget_cancelled()
+
+    def get_download_statistics(self):
+        return {'singlets': self._singlet_download_manager.get_statistics(),
+                'triplets': self._triplet_download_manager.get_statistics()}
+
     def get_cutout_grid(self, source):
         try:
             return self._cutout_grids[source]
@@ -91,13 +91,24 @@ class ValidationModel(object):
         #    except:
         #        pass
         next(self.work_units)
+        # the downloads cancelled for the sources of the last workunit won't be wanted again.
+        self.image_manager.forget_cancelled_downloads()
 
     def expect_source_transition(self):
+        self._prioritize_current_source()
         self.expect_image_transition()
 
     def expect_observation_transition(self):
+        self._prioritize_current_source()
         self.expect_image_transition()
 
+    def _prioritize_current_source(self):
+        workunit = self.get_current_workunit()
+        source = workunit.get_current_source()
+        stale_sources = [other for other in workunit.get_sources()
+                         if other is not source and workunit.is_source_finished(other)]
+        self.image_manager.prioritize_source(source, stale_sources)
+
     @staticmethod
     def expect_image_transition():
         events.send(events.CHANGE_IMAGE)
@@ -780,6 +780,8 @@ class WorkUnitBuilder(object):
 
     def build_workunit(self, input_fullpath):
         try:
+            # not streamed: a WorkUnit steps back and forth through all of its sources and readings,
+            # so they are held in memory whichever way the file is read.
             parsed_data = self.parser.parse(input_fullpath)
             logger.debug("Parsed %s (%d sources)" %
                          (input_fullpath, parsed_data.get_source_count()))
@@ -1,4 +1,6 @@
 import logging
+
+import numpy
 # noinspection PyUnresolvedReferences
 from mp_ephem import time_mpc
 from astropy.time import Time
@@ -95,39 +97,73 @@ class MOPDataParser(object):
                 self._table = Table()
         return self._table
 
+    def zeropoints(self):
+        """
+        The zeropoint of each file_id, read once from the <file_id>.zeropoint.used files, 0 where there is none.
+
+        @rtype: list
+        @return: zeropoint of each of header.file_ids
+        """
+        zeropoints = []
+        for file_id in self.header.file_ids:
+            try:
+                with open("{}.zeropoint.used".format(file_id), 'r') as fobj:
+                    zeropoints.append(float(fobj.readline()))
+            except:
+                zeropoints.append(0)
+        return zeropoints
+
     def parse(self, lines):
+        """
+        Build the data table from the lines of a MOP file that follow the header.
 
-        record = []
-        while len(lines) > 0:
-            line = lines.pop(0)
-            if line.strip().startswith("#"):
-                continue
-            if len(line.strip()) != 0:
-                record.append(line)
-                continue
-            if len(record) == 0:
-                continue
-            if len(record) != len(self.header.file_ids):
-                logging.debug("record: {}".format(record))
-                logging.debug("file_ids: {}".format(self.header.file_ids))
-                raise ValueError("Wrong number of entries in record.")
-            values = []
-            record_number = 0
-            for line in record:
-                if len(line.split()) != len(self.header.column_names):
-                    logging.debug("line: {}".format(line))
-                    logging.debug("Wrong number of columns compared to: {}".format(self.header.column_names))
-                    raise ValueError("column length mismatch")
-                values.extend([ float(x) for x in line.split() ])
-                try:
-                    zp = float(open("{}.zeropoint.used".format(self.header.file_ids[record_number]), 'r').readline())
-                except:
-                    zp = 0
-                values.append(zp)
-                record_number += 1
-            self.table.add_row(values)
-            record = []
-        return self.table
+        Records are blocks of one line per file_id, separated by blank lines.  The lines are
+        gathered in one pass and converted to an array of (record, file_id, column) in one go.
+
+        @param lines: lines of the file, after the header.
+        @rtype: Table
+        @return: data table, with a column per header column and a ZP column for each file_id.
+        """
+        n_files = len(self.header.file_ids)
+        n_columns = len(self.header.column_names)
+
+        data_lines = []
+        record_length = 0
+        for line in lines:
+            stripped = line.strip()
+            if len(stripped) == 0:
+                if record_length != 0 and record_length != n_files:
+                    logging.debug("record: {}".format(data_lines[-record_length:]))
+                    logging.debug("file_ids: {}".format(self.header.file_ids))
+                    raise ValueError("Wrong number of entries in record.")
+                record_length = 0
+            elif not stripped.startswith("#"):
+                data_lines.append(stripped)
+                record_length += 1
+        if record_length != 0 and record_length != n_files:
+            logging.debug("record: {}".format(data_lines[-record_length:]))
+            logging.debug("file_ids: {}".format(self.header.file_ids))
+            raise ValueError("Wrong number of entries in record.")
+
+        if len(data_lines) == 0:
+            return self.table
+
+        try:
+            values = numpy.loadtxt(data_lines, dtype='f8', ndmin=2, comments=None)
+        except ValueError as ex:
+            logging.debug("Failed to convert data lines: {}".format(ex))
+            raise ValueError("column length mismatch")
+        if values.shape[1] != n_columns:
+            logging.debug("Wrong number of columns compared to: {}".format(self.header.column_names))
+            raise ValueError("column length mismatch")
+        values = values.reshape(-1, n_files, n_columns)
+
+        columns = []
+        for idx, zeropoint in enumerate(self.zeropoints()):
+            columns.extend(values[:, idx, :].T)
+            columns.append(numpy.full(values.shape[0], zeropoint, dtype='f8'))
+        self._table = Table(columns, names=self.table.colnames, copy=False)
+        return self._table
 
 
 class MOPHeader(object):
@@ -145,19 +181,24 @@ class MOPHeader(object):
         return str(self.keywords)+'\n'+str(self.column_names)
 
     def parser(self, lines):
-        """Given a set of lines parse the into a MOP Header"""
-        while len(lines) > 0:
-            if lines[0].startswith('##') and lines[1].startswith('# '):
+        """Given a set of lines parse the into a MOP Header, the header lines are removed from lines."""
+        idx = 0
+        while idx < len(lines):
+            if lines[idx].startswith('##') and idx + 1 < len(lines) and lines[idx + 1].startswith('# '):
                 # A two-line keyword/value line starts here.
-                self._header_append(lines.pop(0), lines.pop(0))
-            elif lines[0].startswith('# '):
+                self._header_append(lines[idx], lines[idx + 1])
+                idx += 2
+            elif lines[idx].startswith('# '):
                 # Lines with single comments are exposure numbers unless preceeded by double comment line
-                self._append_file_id(lines.pop(0))
-            elif lines[0].startswith('##'):
+                self._append_file_id(lines[idx])
+                idx += 1
+            elif lines[idx].startswith('##'):
                 # Double comment lines without a single comment following are column headers for dataset.
-                self._set_column_names(lines.pop(0)[2:])
+                self._set_column_names(lines[idx][2:])
+                idx += 1
             else:
-                # Last line of the header reached.
+                # Last line of the header reached, drop the header lines in one go.
+                del lines[:idx]
                 return self
         raise IOError("Failed trying to read header")
 
@@ -29,7 +29,7 @@ import argparse
 import logging
 
 
-task = util.task()
+task = 'combine'
 dependency = 'step3'
 
 
@@ -1,11 +1,16 @@
 #!/usr/bin/env python
-# use the xy2skypv code to generate the astrometric values
-# that measure3 would normally produce.
+# use the PV WCS of each frame (or the xy2skypv code) to generate the
+# astrometric values that measure3 would normally produce.
 import os
 import argparse
 import logging
 from pathlib import Path
+
+import numpy
+from astropy.io import fits
+
 from ossos import storage
+from ossos import wcs
 
 
 SUCCESS_FILE = "measure3.OK"
@@ -16,22 +21,105 @@ CANDS_ASTROM_EXT = 'measure3.cands.astrom'
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Run xy2skypv on cands.comb files to produce cands.astrom")
+        description="Compute the RA/DEC of the sources in a cands.comb file to produce cands.astrom")
     parser.add_argument('base_image',
                         help="The base image referencing the .cands.comb file")
     parser.add_argument('--dbimages',
                         help="DBImage VOSpace URI",
                         default=storage.DBIMAGES)
+    parser.add_argument('--xy2skypv',
+                        action='store_true',
+                        default=False,
+                        help="Run the external xy2skypv program on each frame rather than computing in process.")
 
     args = parser.parse_args()
     base_image = args.base_image
     storage.DBIMAGES = args.dbimages
-    run(base_image, dbimages=storage.DBIMAGES)
+    run(base_image, dbimages=storage.DBIMAGES, use_xy2skypv=args.xy2skypv)
 
 
-def run(base_image, dbimages=None):
+def read_cands(cands_filename):
     """
-    execute sky2xypv on sources found in cands.comb file.
+    Read a cands.comb file.
+
+    @param cands_filename: name of the file to read.
+    @return: (header_lines, base_names, coords) where coords is an array of shape (n_candidates, n_frames, 4)
+    holding the X, Y, X_0, Y_0 of each candidate on each frame.
+    """
+    header_lines = []
+    base_names = []
+    values = []
+    get_image_names = True
+    started = False
+    for cands_line in open(cands_filename):
+        # read the names of the exposures to work from...
+        if len(cands_line.strip()) == 0:
+            # Skip EMPTY lines...
+            continue
+        if cands_line.lstrip()[0] == '#':
+            header_lines.append(cands_line)
+            if cands_line.lstrip()[1] == '#':
+                get_image_names = not started
+                continue
+            logging.info("Read this line: {}".format(cands_line[2:].strip()))
+            if get_image_names and cands_line.lstrip()[1] == ' ':
+                base_names.append(cands_line[2:].strip())
+                started = True
+            continue
+        values.append(cands_line.split()[0:4])
+    coords = numpy.array(values, dtype=float).reshape(-1, max(len(base_names), 1), 4)
+    return header_lines, base_names, coords
+
+
+def _sky_coords_xy2skypv(base_names, coords):
+    """
+    Compute the RA/DEC of the sources on each frame by running xy2skypv on a file of x/y values per frame.
+    """
+    ra = numpy.zeros(coords.shape[0:2])
+    dec = numpy.zeros(coords.shape[0:2])
+    for idx, base_name in enumerate(base_names):
+        storage.get_frame(base_name)
+        with open("%s.xy" % base_name, 'w') as xy_file:
+            for x, y in coords[:, idx, 0:2]:
+                xy_file.write("%s %s\n" % (x, y))
+        cmd = 'xy2skypv %s.fits %s.xy %s.rd' % (base_name,
+                                                base_name, base_name)
+        os.system(cmd)
+        rd_lines = [line.split() for line in open("%s.rd" % base_name) if len(line.strip()) > 0]
+        if len(rd_lines) != coords.shape[0]:
+            raise ValueError("MISMATCH in astrometric code... bailing out.\n")
+        for jdx, rd in enumerate(rd_lines):
+            if float(rd[2]) != coords[jdx, idx, 0] or float(rd[3]) != coords[jdx, idx, 1]:
+                # the files are misalligned?
+                raise ValueError("MISMATCH in astrometric code... bailing out.\n")
+            ra[jdx, idx] = float(rd[0])
+            dec[jdx, idx] = float(rd[1])
+    return ra, dec
+
+
+def _sky_coords_wcs(base_names, coords):
+    """
+    Compute the RA/DEC of the sources on each frame using the PV WCS in the header of each frame,
+    all the sources of a frame in one pass.
+    """
+    ra = numpy.zeros(coords.shape[0:2])
+    dec = numpy.zeros(coords.shape[0:2])
+    for idx, base_name in enumerate(base_names):
+        with fits.open(storage.get_frame(base_name)) as hdulist:
+            frame_wcs = wcs.WCS(hdulist[0].header)
+        frame_ra, frame_dec = frame_wcs.xy2sky(coords[:, idx, 0], coords[:, idx, 1])
+        ra[:, idx] = frame_ra.to('degree').value
+        dec[:, idx] = frame_dec.to('degree').value
+    return ra, dec
+
+
+def run(base_image, dbimages=None, use_xy2skypv=False):
+    """
+    compute the RA/DEC of the sources found in cands.comb file.
+
+    @param base_image: the base name of the cands.comb file.
+    @param dbimages: DBImage VOSpace URI
+    @param use_xy2skypv: run the external xy2skypv program rather than evaluating the WCS in process.
     """
 
     if dbimages is not None:
@@ -41,80 +129,38 @@ def run(base_image, dbimages=None):
 
     cands_filename = "%s.%s" % (base_image, CANDS_COMB_EXT)
     if not os.access(cands_filename, os.R_OK):
-        FileNotFoundError("Failed to open input candidate file %s\n" % cands_filename)
+        raise FileNotFoundError("Failed to open input candidate file %s\n" % cands_filename)
 
     astrom_header = """##   X        Y        X_0     Y_0          R.A.          DEC                   \n"""
 
     astrom_filename = "%s.%s" % (base_image, CANDS_ASTROM_EXT)
-    coords = []
-    base_names = []
-    line_counter = 0
-    xy_files = {}
-    xy_lines = {}
-    get_image_names = True
-    started = False
+    header_lines, base_names, coords = read_cands(cands_filename)
+
+    # Now run the astrometry for each object on the frame that
+    # object was detected on
+    if use_xy2skypv:
+        ra, dec = _sky_coords_xy2skypv(base_names, coords)
+    else:
+        ra, dec = _sky_coords_wcs(base_names, coords)
+
     with open(astrom_filename, 'w') as astrom_file:
-        cands_lines = open(cands_filename).readlines()
-        for cands_line in cands_lines:
-            # read the names of the exposures to work from...
-            if len(cands_line.strip()) == 0:
-                # Skip EMPTY lines...
-                continue
-            if cands_line.lstrip()[0] == '#':
-                # write out all the header lines except the one with column
-                # names as its different for the astrom version 'X_0' is a
-                # column name in the cands.comb files.
-                if "X_0" not in cands_line:
-                    astrom_file.write(cands_line)
-                else:
-                    astrom_file.write(astrom_header)
-                if cands_line.lstrip()[1] == '#':
-                    get_image_names = not started
-                    continue
-                logging.info("Read this line: {}".format(cands_line[2:].strip()))
-                if get_image_names and cands_line.lstrip()[1] == ' ':
-                    base_name = cands_line[2:].strip()
-                    base_names.append(base_name)
-                    xy_files[base_name] = open("%s.xy" % base_name, 'w')
-                    started = True
-                    continue
-                continue
-            v = cands_line.strip().split()
-            coords.append(v)
-            base_name = base_names[line_counter % len(base_names)]
-            if base_name not in xy_lines:
-                xy_lines[base_name] = []
-            xy_lines[base_name].append(cands_line)
-            xy_files[base_name].write("%s %s\n" % (v[0], v[1]))
-            xy_files[base_name].flush()
-            line_counter += 1
-
-        # Now run the astrometry for each object on the frame that
-        # object was detected on
-
-        astrometry_lines = {}
-        for base_name in xy_files:
-            storage.get_frame(base_name)
-            xy_files[base_name].close()
-            cmd = 'xy2skypv %s.fits %s.xy %s.rd' % (base_name,
-                                                    base_name, base_name)
-            os.system(cmd)
-            astrometry_lines[base_name] = open("%s.rd" % base_name).readlines()
-
-        for idx in range(len(astrometry_lines[base_names[0]])):
+        for cands_line in header_lines:
+            # write out all the header lines except the one with column
+            # names as its different for the astrom version 'X_0' is a
+            # column name in the cands.comb files.
+            if "X_0" not in cands_line:
+                astrom_file.write(cands_line)
+            else:
+                astrom_file.write(astrom_header)
+        for jdx in range(coords.shape[0]):
             astrom_file.write("\n")
-            for base_name in base_names:
-                rd = astrometry_lines[base_name][idx].split()
-                xy = xy_lines[base_name][idx].split()
-                if rd[2] != xy[0] or rd[3] != xy[1]:
-                    # the files are misalligned?
-                    raise ValueError("MISMATCH in astrometric code... bailing out.\n")
-                astrom_file.write(" %8.2f %8.2f %8.2f %8.2f %12.7f %12.7f\n" % (float(xy[0]),
-                                                                                float(xy[1]),
-                                                                                float(xy[2]),
-                                                                                float(xy[3]),
-                                                                                float(rd[0]),
-                                                                                float(rd[1])))
+            for idx in range(len(base_names)):
+                astrom_file.write(" %8.2f %8.2f %8.2f %8.2f %12.7f %12.7f\n" % (coords[jdx, idx, 0],
+                                                                                coords[jdx, idx, 1],
+                                                                                coords[jdx, idx, 2],
+                                                                                coords[jdx, idx, 3],
+                                                                                ra[jdx, idx],
+                                                                                dec[jdx, idx]))
 
     Path(f'{SUCCESS_FILE}').touch()
     os.unlink(f'{base_image}.{FAILED_EXT}')
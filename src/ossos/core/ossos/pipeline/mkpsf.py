@@ -43,7 +43,8 @@ def run(expnum, ccd, version, dry_run=False, prefix="", force=False):
         logging.info("{} completed successfully for {} {} {} {}".format(task, prefix, expnum, version, ccd))
         return
 
-    with storage.LoggingManager(task, prefix, expnum, ccd, version, dry_run):
+    # the fwhm, zeropoint and mkpsf tags are written together when the batch closes.
+    with storage.LoggingManager(task, prefix, expnum, ccd, version, dry_run), storage.TagBatch():
         try:
             if not storage.get_status(dependency, prefix, expnum, version, ccd=ccd):
                 raise IOError("{} not yet run for {}".format(dependency, expnum))
@@ -79,17 +80,8 @@ def run(expnum, ccd, version, dry_run=False, prefix="", force=False):
                         'zeropoint.used', 'apcor', 'fwhm', 'phot'):
                 dest = storage.dbimages_uri(expnum, ccd, prefix=prefix, version=version, ext=ext)
                 source = basename + "." + str(ext)
-                count = 0
                 with open(source, 'r'):
-                  while True:
-                    count += 1
-                    try:
-                        logging.info("Attempt {} to copy {} -> {}".format(count, source, dest))
-                        storage.copy(source, dest)
-                        break
-                    except Exception as ex:
-                        if count > 10:
-                            raise ex
+                    storage.copy(source, dest)
 
             # set some data parameters associated with the image, determined in this step.
             storage.set_status('fwhm', prefix, expnum, version=version, ccd=ccd, status=str(storage.get_fwhm(
@@ -141,6 +133,8 @@ def main():
                         action="store_true")
     parser.add_argument("--debug", "-d",
                         action="store_true")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of CCD images to download ahead of the one being processed")
 
     cmd_line = " ".join(sys.argv)
     args = parser.parse_args()
@@ -163,6 +157,12 @@ def main():
                ccdlist = list(range(0, 40))
         else:
            ccdlist = [args.ccd]
+        if args.jobs > 1:
+            # download the images of the next CCDs while the current one is processed.
+            ccdlist = [ccd for ccd in ccdlist
+                       if args.force or not storage.get_status(task, prefix, expnum, args.type, ccd)]
+            ccdlist = (ccd for ccd, filename in storage.iter_images(expnum, ccdlist, version=args.type,
+                                                                   prefix=prefix, jobs=args.jobs))
         for ccd in ccdlist:
             run(expnum, ccd, args.type, args.dry_run, prefix, args.force)
     return exit_code
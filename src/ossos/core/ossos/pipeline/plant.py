@@ -27,41 +27,39 @@ import argparse
 import errno
 import json
 import logging
-import math
 import os
 import sys
-import tempfile
 
+import numpy
 from astropy import wcs
 from astropy.io import fits
-from numpy import radians, fabs, log10, rint, cos, sin, transpose
+from numpy import radians, fabs, log10, rint, cos, sin
 
+from ossos import daophot
 from ossos import storage
 from ossos import util
 from ossos.plant import KBOGenerator
 
 task = 'plant'
-dependency = 'mkpsf'
+dependency = 'align'
 
 
-def plant_kbos(filename, psf, kbos, shifts, prefix):
+# numpy types of the integer FITS BITPIX values.
+INTEGER_BITPIX = {8: 'uint8', 16: 'int16', 32: 'int32', 64: 'int64'}
+
+
+def plant_kbos(filename, psf, kbos, shifts, prefix, noise=True, rng=None):
     """
     Add KBOs to an image
     :param filename: name of the image to add KBOs to
-    :param psf: Point Spread Function in IRAF/DAOPHOT format, used by ADDSTAR
+    :param psf: Point Spread Function in IRAF/DAOPHOT format, as written by daophot.psf
     :param kbos: list of KBOs to add, has format as returned by KBOGenerator
     :param shifts: dictionary to transform coordinates to reference frame.
     :param prefix: an estimate FWHM of the image, used to determine trailing.
+    :param noise: add Poisson noise to the planted sources, as ADDSTAR does.
+    :param rng: numpy.random.Generator for the noise, pass a seeded one for a reproducible planting.
     :return: None
     """
-    from pyraf import iraf
-
-    iraf.set(uparm="./")
-    iraf.digiphot()
-    iraf.apphot()
-    iraf.daophot(_doprint=0)
-    iraf.images()
-
     if shifts['nmag'] < 4:
         logging.warning("Mag shift based on fewer than 4 common stars.")
         fd = open("plant.WARNING", 'a')
@@ -74,26 +72,27 @@ def plant_kbos(filename, psf, kbos, shifts, prefix):
         fd.write("Mag shift hsa large uncertainty.")
         fd.close()
 
-    addstar = tempfile.NamedTemporaryFile(suffix=".add", mode='w')
-
     # transform KBO locations to this frame using the shifts provided.
     w = get_wcs(shifts)
 
-    header = fits.open(filename)[0].header
+    with fits.open(filename) as hdulist:
+        # copied before the data are read, so BITPIX/BSCALE/BZERO still describe the image on disk.
+        header = hdulist[0].header.copy()
+        data = numpy.array(hdulist[0].data, dtype='float64')
 
     # set the rate of motion in units of pixels/hour instead of ''/hour
     scale = header['PIXSCAL1']
-    rate = kbos['sky_rate']/scale
+    rate = numpy.array(kbos['sky_rate'])/scale
 
     # compute the location of the KBOs in the current frame.
 
     # offset magnitudes from the reference frame to the current one.
-    mag = kbos['mag'] - shifts['dmag']
-    angle = radians(kbos['angle'])
+    mag = numpy.array(kbos['mag']) - shifts['dmag']
+    angle = radians(numpy.array(kbos['angle']))
 
     # Move the x/y locations to account for the sky motion of the source.
-    x = kbos['x'] - rate*24.0*shifts['dmjd']*cos(angle)
-    y = kbos['y'] - rate*24.0*shifts['dmjd']*sin(angle)
+    x = numpy.array(kbos['x']) - rate*24.0*shifts['dmjd']*cos(angle)
+    y = numpy.array(kbos['y']) - rate*24.0*shifts['dmjd']*sin(angle)
     x, y = w.wcs_world2pix(x, y, 1)
 
     # Each source will be added as a series of PSFs so that a new PSF is
@@ -103,23 +102,16 @@ def plant_kbos(filename, psf, kbos, shifts, prefix):
     mag += 2.5*log10(npsf)
     dt_per_psf = itime/npsf
 
-    # Build an addstar file to be used in the planting of source.
-    idx = 0
-    for record in transpose([x, y, mag, npsf, dt_per_psf, rate, angle]):
-        x = record[0]
-        y = record[1]
-        mag = record[2]
-        npsf = record[3]
-        dt = record[4]
-        rate = record[5]
-        angle = record[6]
-        for i in range(int(npsf)):
-            idx += 1
-            x += dt*rate*math.cos(angle)
-            y += dt*rate*math.sin(angle)
-            addstar.write("{} {} {} {}\n".format(x, y, mag, idx))
-
-    addstar.flush()
+    # Lay down the PSFs of every source, each step along the trail moves dt*rate pixels.
+    npsf = npsf.astype(int)
+    source = numpy.repeat(numpy.arange(len(npsf)), npsf)
+    step = numpy.arange(len(source)) - numpy.repeat(numpy.cumsum(npsf) - npsf, npsf) + 1
+    distance = step * dt_per_psf[source] * rate[source]
+    x = x[source] + distance * cos(angle[source])
+    y = y[source] + distance * sin(angle[source])
+
+    daophot.add_stars(data, daophot.PSF(psf), x, y, mag[source], noise=noise, rng=rng)
+
     fk_image = prefix+filename
     try:
         os.unlink(fk_image)
@@ -129,13 +121,19 @@ def plant_kbos(filename, psf, kbos, shifts, prefix):
         else:
             raise
 
-    # add the sources to the image.
-    if os.access(f'{fk_image}.art', os.R_OK):
-        os.unlink(f'{fk_image}.art')
-    iraf.daophot.addstar(filename, addstar.name, psf, fk_image,
-                         simple=True, verify=False, verbose=False)
-    # convert the image to short integers.
-    iraf.images.chpix(fk_image, fk_image, 'ushort')
+    # write the image with the pixel type and scaling it was read with.
+    bitpix = header['BITPIX']
+    bzero = header.get('BZERO', 0)
+    bscale = header.get('BSCALE', 1)
+    if bitpix > 0:
+        limits = numpy.iinfo(INTEGER_BITPIX[bitpix])
+        data = numpy.clip(data, limits.min * bscale + bzero, limits.max * bscale + bzero)
+    hdu = fits.PrimaryHDU(data=data, header=header)
+    if bitpix > 0:
+        hdu.scale(INTEGER_BITPIX[bitpix], bzero=bzero, bscale=bscale)
+    else:
+        hdu.scale(bitpix == -32 and 'float32' or 'float64')
+    hdu.writeto(fk_image)
 
 
 def get_wcs(shifts):
@@ -156,7 +154,7 @@ def get_wcs(shifts):
 
 
 def plant(expnums, ccd, rmin, rmax, ang, width, number=10,
-          mmin=21.0, mmax=25.5, version='s', dry_run=False, force=True):
+          mmin=21.0, mmax=25.5, version='s', dry_run=False, force=True, noise=True, seed=None):
     """Plant artificial sources into the list of images provided.
 
     @param dry_run: don't push results to VOSpace.
@@ -171,8 +169,12 @@ def plant(expnums, ccd, rmin, rmax, ang, width, number=10,
     @param mmin: Minimum magnitude to plant sources at
     @param number: number of sources to plant.
     @param force: Run, even if we already succeeded at making a fk image.
+    @param noise: add Poisson noise to the planted sources.
+    @param seed: seed for generating the artificial KBOs and their noise, for reproducible plantings.
     """
     message = storage.SUCCESS
+    # the KBOs and the noise added with them are drawn from the same generator.
+    rng = numpy.random.default_rng(seed)
 
     if storage.get_status(task, "", expnums[0], version, ccd) and not force:
         logging.info("{} completed successfully for {}{}{}{:02d}".format(
@@ -197,13 +199,14 @@ def plant(expnums, ccd, rmin, rmax, ang, width, number=10,
                                          mag=(mmin, mmax),
                                          x=(bounds[0][0], bounds[0][1]),
                                          y=(bounds[1][0], bounds[1][1]),
-                                         filename='Object.planted')
+                                         filename='Object.planted',
+                                         seed=rng)
 
             for expnum in expnums:
                 filename = storage.get_image(expnum, ccd, version)
                 psf = storage.get_file(expnum, ccd, version, ext='psf.fits')
                 plant_kbos(filename, psf, kbos,
-                           get_shifts(expnum, ccd, version), "fk")
+                           get_shifts(expnum, ccd, version), "fk", noise=noise, rng=rng)
 
             if dry_run:
                 return
@@ -277,6 +280,10 @@ def main():
                         type=float, help="angle opening")
     parser.add_argument("--ang", default=20,
                         type=float, help="angle of motion, 0 is West")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed for the random generation of the planted sources, combined with the CCD number.")
+    parser.add_argument("--no-noise", action="store_true",
+                        help="Do not add Poisson noise to the planted sources.")
     parser.add_argument("--force", action="store_true")
     parser.add_argument("--dry-run", action="store_true")
 
@@ -309,7 +316,8 @@ def main():
               args.rmin, args.rmax, args.ang, args.width,
               number=args.number, mmin=args.mmin, mmax=args.mmax,
               version=version,
-              dry_run=args.dry_run, force=args.force )
+              dry_run=args.dry_run, force=args.force, noise=not args.no_noise,
+              seed=args.seed is not None and [args.seed, ccd] or None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,381 @@
+"""Run the pipeline stages over a set of triplets on a local pool of worker processes.
+
+The task graph is built from the ``task`` and ``dependency`` attributes of the stage modules: a task for
+(expnum, ccd, version, prefix) is started as soon as the task it depends on has succeeded for the same
+CCD.  Tasks already recorded as successful in the VOSpace status tags are not run again, so an interrupted
+field is resumed by running the scheduler again with the same arguments.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+from concurrent import futures
+
+from ossos import storage
+from ossos import util
+from ossos.pipeline import align, combine, mk_mopheader, mkpsf, plant, scramble, slow, step1, step2, step3
+
+DONE = 'done'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+def _run_mk_mopheader(expnums, ccd, version, prefix, dry_run, force, options):
+    mk_mopheader.run(expnums[0], ccd, version, dry_run=dry_run, prefix=prefix, force=force)
+
+
+def _run_mkpsf(expnums, ccd, version, prefix, dry_run, force, options):
+    mkpsf.run(expnums[0], ccd, version, dry_run=dry_run, prefix=prefix, force=force)
+
+
+def _run_step1(expnums, ccd, version, prefix, dry_run, force, options):
+    step1.run(expnums[0], ccd, prefix=prefix, version=version, dry_run=dry_run, force=force)
+
+
+def _run_slow(expnums, ccd, version, prefix, dry_run, force, options):
+    slow.run(expnums[0], ccd, version=version, prefix=prefix, dry_run=dry_run, force=force)
+
+
+def _run_step2(expnums, ccd, version, prefix, dry_run, force, options):
+    step2.run(expnums, ccd, version, prefix=prefix, dry_run=dry_run, force=force)
+
+
+def _run_step3(expnums, ccd, version, prefix, dry_run, force, options):
+    step3.run(expnums, ccd, version,
+              options.get('rate_min', step3._RATE_MIN),
+              options.get('rate_max', step3._RATE_MAX),
+              options.get('angle', step3._ANGLE_CENTRE),
+              options.get('width', step3._ANGLE_WIDTH),
+              prefix=prefix, dry_run=dry_run, force=force)
+
+
+def _run_combine(expnums, ccd, version, prefix, dry_run, force, options):
+    combine.run(expnums[0], ccd, prefix=prefix, version=version, dry_run=dry_run, force=force)
+
+
+def _run_scramble(expnums, ccd, version, prefix, dry_run, force, options):
+    scramble.scramble(expnums, ccd, version=version, dry_run=dry_run, force=force, prefix=prefix)
+
+
+def _run_align(expnums, ccd, version, prefix, dry_run, force, options):
+    align.align(expnums, ccd, version=version, prefix=prefix, dry_run=dry_run, force=force)
+
+
+def _run_plant(expnums, ccd, version, prefix, dry_run, force, options):
+    plant.plant(expnums, ccd,
+                options.get('rate_min', step3._RATE_MIN),
+                options.get('rate_max', step3._RATE_MAX),
+                options.get('angle', step3._ANGLE_CENTRE),
+                options.get('width', step3._ANGLE_WIDTH),
+                version=version, dry_run=dry_run, force=force)
+
+
+class Stage(object):
+    """
+    A pipeline step that the scheduler can run.
+    """
+
+    def __init__(self, module, runner, per_triplet=False, version=None, prefix=None, creates=None):
+        """
+        @param module: the pipeline module, provides the task and dependency names.
+        @param runner: function that runs the stage given (expnums, ccd, version, prefix, dry_run, force, options)
+        @param per_triplet: is the stage run once for a triplet or once for each exposure?
+        @param version: the image version this stage always works on, regardless of the scheduled version.
+        @param prefix: the file prefix this stage always works on, regardless of the scheduled prefix.
+        @param creates: the image version this stage makes, tasks on that version wait for this stage.
+        """
+        self.module = module
+        self.runner = runner
+        self.per_triplet = per_triplet
+        self.version = version
+        self.prefix = prefix
+        self.creates = creates
+
+    @property
+    def task(self):
+        return self.module.task
+
+    @property
+    def dependency(self):
+        return self.module.dependency
+
+
+STAGES = [Stage(mk_mopheader, _run_mk_mopheader),
+          Stage(scramble, _run_scramble, per_triplet=True, version='p', creates='s'),
+          Stage(mkpsf, _run_mkpsf),
+          Stage(step1, _run_step1),
+          Stage(slow, _run_slow),
+          Stage(step2, _run_step2, per_triplet=True),
+          Stage(align, _run_align, per_triplet=True),
+          Stage(plant, _run_plant, per_triplet=True, prefix=''),
+          Stage(step3, _run_step3, per_triplet=True),
+          Stage(combine, _run_combine)]
+
+DEFAULT_STAGES = ['mk_mopheader', 'mkpsf', 'step1', 'step2', 'step3', 'combine']
+
+
+def get_stage(name):
+    """
+    Look up a stage by task name.
+
+    @param name: the task name, eg. 'step1'
+    @rtype: Stage
+    """
+    for stage in STAGES:
+        if stage.task == name:
+            return stage
+    raise ValueError("Unknown pipeline stage: {}".format(name))
+
+
+class Node(object):
+    """
+    One task of the graph: a stage run on an exposure (or triplet) and CCD.
+    """
+
+    def __init__(self, stage, expnums, ccd, version, prefix):
+        self.stage = stage
+        self.expnums = tuple(expnums)
+        self.ccd = ccd
+        self.version = version if stage.version is None else stage.version
+        self.prefix = prefix if stage.prefix is None else stage.prefix
+        self.depends_on = set()
+        self.dependents = set()
+        self.state = None
+
+    @property
+    def key(self):
+        return self.stage.task, self.expnums, self.ccd, self.version, self.prefix
+
+    def __repr__(self):
+        return "{}{}{}{}{:02d}".format(self.stage.task, self.prefix, self.expnums[0], self.version, self.ccd)
+
+    def succeeded(self):
+        """
+        Is this task recorded as successful in the VOSpace status tags?
+        """
+        return storage.get_status(self.stage.task, self.prefix, self.expnums[0], self.version, self.ccd)
+
+
+def build_graph(triplets, ccds, stages=DEFAULT_STAGES, version='p', prefix=''):
+    """
+    Build the task graph for the given triplets.
+
+    @param triplets: list of exposure number triplets.
+    @param ccds: the CCDs to process, None for all the CCDs of each exposure.
+    @param stages: names of the stages to run.
+    @param version: which version of the images to process (o, p, s)
+    @param prefix: file prefix of the images to process, '' or 'fk'
+    @return: list of nodes, each exposure/CCD appears once per stage even if it is in more than one triplet.
+    @rtype: list(Node)
+    """
+    stages = [get_stage(name) for name in stages]
+    by_task = dict((stage.task, stage) for stage in stages)
+    nodes = {}
+
+    def node(stage, expnums, ccd):
+        candidate = Node(stage, expnums, ccd, version, prefix)
+        return nodes.setdefault(candidate.key, candidate)
+
+    for triplet in triplets:
+        triplet = tuple(int(expnum) for expnum in triplet)
+        for ccd in (ccds is None and storage.get_ccdlist(triplet[0]) or ccds):
+            for stage in stages:
+                if stage.per_triplet:
+                    targets = [node(stage, triplet, ccd)]
+                else:
+                    targets = [node(stage, (expnum,), ccd) for expnum in triplet]
+                for target in targets:
+                    parent = by_task.get(stage.dependency, None)
+                    if parent is None:
+                        # dependency is not scheduled, wait on the stage that makes this version of the images.
+                        parent = [creator for creator in stages if creator.creates == target.version]
+                        parent = len(parent) > 0 and parent[0] or None
+                    if parent is None:
+                        continue
+                    if parent.per_triplet:
+                        parents = [node(parent, triplet, ccd)]
+                    else:
+                        parents = [node(parent, (expnum,), ccd) for expnum in target.expnums]
+                    for dependency in parents:
+                        target.depends_on.add(dependency)
+                        dependency.dependents.add(target)
+    return list(nodes.values())
+
+
+def _execute(stage_name, expnums, ccd, version, prefix, dry_run, force, options, workdir):
+    """
+    Run one task in its own working directory, in a worker process.
+
+    @return: did the task succeed?
+    """
+    stage = get_stage(stage_name)
+    dirname = os.path.join(workdir, "{}{}{}{:02d}_{}".format(prefix, expnums[0], version, ccd, stage_name))
+    cwd = os.getcwd()
+    os.makedirs(dirname, exist_ok=True)
+    os.chdir(dirname)
+    try:
+        stage.runner(expnums, ccd, version, prefix, dry_run, force, options)
+        if dry_run:
+            return True
+        # the status tags are cached by the vos client, make sure we see the value just set.
+        storage.get_tags(expnums[0], force=True)
+        return storage.get_status(stage.task, prefix, expnums[0], version, ccd)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(dirname, ignore_errors=True)
+
+
+def _block(node):
+    for dependent in node.dependents:
+        if dependent.state is None:
+            dependent.state = BLOCKED
+            _block(dependent)
+
+
+def schedule(nodes, jobs=1, dry_run=False, force=False, options=None, workdir=None):
+    """
+    Run the tasks of the graph, each as soon as the tasks it depends on have succeeded.
+
+    @param nodes: the task graph, from build_graph.
+    @param jobs: number of tasks to run at once.
+    @param dry_run: don't push results to VOSpace.
+    @param force: re-run tasks even if they are recorded as successful.
+    @param options: dict of stage options (rate_min, rate_max, angle, width)
+    @param workdir: directory under which each task gets a scratch directory.
+    @return: dict of the number of tasks in each final state.
+    """
+    options = options is not None and options or {}
+    workdir = os.path.abspath(workdir is not None and workdir or os.getcwd())
+
+    if not force:
+        storage.prefetch_tags(set(expnum for node in nodes for expnum in node.expnums), jobs=max(jobs, 8))
+        for node in nodes:
+            try:
+                if node.succeeded():
+                    node.state = DONE
+            except Exception as ex:
+                logging.warning("Failed to get status of {}: {}".format(node, ex))
+    logging.info("{} of {} tasks already completed".format(len([node for node in nodes if node.state == DONE]),
+                                                          len(nodes)))
+
+    def ready(node):
+        return node.state is None and all(parent.state in [DONE, SUCCEEDED] for parent in node.depends_on)
+
+    running = {}
+    with futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            for node in nodes:
+                if len(running) >= jobs:
+                    break
+                if ready(node) and node not in running.values():
+                    logging.info("Starting {}".format(node))
+                    future = executor.submit(_execute, node.stage.task, node.expnums, node.ccd, node.version,
+                                             node.prefix, dry_run, force, options, workdir)
+                    running[future] = node
+            if not running:
+                break
+            finished, _ = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+            for future in finished:
+                node = running.pop(future)
+                try:
+                    success = future.result()
+                except Exception as ex:
+                    logging.error("{} raised {}".format(node, ex))
+                    success = False
+                node.state = success and SUCCEEDED or FAILED
+                logging.info("{} {}".format(node, node.state))
+                if not success:
+                    _block(node)
+
+    summary = {DONE: 0, SUCCEEDED: 0, FAILED: 0, BLOCKED: 0}
+    for node in nodes:
+        summary[node.state is not None and node.state or BLOCKED] += 1
+    return summary
+
+
+def read_triplets(filename):
+    """
+    Read a triplets file, one triplet per line given as three exposure numbers (any further columns are ignored)
+
+    @param filename: name of the file to read.
+    @return: list of triplets
+    """
+    triplets = []
+    for line in open(filename):
+        if line.strip().startswith('#') or len(line.split()) < 3:
+            continue
+        triplets.append([int(expnum) for expnum in line.split()[0:3]])
+    return triplets
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the pipeline stages for a set of triplets on a pool of local processes.')
+    parser.add_argument("triplets",
+                        help="file with one triplet of exposure numbers per line")
+    parser.add_argument("--ccd", "-c",
+                        action="store",
+                        type=int,
+                        nargs='*',
+                        default=None,
+                        help="which ccds to process, default is all")
+    parser.add_argument("--stages",
+                        nargs='+',
+                        default=DEFAULT_STAGES,
+                        choices=[stage.task for stage in STAGES],
+                        help="pipeline stages to run")
+    parser.add_argument("--jobs", "-j",
+                        type=int,
+                        default=os.cpu_count(),
+                        help="number of tasks to run at once")
+    parser.add_argument("--dbimages",
+                        action="store",
+                        default="vos:OSSOS/dbimages",
+                        help='vospace dbimages containerNode')
+    parser.add_argument("--fk", help="add the fk prefix on processing?",
+                        default=False,
+                        action='store_true')
+    parser.add_argument('--type', default='p',
+                        choices=['o', 'p', 's'], help="which type of image")
+    parser.add_argument("--rate_min", default=step3._RATE_MIN, type=float,
+                        help='minimum rate to accept')
+    parser.add_argument('--rate_max', default=step3._RATE_MAX, type=float,
+                        help='maximum rate to accept')
+    parser.add_argument('--angle', default=step3._ANGLE_CENTRE, type=float,
+                        help='angle of x/y motion, West is 0, North 90')
+    parser.add_argument('--width', default=step3._ANGLE_WIDTH, type=float,
+                        help='openning angle of search cone')
+    parser.add_argument("--workdir", default=None,
+                        help="directory to run the tasks in, default is the current directory")
+    parser.add_argument("--verbose", "-v",
+                        action="store_true")
+    parser.add_argument("--debug", '-d',
+                        action='store_true')
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--dry-run", action="store_true")
+
+    cmd_line = " ".join(sys.argv)
+    args = parser.parse_args()
+
+    util.set_logger(args)
+    logging.info("Starting {}".format(cmd_line))
+
+    storage.DBIMAGES = args.dbimages
+    prefix = (args.fk and 'fk') or ''
+
+    nodes = build_graph(read_triplets(args.triplets), args.ccd, stages=args.stages, version=args.type,
+                        prefix=prefix)
+    summary = schedule(nodes, jobs=args.jobs, dry_run=args.dry_run, force=args.force,
+                       options={'rate_min': args.rate_min, 'rate_max': args.rate_max,
+                                'angle': args.angle, 'width': args.width},
+                       workdir=args.workdir)
+    logging.critical("{} tasks: {}".format(len(nodes), ", ".join("{} {}".format(count, state)
+                                                                 for state, count in summary.items())))
+    return (summary[FAILED] + summary[BLOCKED]) > 0 and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -77,18 +77,9 @@ def run(expnum, ccd, version='p', prefix='', dry_run=False, force=False):
             hdu_list.writeto(name)
             uri = storage.dbimages_uri(expnum, ccd, 'p', ext=".obj.fits")
             logging.info(name+" -> "+uri)
-            count = 0
             with open(name):
-              while True:
-                count += 1
-                logging.info("Copy attempt {}".format(count))
-                try:
-                    storage.copy(name, uri)
-                    os.unlink(name)
-                    break
-                except Exception as ex:
-                    if count > 10:
-                        raise ex
+                storage.copy(name, uri)
+            os.unlink(name)
 
             logging.info(message)
         except Exception as e:
@@ -99,8 +90,7 @@ def run(expnum, ccd, version='p', prefix='', dry_run=False, force=False):
             storage.set_status(task, prefix, expnum, version=version, ccd=ccd, status=message)
 
 
-if __name__ == '__main__':
-
+def main():
 
     parser = argparse.ArgumentParser(
         description='Run FITS catalog builder chunk of the OSSOS pipeline')
@@ -133,6 +123,8 @@ if __name__ == '__main__':
                         action="store_true")
     parser.add_argument("--debug", "-d",
                         action="store_true")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of CCD headers to retrieve ahead of the one being processed")
 
     cmd_line = " ".join(sys.argv)
     args = parser.parse_args()
@@ -150,5 +142,15 @@ if __name__ == '__main__':
         else:
            ccdlist = [args.ccd]
 
+        if args.jobs > 1:
+            # retrieve the astrometric headers of the next CCDs while the current one is processed.
+            ccdlist = [ccd for ccd in ccdlist
+                       if args.force or not storage.get_status(task, '', expnum, 'p', ccd)]
+            ccdlist = (ccd for ccd, header in storage.prefetch(lambda this_ccd: storage.get_astheader(expnum, this_ccd),
+                                                               ccdlist, jobs=args.jobs))
         for ccd in ccdlist:
             run(expnum, ccd)
+
+
+if __name__ == '__main__':
+    main()
@@ -127,17 +127,8 @@ def run(expnum,
                     obj_uri = storage.get_uri(expnum, ccd, version=version, ext=ext,
                                               prefix=prefix)
                     obj_filename = basename + "." + ext
-                    count = 0
                     with open(obj_filename, 'r'):
-                        while True:
-                            try:
-                                count += 1
-                                logging.info("Attempt {} to copy {} -> {}".format(count, obj_filename, obj_uri))
-                                storage.copy(obj_filename, obj_uri)
-                                break
-                            except Exception as ex:
-                                if count > 10:
-                                    raise ex
+                        storage.copy(obj_filename, obj_uri)
             logging.info(message)
         except Exception as ex:
             message = str(ex)
@@ -193,6 +184,8 @@ def main():
                         action='store_true')
     parser.add_argument("--force", action="store_true")
     parser.add_argument("--dry-run", action="store_true", help="Do a dry run, not changes to vospce, implies --force")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="number of CCD images to download ahead of the one being processed")
 
     cmd_line = " ".join(sys.argv)
     args = parser.parse_args()
@@ -215,6 +208,12 @@ def main():
                 ccdlist = list(range(0, 40))
         else:
             ccdlist = [args.ccd]
+        if args.jobs > 1:
+            # download the images of the next CCDs while the current one is processed.
+            ccdlist = [ccd for ccd in ccdlist
+                       if args.force or not storage.get_status(task, prefix, expnum, version, ccd)]
+            ccdlist = (ccd for ccd, filename in storage.iter_images(expnum, ccdlist, version=version,
+                                                                   prefix=prefix, jobs=args.jobs))
         for ccd in ccdlist:
             run(expnum,
                 ccd,
@@ -34,7 +34,7 @@ import sys
 
 _FWHM = 4.0
 
-task = util.task()
+task = 'step2'
 dependency = "step1"
 
 
@@ -33,7 +33,7 @@ _RATE_MAX = 15.0
 _ANGLE_CENTRE = 23.0
 _ANGLE_WIDTH = 30.0
 
-task = util.task()
+task = 'step3'
 dependency = 'step2'
 
 
@@ -3,6 +3,7 @@
 Update the astrometric and photometric measurements of an mpc observation based on the header contents of the
 observation.
 """
+from concurrent import futures
 from copy import deepcopy
 import time
 from astropy import units
@@ -11,6 +12,7 @@ import math
 import numpy
 import logging
 import re
+import sys
 import mp_ephem
 from ossos import storage, wcs, astrom
 from ossos import orbfit
@@ -34,7 +36,100 @@ def _flipped_ccd(ccd):
     return ccd < 18 or ccd in [36, 37]
 
 
-def remeasure(mpc_in, reset_pixel_coordinates=True):
+def _frame_key(mpc_obs):
+    """
+    The frame an observation was measured on, parsed from its comment.
+
+    @param mpc_obs: an observation with an OSSOSComment.
+    @return: (expnum, type, ccd) or None if the comment has no frame.
+    """
+    parts = re.search(r'(?P<expnum>\d{7})(?P<type>\S)(?P<ccd>\d\d)', str(mpc_obs.comment.frame))
+    if not parts:
+        return None
+    return int(parts.group('expnum')), parts.group('type'), int(parts.group('ccd'))
+
+
+def _filter_value(header):
+    """
+    The one letter name of the filter an image was taken in, 'w' for the wide gri filter.
+    """
+    filter_value = None
+    for keyword in ['FILTER', 'FILT1 NAME']:
+       filter_value = header.get(keyword, None)
+       if filter_value is not None:
+         if filter_value.startswith('gri'):
+             filter_value = 'w'
+         else:
+             filter_value = filter_value[0]
+         break
+    return filter_value
+
+
+class Frame(object):
+    """
+    One CCD of an exposure, with the headers, calibrations and image needed to remeasure observations made on it.
+
+    Each is retrieved at most once, however many observations are remeasured on the frame.
+    """
+
+    def __init__(self, expnum, ccd, version='p'):
+        """
+        @param expnum: the CFHT exposure number.
+        @param ccd: the CCD the observations are on.
+        @param version: the version (p, s, o) of the exposure the observations were measured on.
+        """
+        self.expnum = expnum
+        self.ccd = ccd
+        self.version = version
+        self.header = _connection_error_wrapper(storage._get_sghead, expnum)[ccd + 1]
+        self.wcs = wcs.WCS(self.header)
+        self._astheader = None
+        self._fwhm = None
+        self._zeropoint = None
+        self._apcor = None
+        self._image = None
+
+    @property
+    def astheader(self):
+        """The header the original astrometry was measured with."""
+        if self._astheader is None:
+            self._astheader = _connection_error_wrapper(storage.get_astheader, self.expnum, self.ccd)
+        return self._astheader
+
+    @property
+    def fwhm(self):
+        if self._fwhm is None:
+            self._fwhm = float(_connection_error_wrapper(storage.get_fwhm, self.expnum, self.ccd))
+        return self._fwhm
+
+    @property
+    def zeropoint(self):
+        """The zeropoint likely used for the original photometry, the new one is PHOTZP in the header."""
+        if self._zeropoint is None:
+            self._zeropoint = _connection_error_wrapper(storage.get_zeropoint, self.expnum, self.ccd)
+        return self._zeropoint
+
+    @property
+    def apcor(self):
+        if self._apcor is None:
+            from ossos.downloads.core import ApcorData
+            try:
+                self._apcor = ApcorData(*storage.get_apcor(self.expnum, self.ccd, version=self.version))
+            except Exception as ex:
+                logging.error("Failed to get apcor for {}{}{:02d}: {}".format(self.expnum, self.version,
+                                                                             self.ccd, ex))
+                self._apcor = ApcorData.from_string("5 25 0.3 0.3")
+        return self._apcor
+
+    @property
+    def image(self):
+        """Name of the local copy of the CCD image."""
+        if self._image is None:
+            self._image = _connection_error_wrapper(storage.get_image, self.expnum, self.ccd, self.version)
+        return self._image
+
+
+def remeasure(mpc_in, reset_pixel_coordinates=True, frame=None, coordinate=None):
     """
     Compute the RA/DEC of the line based on the X/Y in the comment and the WCS of the associated image.
 
@@ -44,7 +139,10 @@ def remeasure(mpc_in, reset_pixel_coordinates=True):
     @type mpc_in: mp_ephem.Observation
     @param reset_pixel_coordinates: try and determine correct X/Y is X/Y doesn't map to correct RA/DEC value
     @type reset_pixel_coordinates: bool
-    @type reset_pixecl_coordinates: bool
+    @param frame: the Frame the observation is on, retrieved here if not given.
+    @type frame: Frame
+    @param coordinate: RA/DEC of the X/Y in the comment, if already computed on frame.
+    @type coordinate: (Quantity, Quantity)
 
     """
     if mpc_in.null_observation:
@@ -64,16 +162,18 @@ def remeasure(mpc_in, reset_pixel_coordinates=True):
     expnum = int(parts.group('expnum'))
     exp_type = parts.group('type')
 
-    try:
-        header = _connection_error_wrapper(storage._get_sghead, expnum)[ccd+1]
-    except IOError as ioerr:
-        logging.error(str(ioerr))
-        logging.error("Failed to get astrometric header for: {}".format(mpc_obs))
-        return mpc_in
-
-    this_wcs = wcs.WCS(header)
-
-    coordinate = this_wcs.xy2sky(mpc_obs.comment.x, mpc_obs.comment.y, usepv=True)
+    if frame is None:
+        try:
+            frame = Frame(expnum, ccd, exp_type)
+        except IOError as ioerr:
+            logging.error(str(ioerr))
+            logging.error("Failed to get astrometric header for: {}".format(mpc_obs))
+            return mpc_in
+    header = frame.header
+    this_wcs = frame.wcs
+
+    if coordinate is None:
+        coordinate = this_wcs.xy2sky(mpc_obs.comment.x, mpc_obs.comment.y, usepv=True)
     mpc_obs.coordinate = coordinate[0].to('degree').value, coordinate[1].to('degree').value
     sep = mpc_in.coordinate.separation(mpc_obs.coordinate)
 
@@ -96,8 +196,7 @@ def remeasure(mpc_in, reset_pixel_coordinates=True):
         logging.warn("sep: {} --> large offset when using comment line X/Y to compute RA/DEC")
         if reset_pixel_coordinates:
            logging.warn("Using RA/DEC and original WCS to compute X/Y and replacing X/Y in comment.".format(sep))
-           header2 = _connection_error_wrapper(storage.get_astheader, expnum, ccd)
-           image_wcs = wcs.WCS(header2)
+           image_wcs = wcs.WCS(frame.astheader)
            (x, y) = image_wcs.sky2xy(mpc_in.coordinate.ra.degree, mpc_in.coordinate.dec.degree, usepv=False)
            mpc_obs.coordinate = this_wcs.xy2sky(x, y, usepv=True)
            mpc_obs.comment.x = x
@@ -109,7 +208,7 @@ def remeasure(mpc_in, reset_pixel_coordinates=True):
     if mpc_obs.comment.mag_uncertainty is not None:
         try:
             merr = float(mpc_obs.comment.mag_uncertainty)
-            fwhm = float(_connection_error_wrapper(storage.get_fwhm, expnum, ccd))
+            fwhm = frame.fwhm
             centroid_err = merr * fwhm * header['PIXSCAL1']
             logging.debug("Centroid uncertainty:  {} {} => {}".format(merr, fwhm, centroid_err))
         except Exception as err:
@@ -187,15 +286,7 @@ def recompute_mag(mpc_in, skip_centroids=False):
 
     ast_header = _connection_error_wrapper(storage._get_sghead, int(expnum))[int(ccd)+1]
 
-    filter_value = None
-    for keyword in ['FILTER', 'FILT1 NAME']:
-       filter_value = ast_header.get(keyword, None)
-       if filter_value is not None:
-         if filter_value.startswith('gri'):
-             filter_value = 'w'
-         else:
-             filter_value = filter_value[0]
-         break
+    filter_value = _filter_value(ast_header)
     # The ZP for the current astrometric lines is the pipeline one.  The new ZP is in the astheader file.
     new_zp = ast_header.get('PHOTZP')
 
@@ -226,21 +317,38 @@ def recompute_mag(mpc_in, skip_centroids=False):
         logging.error("ERROR: {}".format(str(ex)))
         return mpc_obs
 
+    return _update_photometry(mpc_obs, mpc_in, x.value, y.value, mag, merr, filter_value, skip_centroids)
+
+
+def _update_photometry(mpc_obs, mpc_in, x, y, mag, merr, filter_value, skip_centroids=False):
+    """
+    Put a new centroid and magnitude measured on the frame of mpc_in into its copy mpc_obs.
+
+    @param x: the new x centroid, in the frame of the observation.
+    @param y: the new y centroid.
+    @param mag: the new magnitude.
+    @param merr: uncertainty in mag.
+    @param filter_value: the filter the frame was taken in.
+    @return: mpc_obs
+    """
     try:
         if mpc_obs.comment.mag_uncertainty is not None and mpc_obs.comment.mag is not None and math.fabs(mpc_obs.comment.mag - mag) > 3.5 * mpc_obs.comment.mag_uncertainty:
-           logging.warn("recomputed magnitude shift large: {} --> {}".format(mpc_obs.mag, mag[0]))
-        if math.sqrt((x.value - mpc_obs.comment.x) ** 2 + (y.value - mpc_obs.comment.y) ** 2) > 1.9:
+           logging.warn("recomputed magnitude shift large: {} --> {}".format(mpc_obs.mag, mag))
+        if math.sqrt((x - mpc_obs.comment.x) ** 2 + (y - mpc_obs.comment.y) ** 2) > 1.9:
             logging.warn("Centroid shifted ({},{}) -> ({},{})".format(mpc_obs.comment.x,
                                                                       mpc_obs.comment.y,
-                                                                      x.value,
-                                                                      y.value))
+                                                                      x,
+                                                                      y))
     except Exception as ex:
         logging.error(str(ex))
 
     # Don't use the new X/Y for Hand measured entries.  (although call to get_observed_magnitude should have changed)
     if str(mpc_obs.note1) != "H" and not skip_centroids:
-        mpc_obs.comment.x = x.value
-        mpc_obs.comment.y = y.value
+        mpc_obs.comment.x = x
+        mpc_obs.comment.y = y
+
+    if numpy.ma.is_masked(mag):
+        return mpc_obs
 
     try:
         mag = float(mag)
@@ -279,22 +387,7 @@ def run(mpc_file, cor_file,
     logging.info("ASTROMETRY FILE: {} --> {}.tlf".format(mpc_file, cor_file))
     for mpc_in in observations:
       try:
-        if not isinstance(mpc_in.comment, mp_ephem.ephem.OSSOSComment):
-            logging.info(type(mpc_in.comment))
-            logging.info("Skipping: {}".format(mpc_in.to_string()))
-            continue
-        if ((skip_discovery and mpc_in.discovery) or
-                (not skip_discovery and not mpc_in.discovery)):
-            logging.info("Discovery mis-match")
-            logging.info("Skipping: {}".format(mpc_in.to_string()))
-            continue
-        logging.info("="*220)
-        logging.info("   orig: {}".format(mpc_in.to_string()))
-        if mpc_in.comment.astrometric_level == 4:
-            logging.info("Already at maximum AstLevel, skipping.")
-            continue
-        if mpc_in.null_observation:
-            logging.info("Skipping NULL observation.")
+        if _skip(mpc_in, skip_discovery):
             continue
         mpc_obs = remeasure(mpc_in)
         logging.info("new wcs: {}".format(mpc_obs.to_string()))
@@ -307,20 +400,68 @@ def run(mpc_file, cor_file,
         else:
             mpc_mag = mpc_obs
 
-        sep = mpc_in.coordinate.separation(mpc_mag.coordinate)
-        if sep > TOLERANCE:
-            logging.error("Large offset: {} arc-sec".format(sep))
-            logging.error("orig: {}".format(mpc_in.to_string()))
-            logging.error(" new: {}".format(mpc_mag.to_string()))
-            new_comment = "BIG SHIFT HERE"
-            mpc_mag.comment.comment = mpc_mag.comment.comment + " " + new_comment
-        logging.info("new cen: {}".format(mpc_mag.to_string()))
+        _flag_big_shift(mpc_in, mpc_mag)
         original_obs.append(mpc_in)
         modified_obs.append(mpc_mag)
         logging.info("="*220)
       except:
         logging.error("Skipping: {}".format(mpc_in))
 
+    _write_tlf(cor_file, original_obs, modified_obs)
+
+    if not compare_orbits:
+        return True
+    try:
+       compare_orbits(original_obs, modified_obs, cor_file)
+    except Exception as ex:
+       logging.error("Orbit comparison failed: {}".format(ex))
+    logging.info("="*220)
+
+    return True
+
+
+def _skip(mpc_in, skip_discovery=True):
+    """
+    Should this observation be left as it is?
+    """
+    if not isinstance(mpc_in.comment, mp_ephem.ephem.OSSOSComment):
+        logging.info(type(mpc_in.comment))
+        logging.info("Skipping: {}".format(mpc_in.to_string()))
+        return True
+    if ((skip_discovery and mpc_in.discovery) or
+            (not skip_discovery and not mpc_in.discovery)):
+        logging.info("Discovery mis-match")
+        logging.info("Skipping: {}".format(mpc_in.to_string()))
+        return True
+    logging.info("="*220)
+    logging.info("   orig: {}".format(mpc_in.to_string()))
+    if mpc_in.comment.astrometric_level == 4:
+        logging.info("Already at maximum AstLevel, skipping.")
+        return True
+    if mpc_in.null_observation:
+        logging.info("Skipping NULL observation.")
+        return True
+    return False
+
+
+def _flag_big_shift(mpc_in, mpc_mag):
+    """
+    Note in the comment of the remeasured observation if it has moved more than TOLERANCE.
+    """
+    sep = mpc_in.coordinate.separation(mpc_mag.coordinate)
+    if sep > TOLERANCE:
+        logging.error("Large offset: {} arc-sec".format(sep))
+        logging.error("orig: {}".format(mpc_in.to_string()))
+        logging.error(" new: {}".format(mpc_mag.to_string()))
+        new_comment = "BIG SHIFT HERE"
+        mpc_mag.comment.comment = mpc_mag.comment.comment + " " + new_comment
+    logging.info("new cen: {}".format(mpc_mag.to_string()))
+
+
+def _write_tlf(cor_file, original_obs, modified_obs):
+    """
+    Write the observations that were changed to cor_file.tlf
+    """
     optr = open(cor_file + ".tlf", 'w')
     for idx in range(len(modified_obs)):
         inp = original_obs[idx]
@@ -329,13 +470,149 @@ def run(mpc_file, cor_file,
             optr.write(out.to_tnodb()+"\n")
     optr.close()
 
-    if not compare_orbits:
-        return True
+
+def _remeasure_all(observations, frame, reset_pixel_coordinates=True):
+    """
+    Remeasure observations all made on frame, converting their X/Y to RA/DEC in one call to the WCS.
+    """
+    x = numpy.array([float(mpc_obs.comment.x) for mpc_obs in observations])
+    y = numpy.array([float(mpc_obs.comment.y) for mpc_obs in observations])
+    ra, dec = frame.wcs.xy2sky(x, y, usepv=True)
+    return [remeasure(mpc_obs, reset_pixel_coordinates=reset_pixel_coordinates, frame=frame,
+                      coordinate=(ra[idx], dec[idx]))
+            for idx, mpc_obs in enumerate(observations)]
+
+
+def recompute_mags(observations, frame, skip_centroids=False):
+    """
+    Recompute the magnitudes of observations all made on frame, with one call to photometry for the
+    observations that are centroided and one for those that are not.
+
+    @param observations: the observations to remeasure.
+    @param frame: the Frame they were measured on.
+    @param skip_centroids: keep the X/Y of the observations rather than the new centroids.
+    @return: list of updated copies of the observations.
+    """
+    from ossos import daophot
+
+    result = [deepcopy(mpc_in) for mpc_in in observations]
+    # The ZP for the current astrometric lines is the pipeline one.  The new ZP is in the astheader file.
+    new_zp = frame.header.get('PHOTZP', None)
     try:
-       compare_orbits(original_obs, modified_obs, cor_file)
+        if math.fabs(new_zp - frame.zeropoint) > 0.3:
+            logging.warn("Large change in zeropoint detected: {}  -> {}".format(frame.zeropoint, new_zp))
     except Exception as ex:
-       logging.error("Orbit comparison failed: {}".format(ex))
-    logging.info("="*220)
+        logging.error(str(ex))
+    groups = {}
+    for idx, mpc_obs in enumerate(observations):
+        if not mpc_obs.null_observation:
+            groups.setdefault(not skip_centroids and mpc_obs.note1 != "H", []).append(idx)
+
+    filter_value = _filter_value(frame.header)
+    for centroid, indices in list(groups.items()):
+        try:
+            phot = daophot.phot_mag(frame.image,
+                                    [float(observations[idx].comment.x) for idx in indices],
+                                    [float(observations[idx].comment.y) for idx in indices],
+                                    aperture=frame.apcor.aperture,
+                                    sky=frame.apcor.sky,
+                                    swidth=frame.apcor.swidth,
+                                    apcor=frame.apcor.apcor,
+                                    zmag=new_zp,
+                                    maxcount=float(frame.header.get("MAXCOUNT", 30000)),
+                                    extno=0,
+                                    centroid=centroid)
+        except Exception as ex:
+            logging.error("ERROR: {}".format(str(ex)))
+            continue
+        if not frame.apcor.valid:
+            logging.error("No valid apcor for {}{}{:02d}".format(frame.expnum, frame.version, frame.ccd))
+        for row, idx in zip(phot, indices):
+            result[idx] = _update_photometry(result[idx], observations[idx], float(row['XCENTER']),
+                                             float(row['YCENTER']), row['MAG'], row['MERR'], filter_value,
+                                             skip_centroids)
+    return result
+
+
+def remeasure_frame(key, observations, skip_mags=False, skip_centroids=False):
+    """
+    Remeasure the astrometry, and photometry, of all the observations made on one frame.
+
+    The headers and image of the frame are retrieved once for all of the observations.
+
+    @param key: (expnum, type, ccd) of the frame.
+    @param observations: the observations made on the frame.
+    @param skip_mags: Should we skip recomputing the magnitude of sources?
+    @param skip_centroids: keep the X/Y of the observations rather than the new centroids.
+    @return: list of the remeasured observations, None for those that could not be remeasured.
+    """
+    expnum, exp_type, ccd = key
+    try:
+        frame = Frame(expnum, ccd, exp_type)
+        mpc_obs = _remeasure_all(observations, frame)
+        if not skip_mags:
+            mpc_obs = _remeasure_all(recompute_mags(mpc_obs, frame, skip_centroids=skip_centroids), frame,
+                                     reset_pixel_coordinates=not skip_centroids)
+    except Exception as ex:
+        logging.error("Skipping {} observations on {}{}{:02d}: {}".format(len(observations), expnum, exp_type,
+                                                                          ccd, ex))
+        return [None for mpc_in in observations]
+
+    for mpc_in, mpc_mag in zip(observations, mpc_obs):
+        _flag_big_shift(mpc_in, mpc_mag)
+    return mpc_obs
+
+
+def run_batch(mpc_files, result_dir=".", skip_discovery=True, skip_mags=False, skip_centroids=False, jobs=4):
+    """
+    Update all the astrometric lines of a release, grouped by the frame they were measured on, so the
+    work done scales with the number of frames rather than the number of lines.
+
+    The frames are remeasured in a pool of worker processes.
+
+    :param mpc_files: the files containing the astrometric lines to be updated.
+    :param result_dir: where the updated astrometry, basename.tlf for each file, is written.
+    :param skip_mags: Should we skip recomputing the magnitude of sources?
+    :param jobs: number of frames to remeasure at once.
+    """
+    observations = []
+    frames = {}
+    for file_idx, mpc_file in enumerate(mpc_files):
+        logging.info("ASTROMETRY FILE: {}".format(mpc_file))
+        observations.append(mp_ephem.EphemerisReader().read(mpc_file))
+        for obs_idx, mpc_in in enumerate(observations[-1]):
+            if _skip(mpc_in, skip_discovery):
+                continue
+            key = _frame_key(mpc_in)
+            if key is None:
+                logging.error("Failed to parse expnum from frame info in comment line")
+                continue
+            frames.setdefault(key, []).append((file_idx, obs_idx))
+    logging.info("Remeasuring {} observations on {} frames".format(sum([len(v) for v in list(frames.values())]),
+                                                                  len(frames)))
+
+    keys = sorted(frames)
+    frame_observations = [[observations[file_idx][obs_idx] for file_idx, obs_idx in frames[key]] for key in keys]
+    if jobs > 1:
+        with futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(remeasure_frame, keys, frame_observations,
+                                        [skip_mags] * len(keys), [skip_centroids] * len(keys)))
+    else:
+        results = [remeasure_frame(key, frame_observations[idx], skip_mags, skip_centroids)
+                   for idx, key in enumerate(keys)]
+
+    modified = {}
+    for key, result in zip(keys, results):
+        for (file_idx, obs_idx), mpc_mag in zip(frames[key], result):
+            if mpc_mag is not None:
+                modified[(file_idx, obs_idx)] = mpc_mag
+
+    for file_idx, mpc_file in enumerate(mpc_files):
+        cor_file = os.path.join(result_dir, os.path.splitext(os.path.basename(mpc_file))[0])
+        indices = [obs_idx for obs_idx in range(len(observations[file_idx])) if (file_idx, obs_idx) in modified]
+        _write_tlf(cor_file,
+                   [observations[file_idx][obs_idx] for obs_idx in indices],
+                   [modified[(file_idx, obs_idx)] for obs_idx in indices])
 
     return True
 
@@ -437,13 +714,17 @@ def main():
     entries to be consistent with the current best estimate for the astrometric and photometric calibrations.
     """
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument('ast_file', help="An MPC file to update.")
+    parser.add_argument('ast_file', nargs='+', help="MPC files to update.")
     parser.add_argument('--discovery', help="Only process the discovery images.", action='store_true', default=False)
     parser.add_argument('--result_base_name', help="base name for remeasurement results (defaults to basename of input)",
                         default=None)
     parser.add_argument('--skip-mags', action="store_true", help="Recompute magnitudes.", default=False)
     parser.add_argument('--skip-centroids', action="store_true", help="Recompute centroids.", default=False)
     parser.add_argument('--compare-orbits', action='store_true', help="Compute/Compare pre and post remeasure orbits?", default=False)
+    parser.add_argument('--batch', action='store_true', default=False,
+                        help="Remeasure all the files together, one frame at a time.")
+    parser.add_argument('--jobs', type=int, default=4, help="Number of frames to remeasure at once in --batch mode.")
+    parser.add_argument('--result-dir', default='.', help="Directory for the --batch mode results.")
     parser.add_argument('--debug', action='store_true')
 
     args = parser.parse_args()
@@ -456,15 +737,26 @@ def main():
     logger = logging.getLogger('update_astrom')
     coloredlogs.install(level=level)
 
-    if args.result_base_name is None:
-        base_name = os.path.splitext(os.path.basename(args.ast_file))[0]
-    else:
-        base_name = args.result_base_name
-    run(args.ast_file, base_name, 
-        skip_discovery=not args.discovery, 
-        skip_mags=args.skip_mags, 
-        skip_centroids=args.skip_centroids, 
-        compare_orbits=args.compare_orbits)
+    if args.batch:
+        if args.compare_orbits:
+            logging.warning("Orbits are not compared in --batch mode.")
+        run_batch(args.ast_file, result_dir=args.result_dir,
+                  skip_discovery=not args.discovery,
+                  skip_mags=args.skip_mags,
+                  skip_centroids=args.skip_centroids,
+                  jobs=args.jobs)
+        return
+
+    for ast_file in args.ast_file:
+        if args.result_base_name is None:
+            base_name = os.path.splitext(os.path.basename(ast_file))[0]
+        else:
+            base_name = args.result_base_name
+        run(ast_file, base_name,
+            skip_discovery=not args.discovery,
+            skip_mags=args.skip_mags,
+            skip_centroids=args.skip_centroids,
+            compare_orbits=args.compare_orbits)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,8 @@
 import fcntl
 import os
-from numpy import random
 from astropy.table import Table
 import numpy
 from . import storage
-from scipy import interpolate
 
 
 class MatchFile(object):
@@ -39,7 +37,13 @@ class Range(object):
     """A custom object that is initialized with a range and when called returns a random value in that range."""
 
     def __init__(self, minimum, maximum=None, seed=None, func=None):
-        random.seed(seed)
+        """
+        :param minimum: the low end of the range, or a (min, max) tuple.
+        :param maximum: the high end of the range.
+        :param seed: seed, or numpy.random.Generator shared with other Ranges, for the random draws.
+        :param func: un-normalized probability density to sample from, uniform if None.
+        """
+        self.random = numpy.random.default_rng(seed)
         if maximum is None:
             if len(minimum) == 2:
                 maximum = minimum[1]
@@ -59,15 +63,24 @@ class Range(object):
         How should the values in range be sampled, uniformly or via some function.
         :return:
         """
+        return self.sample()
+
+    def sample(self, size=None):
+        """
+        Draw size values from the range at once, uniformly or via the inverse of the cumulative of func.
+
+        @param size: number of values to draw, a scalar is returned if None.
+        @return: numpy.array
+        """
         if self.func is None:
-            return random.uniform(self.min, self.max)
+            return self.random.uniform(self.min, self.max, size)
         if self._dist is None:
             x = numpy.arange(self.min, self.max, (self.max-self.min)/1000.0)
             p = self.func(x).cumsum()
             p -= p.min()
             p /= p.max()
-            self._dist = interpolate.interp1d(p, x)
-        return self._dist(random.random())
+            self._dist = (p, x)
+        return numpy.interp(self.random.random(size), *self._dist)
 
     def __call__(self, new=True):
         if new or self.value is None:
@@ -123,27 +136,42 @@ class KBOGenerator(object):
         return {'x': self.x(), 'y': self.y(), 'mag': self.mag(), 'sky_rate': self.rate(), 'angle': self.angle(),
                 'id': int(self.id)}
 
+    def sample(self):
+        """
+        Draw all the remaining KBOs at once.
+
+        :return: Table with the columns x, y, mag, sky_rate, angle and id.
+        """
+        n = max(self._n, 0)
+        first = self._id is None and 1 or self._id + 1
+        kbos = Table([self.x.sample(n), self.y.sample(n), self.mag.sample(n), self.rate.sample(n),
+                      self.angle.sample(n), numpy.arange(first, first + n, dtype='int64')],
+                     names=('x', 'y', 'mag', 'sky_rate', 'angle', 'id'))
+        self._id = first + n - 1
+        self._n = 0
+        return kbos
+
     @classmethod
     def _step(cls, mag):
-        low = mag * 0 + 0.3
-        high = mag * 0 + 0.7
-        g = [mag < 23.3] * low + [mag >= 23.3] * high
-        return g[0]
+        return numpy.where(mag < 23.3, 0.3, 0.7)
 
     @classmethod
-    def get_kbos(cls, n, rate, angle, mag, x, y, filename=None):
+    def get_kbos(cls, n, rate, angle, mag, x, y, filename=None, seed=None):
+        """
+        Generate n artificial KBOs with properties drawn from the given ranges.
 
-        kbos = Table(names=('x', 'y', 'mag', 'sky_rate', 'angle', 'id'),
-                     dtype=('float64', 'float64', 'float64', 'float64', 'float64', 'int64'))
+        :param seed: seed for the random draws, the same seed gives the same KBOs.
+        :return: Table of KBOs
+        """
+        rng = numpy.random.default_rng(seed)
 
         # generate the KBOs.
-        for kbo in cls(n,
-                       rate=Range(rate, func=lambda value: value**0.25),
-                       angle=Range(angle),
-                       mag=Range(mag, func=cls._step),
-                       x=Range(x),
-                       y=Range(y)):
-            kbos.add_row(kbo)
+        kbos = cls(n,
+                   rate=Range(rate, func=lambda value: value**0.25, seed=rng),
+                   angle=Range(angle, seed=rng),
+                   mag=Range(mag, func=cls._step, seed=rng),
+                   x=Range(x, seed=rng),
+                   y=Range(y, seed=rng)).sample()
 
         # Write to a local file if filename given.
         if filename is not None:
@@ -0,0 +1,183 @@
+"""
+Retry policy and transfer metrics for VOSpace and CADC data service requests.
+"""
+import errno
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from cadcutils import exceptions
+
+from .gui import config
+from .gui import logger
+
+# errors that will not go away by trying again.
+NO_RETRY_EXCEPTIONS = (exceptions.NotFoundException,
+                       exceptions.UnauthorizedException,
+                       exceptions.ForbiddenException,
+                       exceptions.AlreadyExistsException,
+                       exceptions.BadRequestException)
+
+NO_RETRY_ERRNOS = (errno.ENOENT, errno.EACCES, errno.EPERM, errno.EEXIST,
+                   errno.EISDIR, errno.ENOTDIR, 400, 401, 403, 404, 409)
+
+
+class TransferMetrics(object):
+    """
+    Record the latency, size and number of retries of each transfer.
+
+    Each transfer is written as a JSON record to the 'ossos.metrics' logger, and to the file given by the
+    METRICS.FILENAME configuration value if that is set, and accumulated per URI for reporting.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.logger = logging.getLogger('ossos.metrics')
+        self._lock = threading.Lock()
+        self._handler = None
+        self.totals = {}
+
+    def _attach_handler(self):
+        filename = self.filename
+        if filename is None:
+            filename = config.read("METRICS.FILENAME")
+        if not filename or self._handler is not None:
+            return
+        self._handler = logging.FileHandler(os.path.expanduser(filename))
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger.addHandler(self._handler)
+        self.logger.setLevel(logging.INFO)
+
+    def record(self, uri, operation, latency, nbytes=None, attempts=1, error=None):
+        """
+        Record a transfer.
+
+        @param uri: the source of the transfer.
+        @param operation: what was done, eg. 'copy'
+        @param latency: wall clock seconds taken, including retries.
+        @param nbytes: number of bytes transferred, if known.
+        @param attempts: number of attempts made.
+        @param error: the error that ended the transfer, None on success.
+        """
+        entry = {'time': time.time(),
+                 'pid': os.getpid(),
+                 'uri': uri,
+                 'operation': operation,
+                 'latency': round(latency, 4),
+                 'bytes': nbytes,
+                 'attempts': attempts,
+                 'retries': attempts - 1,
+                 'status': error is None and 'success' or 'failed',
+                 'error': error is not None and str(error) or None}
+        with self._lock:
+            self._attach_handler()
+            total = self.totals.setdefault(uri, {'transfers': 0, 'latency': 0.0, 'bytes': 0,
+                                                 'retries': 0, 'failures': 0})
+            total['transfers'] += 1
+            total['latency'] += latency
+            total['bytes'] += nbytes or 0
+            total['retries'] += attempts - 1
+            total['failures'] += error is not None and 1 or 0
+        self.logger.info(json.dumps(entry))
+
+    def summary(self):
+        """
+        Totals of latency, bytes, retries and failures per URI.
+
+        @rtype: dict
+        """
+        with self._lock:
+            return dict((uri, dict(total)) for uri, total in self.totals.items())
+
+
+metrics = TransferMetrics()
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff, with jitter, for a bounded number of attempts.
+
+    Errors that can not be fixed by trying again (missing files, permission problems) are raised immediately.
+    """
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, jitter=0.5,
+                 no_retry_exceptions=NO_RETRY_EXCEPTIONS, no_retry_errnos=NO_RETRY_ERRNOS):
+        """
+        @param max_attempts: total number of attempts before the last error is raised.
+        @param base_delay: seconds to wait after the first failure, doubled after each further failure.
+        @param max_delay: upper limit on the wait between attempts.
+        @param jitter: fraction by which the wait is randomly varied, so parallel clients don't retry in step.
+        @param no_retry_exceptions: exception classes that are never retried.
+        @param no_retry_errnos: errno values of EnvironmentErrors that are never retried.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.no_retry_exceptions = no_retry_exceptions
+        self.no_retry_errnos = no_retry_errnos
+
+    def should_retry(self, ex):
+        """
+        Is the given error worth trying again?
+
+        @param ex: the exception raised by the last attempt.
+        @rtype: bool
+        """
+        if isinstance(ex, self.no_retry_exceptions):
+            return False
+        if isinstance(ex, EnvironmentError) and getattr(ex, 'errno', None) in self.no_retry_errnos:
+            return False
+        return True
+
+    def delay(self, attempt):
+        """
+        How long to wait after the given (1 based) failed attempt.
+
+        @param attempt: number of the attempt that just failed.
+        @return: seconds
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) until it succeeds, a non-retryable error is raised or max_attempts is reached.
+
+        @param func: the callable to try.
+        @param uri: (keyword only) the URI being transferred, used to record metrics.
+        @param operation: (keyword only) name of the operation, used to record metrics.
+        @param size: (keyword only) callable, given the result, that returns the number of bytes transferred.
+        @return: the result of func.
+        """
+        uri = kwargs.pop('uri', None)
+        operation = kwargs.pop('operation', getattr(func, '__name__', str(func)))
+        size = kwargs.pop('size', None)
+        start = time.time()
+        attempt = 1
+        while True:
+            try:
+                result = func(*args, **kwargs)
+            except Exception as ex:
+                if attempt >= self.max_attempts or not self.should_retry(ex):
+                    if uri is not None:
+                        metrics.record(uri, operation, time.time() - start, attempts=attempt, error=ex)
+                    raise ex
+                delay = self.delay(attempt)
+                logger.debug("{} {} attempt {} failed with {}, retrying in {:.1f}s".format(
+                    operation, uri, attempt, ex, delay))
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if uri is not None:
+                nbytes = None
+                if size is not None:
+                    try:
+                        nbytes = size(result)
+                    except Exception:
+                        pass
+                metrics.record(uri, operation, time.time() - start, nbytes=nbytes, attempts=attempt)
+            return result
@@ -2,6 +2,7 @@
 import datetime
 import os
 import pprint
+import tempfile
 import warnings
 import numpy
 import requests
@@ -24,6 +25,41 @@ RESPONSE_FORMAT = 'tsv'
 NEW_LINE = '\r\n'
 
 
+def predict_ephemeris(orbit, mjds):
+    """
+    Predict the location of a body at many dates, computing each distinct date only once.
+
+    :param orbit: the orbit to predict from, an Orbfit or anything with the same predict interface.
+    :param mjds: UTC MJD of each prediction.
+    :return: dictionary of ra, dec, pa (degree), dra and ddec (arcsec) Quantity arrays, one entry per mjd.
+    """
+    unique_mjds, index = numpy.unique(numpy.asarray(mjds, dtype='float64'), return_inverse=True)
+    values = numpy.zeros((len(unique_mjds), 5))
+    kwargs = {}
+    if hasattr(orbit, 'abg'):
+        # Orbfit writes the abg orbit to a new file for every prediction unless given one to re-use.
+        kwargs['abg_file'] = tempfile.NamedTemporaryFile(suffix='.abg')
+        kwargs['abg_file'].write(bytes(orbit.abg, 'utf-8'))
+        kwargs['abg_file'].flush()
+    try:
+        for idx, mjd in enumerate(unique_mjds):
+            orbit.predict(Time(mjd, format='mjd', scale='utc'), **kwargs)
+            values[idx] = (orbit.coordinate.ra.to(units.degree).value,
+                           orbit.coordinate.dec.to(units.degree).value,
+                           orbit.pa.to(units.degree).value,
+                           orbit.dra.to(units.arcsec).value,
+                           orbit.ddec.to(units.arcsec).value)
+    finally:
+        if 'abg_file' in kwargs:
+            kwargs['abg_file'].close()
+    values = values[index]
+    return {'ra': values[:, 0] * units.degree,
+            'dec': values[:, 1] * units.degree,
+            'pa': values[:, 2] * units.degree,
+            'dra': values[:, 3] * units.arcsec,
+            'ddec': values[:, 4] * units.arcsec}
+
+
 class TracksParser(object):
 
     def __init__(self, inspect=True, skip_previous=False, lunation_count=0, telescope_instrument='CFHT/MegaCam'):
@@ -299,7 +335,7 @@ class SSOSParser(object):
         :param ssos_result_filename_or_lines:
         :param mpc_observations: a list of mpc.Observation objects used to retrieve the SSOS observations
         """
-        table_reader = ascii.get_reader(Reader=ascii.Basic)
+        table_reader = ascii.get_reader(ascii.Basic)
         table_reader.inconsistent_handler = self._skip_missing_data
         table_reader.header.splitter.delimiter = '\t'
         table_reader.data.splitter.delimiter = '\t'
@@ -322,23 +358,39 @@ class SSOSParser(object):
 
         warnings.filterwarnings('ignore')
         logger.info("Loading {} observations\n".format(len(ssos_table)))
-        expnums_examined = []
-        for row in ssos_table:
-            # Trim down to OSSOS-specific images
 
+        # Trim down to OSSOS-specific images that have a dbimages entry.
+        # For CFHT/MegaCam strip off the trailing character to get the exposure number.
+        images = numpy.array(ssos_table['Image'], dtype=str)
+        expnums = numpy.array([image[:-1] for image in images])
+        keep = (numpy.isin(numpy.array(ssos_table['Filter'], dtype=str), parameters.OSSOS_FILTERS) &
+                ~numpy.char.startswith(numpy.array(ssos_table['Image_target'], dtype=str), 'WP') &
+                numpy.array([expnum in dbimage_list for expnum in expnums], dtype=bool))
+        logger.debug("{} of {} rows passed the filter, target name and dbimage list checks".format(
+            keep.sum(), len(keep)))
+
+        # Predict the location at all the remaining epochs at once.
+        ephemeris = predict_ephemeris(orbit, numpy.array(ssos_table['MJD'])[keep])
+        max_error = float(os.environ.get("MOP_MAX_ERROR", 15))*units.arcminute
+        too_uncertain = (ephemeris['dra'] > max_error) | (ephemeris['ddec'] > max_error)
+        for mjd in numpy.array(ssos_table['MJD'])[keep][too_uncertain]:
+            print("Skipping entry as orbit uncertainty at date {} is large.".format(
+                Time(mjd, format='mjd', scale='utc')))
+        rows = numpy.flatnonzero(keep)[~too_uncertain]
+        ephemeris = dict((key, value[~too_uncertain]) for key, value in ephemeris.items())
+
+        # only one row of each exposure is examined: the first that SSOIS placed on a CCD or, if there is
+        # none, the first of the exposure.
+        off_ccd = numpy.array(ssos_table['Ext'], dtype=int)[rows] < 1
+        order = numpy.lexsort((numpy.arange(len(rows)), off_ccd))
+        unused, first = numpy.unique(expnums[rows][order], return_index=True)
+        first = numpy.sort(order[first])
+
+        for idx in first:
+            row = ssos_table[rows[idx]]
             logger.debug("Checking row: {}".format(row))
-            if (row['Filter'] not in parameters.OSSOS_FILTERS) or row['Image_target'].startswith('WP'):
-                logger.debug("Failed filter / target name check")
-                continue
-
-            # check if a dbimages object exists
-            # For CFHT/MegaCam strip off the trailing character to get the exposure number.
             ftype = row['Image'][-1]
             expnum = row['Image'][:-1]
-            if str(expnum) not in dbimage_list:
-                logger.debug("Expnum: {} Failed dbimage list check".format(expnum))
-                continue
-            logger.debug("Expnum: {} Passed dbimage list check".format(expnum))
             # The file extension is the ccd number + 1 , or the first extension.
             ccd = int(row['Ext'])-1
             if 39 < ccd < 0 or ccd < 0:
@@ -349,29 +401,14 @@ class SSOSParser(object):
             dec = row['Object_Dec'] * units.degree
             ssois_coordinate = SkyCoord(ra, dec)
             mjd = row['MJD'] * units.day
-
-            # if not 0 < x.value < 2060 or not 0 < y.value < 4700:
-            #    continue
-
-            obs_date = Time(mjd, format='mjd', scale='utc')
-            logger.info("Calling predict")
-            orbit.predict(obs_date)
-            logger.info("Done calling predict")
-            max_error = float(os.environ.get("MOP_MAX_ERROR", 15))*units.arcminute
-            if orbit.dra > max_error or orbit.ddec > max_error:
-                print("Skipping entry as orbit uncertainty at date {} is large.".format(obs_date))
-                continue
-            if expnum in expnums_examined:
-                logger.debug("Already checked this exposure.")
-                continue
-            expnums_examined.append(expnum)
+            predicted_ra = ephemeris['ra'][idx]
+            predicted_dec = ephemeris['dec'][idx]
 
             logger.debug(("SSOIS Prediction: exposure:{} ext:{} "
                           "ra:{} dec:{} x:{} y:{}").format(expnum, ccd, ra, dec, x, y))
 
             logger.debug(("Orbfit Prediction: "
-                          "ra:{} dec:{} ").format(orbit.coordinate.ra.to(units.degree),
-                                                  orbit.coordinate.dec.to(units.degree)))
+                          "ra:{} dec:{} ").format(predicted_ra, predicted_dec))
             logger.info("Building Observation")
             observation = SSOSParser.build_source_reading(expnum, ccd, ftype=ftype)
             observation.mjd = mjd
@@ -399,16 +436,16 @@ class SSOSParser(object):
             observations.append(observation)
             null_observation = observation.rawname in self.null_observations
 
-            ddec = orbit.ddec + abs(orbit.coordinate.dec - ssois_coordinate.dec)
-            dra = orbit.dra + abs(orbit.coordinate.ra - ssois_coordinate.ra)
+            ddec = ephemeris['ddec'][idx] + abs(predicted_dec - ssois_coordinate.dec)
+            dra = ephemeris['dra'][idx] + abs(predicted_ra - ssois_coordinate.ra)
 
             logger.info(" Building SourceReading .... \n")
             source_reading = astrom.SourceReading(x=x, y=y, x0=x, y0=y,
-                                                  ra=orbit.coordinate.ra.to(units.degree).value,
-                                                  dec=orbit.coordinate.dec.to(units.degree).value,
+                                                  ra=predicted_ra.value,
+                                                  dec=predicted_dec.value,
                                                   xref=x, yref=y, obs=observation,
                                                   ssos=True, from_input_file=from_input_file,
-                                                  dx=dra, dy=ddec, pa=orbit.pa,
+                                                  dx=dra, dy=ddec, pa=ephemeris['pa'][idx],
                                                   null_observation=null_observation)
             source_reading.mpc_observation = mpc_observation
             source_readings.append(source_reading)
@@ -725,7 +762,6 @@ class Query(object):
             error_ellipse=error_ellipse)
         self.headers = {'User-Agent': 'OSSOS'}
 
-    def get(self):
     def get(self):
         """
         :return: A string containing the TSV result from SSOS
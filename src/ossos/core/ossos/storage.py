@@ -9,7 +9,9 @@ import tempfile
 import logging
 import warnings
 from glob import glob
+import threading
 import time
+from concurrent import futures
 
 import requests as requests_module
 import vos
@@ -28,6 +30,8 @@ from six import BytesIO
 
 from . import coding
 from . import util
+from .cache import PersistentCache, TileCache
+from .retry import RetryPolicy, metrics
 from .downloads.cutouts.calculator import CoordinateConverter
 from .gui import config
 from .gui import logger
@@ -87,7 +91,20 @@ astheaders = {}
 sgheaders = {}
 fwhm = {}
 zmag = {}
+# processing tags of each exposure, expnum: (time fetched from VOSpace, props), see get_tags.
 tags = {}
+# listings of dbimages containers, uri: {'names', 'mtime', 'checked'}, see list_dbimages.
+dbimages_index = {}
+
+# headers and image metadata persisted between processes, backs the in-memory holders above.
+header_cache = PersistentCache()
+
+# image cutouts kept on local disk so repeated requests around the same source are not re-fetched from VOSpace.
+tile_cache = TileCache()
+
+# retry policy for transfers to/from VOSpace.  copy is the single file transfer used by everything else and is the
+# only place a transfer is retried, the functions built on it pass failures straight through.
+copy_policy = RetryPolicy(max_attempts=9, base_delay=2.0, max_delay=30.0)
 
 APCOR_EXT = "apcor"
 ZEROPOINT_USED_EXT = "zeropoint.used"
@@ -95,6 +112,9 @@ PSF_EXT = "psf.fits"
 FITS_EXT = ".fits.fz"
 FITS_EXT = ".fits"
 
+# size of the reads used when streaming a file from VOSpace.
+STREAM_CHUNK_SIZE = 1024 * 1024
+
 
 class MyRequests(object):
     def __init__(self):
@@ -238,9 +258,13 @@ def populate(dataset_name, data_web_service_url=DATA_WEB_SERVICE + "CFHT"):
     """
 
     data_dest = get_uri(dataset_name, version='o', ext=FITS_EXT)
-    data_source = "%s/%so.{}" % (data_web_service_url, dataset_name, FITS_EXT)
+    data_source = "%s/%so%s" % (data_web_service_url, dataset_name, FITS_EXT)
 
     mkdir(os.path.dirname(data_dest))
+    # the listing of dbimages may not have this exposure yet, list it again when next asked.
+    dbimages = os.path.dirname(os.path.dirname(data_dest))
+    dbimages_index.pop(dbimages, None)
+    header_cache.invalidate("listing:{}".format(dbimages))
 
     try:
         client.link(data_source, data_dest)
@@ -391,16 +415,96 @@ def _set_tags(expnum, keys, values=None):
         value = values[idx]
         node.props[tag] = value
     client.add_props(node)
-    return client.get_node(uri, force=True)
+    node = client.get_node(uri, force=True)
+    tags[str(expnum)] = (time.time(), node.props)
+    return node
+
+
+class TagBatch(object):
+    """
+    Collect the tags set by set_tag, set_tags and set_status and write them, with one node update per exposure,
+    when the batch is closed::
+
+        with storage.TagBatch():
+            for ccd in ccds:
+                storage.set_status('step1', '', expnum, 'p', ccd, status)
+
+    Tags set in the batch are visible to get_tag/get_status straight away.  Batches can be nested, the tags are
+    written when the outermost batch is closed.
+    """
+
+    _local = threading.local()
+
+    def __init__(self):
+        self.pending = {}
+        self.outer = None
+
+    @classmethod
+    def current(cls):
+        """
+        The batch open in this thread, or None.
+
+        @rtype: TagBatch
+        """
+        return getattr(cls._local, 'batch', None)
+
+    def add(self, expnum, props):
+        """
+        Queue the key/value pairs in props to be set as tags on expnum.
+        """
+        pending = self.pending.setdefault(str(expnum), {})
+        for key, value in props.items():
+            pending[tag_uri(key)] = value
+
+    def get(self, expnum, uri):
+        """
+        Look for a tag queued in this batch, or the batches it is nested in.
+
+        @return: (found, value)
+        """
+        batch = self
+        while batch is not None:
+            if uri in batch.pending.get(str(expnum), {}):
+                return True, batch.pending[str(expnum)][uri]
+            batch = batch.outer
+        return False, None
+
+    def flush(self):
+        """
+        Write the queued tags to VOSpace.
+        """
+        pending, self.pending = self.pending, {}
+        for expnum, props in pending.items():
+            _set_tags(expnum, list(props.keys()), list(props.values()))
+
+    def __enter__(self):
+        self.outer = TagBatch.current()
+        TagBatch._local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        TagBatch._local.batch = self.outer
+        if self.outer is not None:
+            for expnum, props in self.pending.items():
+                self.outer.add(expnum, props)
+            self.pending = {}
+        else:
+            self.flush()
 
 
 def set_tags(expnum, props):
     """Assign the key/value pairs in props as tags on on the given expnum.
 
+    If a TagBatch is open the tags are written when the batch is closed.
+
     @param expnum: str
     @param props: dict
     @return: success
     """
+    batch = TagBatch.current()
+    if batch is not None:
+        batch.add(expnum, props)
+        return None
     # now set all the props
     return _set_tags(expnum, list(props.keys()), list(props.values()))
 
@@ -438,11 +542,23 @@ def get_tag(expnum, key):
     """
 
     uri = tag_uri(key)
+    batch = TagBatch.current()
+    if batch is not None:
+        found, value = batch.get(expnum, uri)
+        if found:
+            return value
+    # only tags that are present are answered from the tags already read, a missing tag may have been set since
+    # by another process so it is always looked for in VOSpace.
     force = uri not in get_tags(expnum)
     value = get_tags(expnum, force=force).get(uri, None)
     return value
 
 
+def _tags_are_fresh(expnum):
+    fetched = tags.get(str(expnum), (None, None))[0]
+    return fetched is not None and time.time() - fetched < float(config.read("STORAGE.TAG_CACHE_TTL"))
+
+
 def get_process_tag(program, ccd, version='p'):
     """
     make a process tag have a suffix indicating which ccd its for.
@@ -456,14 +572,65 @@ def get_process_tag(program, ccd, version='p'):
 
 def get_tags(expnum, force=False):
     """
+    Get the processing tags of an exposure.
 
-    @param expnum:
-    @param force:
+    @param expnum: the exposure whose dbimages container holds the tags.
+    @param force: read the tags from VOSpace, rather than using those read within STORAGE.TAG_CACHE_TTL seconds.
     @return: dict
     @rtype: dict
     """
+    if not force and _tags_are_fresh(expnum):
+        return tags[str(expnum)][1]
     uri = os.path.join(DBIMAGES, str(expnum))
-    return client.get_node(uri, force=force).props
+    props = client.get_node(uri, force=force).props
+    if force:
+        tags[str(expnum)] = (time.time(), props)
+    return props
+
+
+def prefetch_tags(expnums, jobs=8):
+    """
+    Read the processing tags of a list of exposures, several at once, so that the get_tag and get_status calls
+    that follow are answered without a round trip to VOSpace.
+
+    @param expnums: the exposures to read the tags of.
+    @param jobs: number of exposures to read concurrently.
+    @return: dict of expnum: tags, exposures whose tags could not be read are left out.
+    """
+    def fetch(expnum):
+        return client.get_node(os.path.join(DBIMAGES, str(expnum)), force=True).props
+
+    result = {}
+    for expnum, props in prefetch(fetch, sorted(set(str(expnum) for expnum in expnums)), jobs=jobs):
+        if props is not None:
+            tags[expnum] = (time.time(), props)
+            result[expnum] = props
+    return result
+
+
+def get_node_date(uri, force=True):
+    """
+    Get the modification date of a VOSpace node, used to check if cached values are still valid.
+
+    @param uri: the VOSpace URI of the node.
+    @param force: get the node from VOSpace, rather than the copy the vos client kept when the node was last read.
+    @return: the date property of the node, or None if the node has no date or can not be reached.
+    @rtype: str
+    """
+    try:
+        return client.get_node(uri, force=force).props.get('date', None)
+    except Exception as ex:
+        logger.debug("Failed to get the date of {}: {}".format(uri, ex))
+        return None
+
+
+def cache_stats():
+    """
+    Report the use of the persistent header cache by this process.
+
+    @return: dict of hits, misses, evictions, entries and size
+    """
+    return header_cache.stats()
 
 
 class Task(object):
@@ -715,23 +882,52 @@ def _cutout_expnum(observation, sky_coord, radius):
         raise(ex)
 
 
-    else:
-      uri = observation.get_image_uri()
-      cutout_filehandle = tempfile.NamedTemporaryFile()
-      disposition_filename = client.copy(uri + "({:f},{:f},{:f})".format(sky_coord.ra.to('degree').value,
-                                                                   sky_coord.dec.to('degree').value,
-                                                                   radius.to('degree').value),
-                                         cutout_filehandle.name,
-                                         disposition=True)
-      cutouts = decompose_content_decomposition(disposition_filename)
-
-      cutout_filehandle.seek(0)
-      with warnings.catch_warnings():
-          warnings.simplefilter('ignore', FITSFixedWarning)
-          hdulist = fits.open(cutout_filehandle, mode='update', lazy_load_hdus=False,
-                              memmap=False)
-          hdulist.verify('silentfix+ignore')
-      logger.debug("Initial Length of HDUList: {}".format(len(hdulist)))
+    uri = observation.get_image_uri()
+    hdulist = _cutout_from_tile_cache(uri, sky_coord, radius)
+    if hdulist is not None:
+        return hdulist
+    fetch_radius = max(radius, float(config.read("CUTOUTS.TILE_CACHE.MIN_RADIUS")) * units.arcsec)
+    hdulist = _fetch_cutout(uri, sky_coord, fetch_radius)
+    if len(hdulist) != 2 or hdulist[1].flipped:
+        return hdulist
+    tile = fits.ImageHDU(data=hdulist[1].data, header=hdulist[1].header.copy())
+    _mark_tile_edges(tile.header, sky_coord, fetch_radius)
+    tile_cache.add(uri, tile)
+    if fetch_radius == radius:
+        return hdulist
+    cutout = _cutout_from_tile(tile, sky_coord, radius)
+    if cutout is None:
+        return hdulist
+    return fits.HDUList([hdulist[0], cutout])
+
+
+def _fetch_cutout(uri, sky_coord, radius):
+    """
+    Get a cutout of the image at uri from VOSpace.
+
+    @param uri: the image to cut from.
+    @param sky_coord: centre of the cutout
+    @type sky_coord:  SkyCoord
+    @param radius: radius of the cutout
+    @type radius: Quantity
+    @return: HDUList containing the cutout image.
+    @rtype: list(HDUList)
+    """
+    cutout_filehandle = tempfile.NamedTemporaryFile()
+    disposition_filename = client.copy(uri + "({:f},{:f},{:f})".format(sky_coord.ra.to('degree').value,
+                                                                 sky_coord.dec.to('degree').value,
+                                                                 radius.to('degree').value),
+                                       cutout_filehandle.name,
+                                       disposition=True)
+    cutouts = decompose_content_decomposition(disposition_filename)
+
+    cutout_filehandle.seek(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FITSFixedWarning)
+        hdulist = fits.open(cutout_filehandle, mode='update', lazy_load_hdus=False,
+                            memmap=False)
+        hdulist.verify('silentfix+ignore')
+    logger.debug("Initial Length of HDUList: {}".format(len(hdulist)))
 
     # Make sure here is a primaryHDU
     if len(hdulist) == 1:
@@ -747,7 +943,7 @@ def _cutout_expnum(observation, sky_coord, radius):
     for hdu in hdulist[1:]:
         cutout = cutouts.pop(0)
         if 'ASTLEVEL' not in hdu.header:
-            logger.info(f"NO ASTLEVEL KEYWORD in {observation.get_image_uri}, setting to 0")
+            logger.info(f"NO ASTLEVEL KEYWORD in {uri}, setting to 0")
             hdu.header['ASTLEVEL'] = 0
         hdu.header['EXTNO'] = cutout[0]
         naxis1 = hdu.header['NAXIS1']
@@ -772,6 +968,7 @@ def _cutout_expnum(observation, sky_coord, radius):
         hdu.header['XOFFSET'] = int(corners[0]) - 1
         hdu.header['YOFFSET'] = int(corners[2]) - 1
         hdu.converter = CoordinateConverter(hdu.header['XOFFSET'], hdu.header['YOFFSET'])
+        hdu.flipped = corners[0] > corners[1] or corners[2] > corners[3]
         try:
                 hdu.wcs = WCS(hdu.header)
         except Exception as ex:
@@ -781,6 +978,113 @@ def _cutout_expnum(observation, sky_coord, radius):
     return hdulist
 
 
+def _cutout_box(header, sky_coord, radius):
+    """
+    The pixel box, in the frame of the image described by header, covered by a cutout.
+
+    @return: (x, y, size, clipped) where x, y is the (1 based) pixel centre of the box, size is the length of its
+    sides and clipped is the string of sides (L, R, B, T) of the box that fall outside the image.
+    """
+    w = WCS(header)
+    x, y = w.sky2xy(sky_coord.ra.degree, sky_coord.dec.degree)
+    size = math.fabs(radius.to('degree').value / w.cd[0][0]) * 2.0
+    half = size / 2.0
+    clipped = ""
+    for edge, outside in (('L', x - half < 0.5), ('R', x + half > header['NAXIS1'] + 0.5),
+                          ('B', y - half < 0.5), ('T', y + half > header['NAXIS2'] + 0.5)):
+        if outside:
+            clipped += edge
+    return x, y, size, clipped
+
+
+def _tile_contains(header, sky_coord, radius):
+    """
+    Is the cutout of radius around sky_coord available from the tile with the given header?
+
+    The cutout must lie inside the tile except on sides where the tile itself was clipped by the edge of the image.
+    """
+    if 'TILEEDGE' not in header:
+        return False
+    try:
+        clipped = _cutout_box(header, sky_coord, radius)[3]
+    except Exception as ex:
+        logger.debug("Failed to locate cutout in tile: {}".format(ex))
+        return False
+    return all(edge in header['TILEEDGE'] for edge in clipped)
+
+
+def _mark_tile_edges(header, sky_coord, radius):
+    """
+    Record, in the TILEEDGE keyword, which sides of a cutout were clipped at the edge of the image it was taken from.
+
+    Cutouts from within a tile can only be clipped on these sides, elsewhere they must lie inside the tile.
+    """
+    header['TILEEDGE'] = (_cutout_box(header, sky_coord, radius)[3], 'sides of cutout clipped by the image edge')
+
+
+def _cutout_from_tile(tile, sky_coord, radius):
+    """
+    Cut the region of radius around sky_coord out of a cached tile.
+
+    @param tile: the image extension of the tile.
+    @param sky_coord: centre of the cutout
+    @type sky_coord:  SkyCoord
+    @param radius: radius of the cutout
+    @type radius: Quantity
+    @return: the cutout image extension, None if the region is not contained in the tile.
+    @rtype: fits.ImageHDU
+    """
+    header = tile.header
+    if not _tile_contains(header, sky_coord, radius):
+        return None
+    x, y, size = _cutout_box(header, sky_coord, radius)[0:3]
+    try:
+        result = Cutout2D(tile.data, (x - 1, y - 1), (size, size))
+    except Exception as ex:
+        logger.debug("Failed to cut from tile: {}".format(ex))
+        return None
+    x0, y0 = result.origin_original
+    ny, nx = result.data.shape
+    header = header.copy()
+    header['CRPIX1'] -= x0
+    header['CRPIX2'] -= y0
+    header['DATASEC'] = reset_datasec("[{:d}:{:d},{:d}:{:d}]".format(x0 + 1, x0 + nx, y0 + 1, y0 + ny),
+                                      header.get('DATASEC', "[1:{},1:{}]".format(header['NAXIS1'],
+                                                                                header['NAXIS2'])),
+                                      nx,
+                                      ny)
+    header['XOFFSET'] = int(header.get('XOFFSET', 0)) + x0
+    header['YOFFSET'] = int(header.get('YOFFSET', 0)) + y0
+    del header['TILEEDGE']
+    hdu = fits.ImageHDU(data=result.data, header=header)
+    hdu.converter = CoordinateConverter(hdu.header['XOFFSET'], hdu.header['YOFFSET'])
+    hdu.wcs = WCS(hdu.header)
+    return hdu
+
+
+def _cutout_from_tile_cache(uri, sky_coord, radius):
+    """
+    Build the cutout from a tile in the local cache.
+
+    @return: HDUList containing the cutout image, None if no cached tile of uri contains the region.
+    """
+    for key, header in tile_cache.tiles(uri):
+        if _tile_contains(header, sky_coord, radius):
+            tile = tile_cache.open(key)
+            if tile is None:
+                continue
+            with tile:
+                hdu = _cutout_from_tile(tile[1], sky_coord, radius)
+            if hdu is None:
+                continue
+            tile_cache.hits += 1
+            phdu = fits.PrimaryHDU()
+            phdu.header['ORIGIN'] = "OSSOS"
+            return fits.HDUList([phdu, hdu])
+    tile_cache.misses += 1
+    return None
+
+
 def ra_dec_cutout(uri, sky_coord, radius, update_wcs=False):
     """
 
@@ -1014,11 +1318,13 @@ def get_image(expnum, ccd=None, version='p', ext=FITS_EXT,
         # uri = get_uri(expnum, ccd, version, ext=ext + ".fz", subdir=subdir, prefix=prefix)
         # locations.append((uri, cutout))
 
+    # the transfers have already been retried by copy, errors without an errno (eg. a bad cutout or a FITS file
+    # that can not be parsed) will not go away by trying again.
     err = errno.EFAULT
-    while len(locations) > 0:
-        (uri, cutout) = locations.pop(0)
+    uri = None
+    for (uri, location_cutout) in locations:
         try:
-            hdu_list = get_hdu(uri, cutout)
+            hdu_list = get_hdu(uri, location_cutout)
             if return_file:
                 hdu_list.writeto(filename)
                 del hdu_list
@@ -1026,18 +1332,79 @@ def get_image(expnum, ccd=None, version='p', ext=FITS_EXT,
             else:
                 return hdu_list
         except Exception as e:
-            err = getattr(e, 'errno', errno.EAGAIN)
+            err = getattr(e, 'errno', None) or errno.EFAULT
             logger.debug("{}".format(type(e)))
-            logger.debug("Failed to open {} cutout:{}".format(uri, cutout))
+            logger.debug("Failed to open {} cutout:{}".format(uri, location_cutout))
             logger.debug("vos sent back error: {} code: {}".format(str(e), getattr(e, 'errno', 0)))
-
-    if err == errno.EAGAIN:
-        time.sleep(5)
-        return get_image(expnum, ccd=ccd, version=version, ext=ext,
-                         subdir=subdir, prefix=prefix, cutout=cutout, return_file=return_file, flip_image=flip_image)
     raise IOError(err, "Failed to get image at uri: {} using {} {} {} {}.".format(uri, expnum, version, ccd, cutout))
 
 
+def prefetch(fetch, items, jobs=2):
+    """
+    Fetch items in a bounded pool of threads, yielding them back in the order given.
+
+    Up to 'jobs' items are retrieved ahead of the one being yielded so that the caller can process item k while
+    item k+1 is being downloaded.  Each item is fetched once, the transfers are retried by copy.  Items that could
+    not be retrieved are yielded with a result of None, the caller is expected to try again and report the error.
+
+    @param fetch: callable that retrieves a single item.
+    @param items: list of items (eg. CCD numbers) to retrieve.
+    @param jobs: number of concurrent fetches.
+    @return: generator of (item, result)
+    """
+    items = list(items)
+    jobs = max(1, int(jobs))
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = []
+        next_idx = 0
+        while next_idx < len(items) or len(pending) > 0:
+            # keep the pool full, 'jobs' items ahead of the consumer.
+            while next_idx < len(items) and len(pending) < jobs + 1:
+                pending.append((items[next_idx],
+                                executor.submit(fetch, items[next_idx])))
+                next_idx += 1
+            item, future = pending.pop(0)
+            try:
+                result = future.result()
+            except Exception as ex:
+                logger.error("Failed to fetch {}: {}".format(item, ex))
+                result = None
+            yield item, result
+
+
+def iter_images(expnum, ccds, version='p', ext=FITS_EXT, prefix=None, jobs=2):
+    """
+    Retrieve the images of the given CCDs of an exposure, downloading ahead of the caller.
+
+    @param expnum: CFHT exposure number
+    @param ccds: list of CCDs to retrieve.
+    @param version: [p, s, o]
+    @param ext: the file extension of the image.
+    @param prefix: possible prefix, eg. 'fk'
+    @param jobs: number of CCDs to download concurrently.
+    @return: generator of (ccd, filename), filename is None if the image could not be retrieved.
+    """
+    def fetch(ccd):
+        return get_image(expnum, ccd, version=version, ext=ext, prefix=prefix)
+    return prefetch(fetch, ccds, jobs=jobs)
+
+
+def get_images(expnum, ccds, version='p', ext=FITS_EXT, prefix=None, jobs=4):
+    """
+    Retrieve the images of the given CCDs of an exposure concurrently.
+
+    @param expnum: CFHT exposure number
+    @param ccds: list of CCDs to retrieve.
+    @param version: [p, s, o]
+    @param ext: the file extension of the image.
+    @param prefix: possible prefix, eg. 'fk'
+    @param jobs: number of CCDs to download concurrently.
+    @return: dict of ccd -> filename, filename is None if the image could not be retrieved.
+    @rtype: dict
+    """
+    return dict(iter_images(expnum, ccds, version=version, ext=ext, prefix=prefix, jobs=jobs))
+
+
 def datasec_to_list(datasec):
     """
     convert an IRAF style PIXEL DATA section as to a list of integers.
@@ -1138,16 +1505,12 @@ def get_hdu(uri, cutout=None):
 
         else:
             logger.debug("Pulling: {}{} from VOSpace".format(uri, cutout))
-            fpt = tempfile.NamedTemporaryFile(suffix='.fits', mode='w+b')
             cutout = cutout is not None and cutout or ""
-            copy(uri+cutout, fpt.name)
-            fpt.seek(0, 2)
-            fpt.seek(0)
-            logger.debug("Read from vospace completed. Building fits object.")
-            with warnings.catch_warnings():
-                warnings.simplefilter('ignore', FITSFixedWarning)
-                hdu_list = fits.open(fpt, scale_back=False, mode='update')
-                hdu_list.verify('silentfix+ignore')
+            with tempfile.NamedTemporaryFile(suffix='.fits', mode='w+b') as fpt:
+                copy(uri+cutout, fpt.name)
+                logger.debug("Read from vospace completed. Building fits object.")
+                # the HDUList holds its own handle on the memory mapped file so the temporary file can go.
+                hdu_list = open_fits_memmap(fpt.name)
             use_this_ext = 0
             for use_this_ext, hdu in enumerate(hdu_list):
                 if hdu.header.get('NAXIS',0) > 0:
@@ -1173,6 +1536,59 @@ def get_hdu(uri, cutout=None):
     return hdu_list
 
 
+def open_fits_memmap(filename):
+    """
+    Open a FITS file with the data memory mapped rather than read into memory.
+
+    All the headers are read on open so the file can be removed once this returns.  The data are mapped
+    copy-on-write, changes made to the arrays are not written back to the file.  memmap is left at the astropy
+    default rather than forced on, forcing it refuses to load images with BZERO set (eg. our ushort images),
+    while the default maps the raw data and applies the scaling on access.
+
+    @param filename: name of the FITS file.
+    @rtype: fits.HDUList
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FITSFixedWarning)
+        hdu_list = fits.open(filename, lazy_load_hdus=False, scale_back=False)
+        hdu_list.verify('silentfix+ignore')
+    return hdu_list
+
+
+def stream_hdulist(uri, **kwargs):
+    """
+    Stream a FITS file from VOSpace to a temporary file and return it memory mapped.
+
+    The response is written to disk once, in STREAM_CHUNK_SIZE pieces, and the pixel data are not copied again.
+
+    @param uri: the VOSpace URI of the FITS file.
+    @param kwargs: arguments for the vos client open, eg. view='cutout', cutout='[1]'
+    @rtype: fits.HDUList
+    """
+    filename = os.path.basename(uri)
+    if os.access(filename, os.F_OK) and kwargs.get('cutout', None) is None and kwargs.get('view', 'data') == 'data':
+        return open_fits_memmap(filename)
+
+    start = time.time()
+    nbytes = 0
+    kwargs['view'] = kwargs.get('view', 'data')
+    with tempfile.NamedTemporaryFile(suffix='.fits', mode='w+b') as fpt:
+        vobj = client.open(uri, **kwargs)
+        try:
+            while True:
+                chunk = vobj.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                fpt.write(chunk)
+                nbytes += len(chunk)
+        finally:
+            vobj.close()
+        fpt.flush()
+        hdu_list = open_fits_memmap(fpt.name)
+    metrics.record(uri, 'stream', time.time() - start, nbytes=nbytes)
+    return hdu_list
+
+
 def get_trans(expnum, ccd, prefix=None, version='p'):
     """
 
@@ -1238,8 +1654,14 @@ def get_fwhm(expnum, ccd, prefix=None, version='p', default=4.0):
     except:
         pass
 
+    value = header_cache.get(uri, revalidate=lambda: get_node_date(uri))
+    if value is not None:
+        fwhm[uri] = value
+        return fwhm[uri]
+
     try:
         fwhm[uri] = float(open_vos_or_local(uri).read())
+        header_cache.put(uri, fwhm[uri], mtime=get_node_date(uri, force=False))
         return fwhm[uri]
     except Exception as ex:
         logger.warning(str(ex))
@@ -1280,8 +1702,20 @@ def get_zeropoint(expnum, ccd, prefix=None, version='p'):
     except:
         pass
 
+    try:
+        zmag[uri] = float(open(os.path.basename(uri), 'r').read())
+        return zmag[uri]
+    except:
+        pass
+
+    value = header_cache.get(uri, revalidate=lambda: get_node_date(uri))
+    if value is not None:
+        zmag[uri] = value
+        return zmag[uri]
+
     try:
         zmag[uri] = float(open_vos_or_local(uri).read())
+        header_cache.put(uri, zmag[uri], mtime=get_node_date(uri, force=False))
         return zmag[uri]
     except:
         pass
@@ -1361,16 +1795,20 @@ def copy(source, dest):
     @return:
     """
     logger.info("copying {} -> {}".format(source, dest))
-    n = 1
-    ex = IOError("no error")
-    while n < 10:
-        try:
-            return client.copy(source, dest)
-        except Exception as ex:
-            logger.debug(f"{source} -> {dest} failed with {ex}.  Retrying")
-            time.sleep(2)
-            n += 1
-    raise ex
+    return copy_policy.call(client.copy, source, dest,
+                            uri=source,
+                            operation='copy',
+                            size=lambda result: _transfer_size(source, dest))
+
+
+def _transfer_size(source, dest):
+    """
+    Size, in bytes, of a completed transfer, taken from whichever end is on the local filesystem.
+    """
+    for path in [dest, source]:
+        if isinstance(path, str) and not path.startswith("vos:") and os.access(path, os.F_OK):
+            return os.path.getsize(path)
+    return None
 
 
 def vlink(s_expnum, s_ccd, s_version, s_ext,
@@ -1441,8 +1879,41 @@ def listdir(directory, force=False):
     return client.listdir(directory, force=force)
 
 
-def list_dbimages(dbimages=DBIMAGES):
-    return listdir(dbimages)
+def list_dbimages(dbimages=DBIMAGES, force=False):
+    """
+    The names, exposure numbers, of the containers in dbimages as a set, for fast membership tests.
+
+    The listing is kept in memory and in the persistent cache. Once it is older than STORAGE.DBIMAGES_TTL seconds
+    the modification date of the container is checked and the container is only listed again if it has changed.
+
+    @param dbimages: the VOSpace container holding the exposures.
+    @param force: list the container again, even if the cached listing is current.
+    @rtype: frozenset
+    """
+    key = "listing:{}".format(dbimages)
+    now = time.time()
+    mtime = None
+    entry = dbimages_index.get(dbimages, None)
+    if entry is None and not force:
+        entry = header_cache.get(key)
+    if entry is not None and not force:
+        if now - entry['checked'] < float(config.read("STORAGE.DBIMAGES_TTL")):
+            dbimages_index[dbimages] = entry
+            return entry['names']
+        mtime = get_node_date(dbimages)
+        if mtime is not None and mtime == entry['mtime']:
+            logger.debug("{} unchanged since {}, using the cached listing.".format(dbimages, mtime))
+            entry = dict(entry, checked=now)
+            dbimages_index[dbimages] = entry
+            header_cache.put(key, entry, mtime=mtime)
+            return entry['names']
+    if mtime is None:
+        mtime = get_node_date(dbimages)
+    entry = {'names': frozenset(listdir(dbimages, force=True)), 'mtime': mtime, 'checked': now}
+    logger.debug("Listed {} entries of {}".format(len(entry['names']), dbimages))
+    dbimages_index[dbimages] = entry
+    header_cache.put(key, entry, mtime=mtime)
+    return entry['names']
 
 
 def exists(uri, force=False):
@@ -1623,12 +2094,18 @@ def get_mopheader(expnum, ccd, version='p', prefix=None):
 
     filename = os.path.basename(mopheader_uri)
 
-    if os.access(filename, os.F_OK):
+    # a local copy is used as is, it is newer than anything in the cache.
+    from_vospace = not os.access(filename, os.F_OK)
+    if from_vospace:
+        header = header_cache.get(mopheader_uri, revalidate=lambda: get_node_date(mopheader_uri))
+        if header is not None:
+            mopheaders[mopheader_uri] = header
+            return mopheaders[mopheader_uri]
+        mopheader_fpt = BytesIO(open_vos_or_local(mopheader_uri).read())
+    else:
         logger.debug("File already on disk: {}".format(filename))
         with open(filename, 'rb') as fobj:
             mopheader_fpt = BytesIO(fobj.read())
-    else:
-        mopheader_fpt = BytesIO(open_vos_or_local(mopheader_uri).read())
 
     with warnings.catch_warnings():
         warnings.simplefilter('ignore', AstropyUserWarning)
@@ -1652,6 +2129,8 @@ def get_mopheader(expnum, ccd, version='p', prefix=None):
         header['MAXCOUNT'] = MAXCOUNT
         mopheaders[mopheader_uri] = header
         mopheader.close()
+    if from_vospace:
+        header_cache.put(mopheader_uri, header, mtime=get_node_date(mopheader_uri, force=False))
     return mopheaders[mopheader_uri]
 
 
@@ -1668,6 +2147,13 @@ def _get_sghead(expnum):
     if key in sgheaders:
         return sgheaders[key]
 
+    # the SG headers come from the CADC data web service, not VOSpace, so they are only subject to the TTL.
+    cache_key = "CFHTSG/{}".format(key)
+    headers = header_cache.get(cache_key)
+    if headers is not None:
+        sgheaders[key] = headers
+        return sgheaders[key]
+
     header_filename = "{}{}.head".format(expnum, version)
 
     if not os.access(header_filename, os.R_OK):
@@ -1677,10 +2163,10 @@ def _get_sghead(expnum):
         resp = requests.get(url)
         if resp.status_code != 200:
             raise IOError(errno.ENOENT, "Could not get {}".format(url))
-        with open(header_filename,'w') as hobj:
+        with open(header_filename, 'wb') as hobj:
             hobj.write(resp.content)
 
-    with open(header_filename, 'w') as hobj:
+    with open(header_filename, 'r') as hobj:
         header_str_list = re.split('END      \n', hobj.read())
 
     # # make the first entry in the list a Null
@@ -1689,6 +2175,7 @@ def _get_sghead(expnum):
         headers.append(fits.Header.fromstring(header_str, sep='\n'))
         logging.debug(headers[-1].get('EXTVER', -1))
     sgheaders[key] = headers
+    header_cache.put(cache_key, headers)
     return sgheaders[key]
 
 
@@ -1699,7 +2186,10 @@ def get_header(uri):
     @param uri:  The URI of the image in VOSpace.
     """
     if uri not in astheaders:
+        astheaders[uri] = header_cache.get(uri, revalidate=lambda: get_node_date(uri))
+    if astheaders[uri] is None:
         astheaders[uri] = get_hdu(uri, cutout="[1:1,1:1]")[0].header
+        header_cache.put(uri, astheaders[uri], mtime=get_node_date(uri, force=False))
     return astheaders[uri]
 
 
@@ -1730,21 +2220,33 @@ def get_astheader(expnum, ccd, version='p', prefix=None):
     try:
        ast_uri = dbimages_uri(expnum, ccd, version=version, ext='.fits')
        if ast_uri not in astheaders:
-           hdulist = get_image(expnum, ccd=ccd, version=version, prefix=prefix,
-                               cutout="[1:1,1:1]", return_file=False, ext='.fits')
-           assert isinstance(hdulist, fits.HDUList)
-           astheaders[ast_uri] = hdulist[0].header
+           _get_cached_astheader(ast_uri, expnum, ccd, version, prefix, '.fits')
     except Exception as ex:
        logging.error(f'{ast_uri}: {ex}')
        ast_uri = dbimages_uri(expnum, ccd, version=version, ext='.fits.fz')
        if ast_uri not in astheaders:
-           hdulist = get_image(expnum, ccd=ccd, version=version, prefix=prefix,
-                               cutout="[1:1,1:1]", return_file=False, ext='.fits.fz')
-           assert isinstance(hdulist, fits.HDUList)
-           astheaders[ast_uri] = hdulist[0].header
+           _get_cached_astheader(ast_uri, expnum, ccd, version, prefix, '.fits.fz')
     return astheaders[ast_uri]
 
 
+def _get_cached_astheader(ast_uri, expnum, ccd, version, prefix, ext):
+    """
+    Fill astheaders[ast_uri] from the persistent cache or, failing that, from the image in VOSpace.
+
+    The cached header is re-validated against the modification date of the full exposure in dbimages.
+    """
+    exposure_uri = get_uri(expnum, version=version, ext=ext)
+    header = header_cache.get(ast_uri, revalidate=lambda: get_node_date(exposure_uri))
+    if header is None:
+        hdulist = get_image(expnum, ccd=ccd, version=version, prefix=prefix,
+                            cutout="[1:1,1:1]", return_file=False, ext=ext)
+        assert isinstance(hdulist, fits.HDUList)
+        header = hdulist[0].header
+        header_cache.put(ast_uri, header, mtime=get_node_date(exposure_uri, force=False))
+    astheaders[ast_uri] = header
+    return header
+
+
 def log_filename(prefix, task, version, ccd):
     return "{}{}_{}{}.txt".format(prefix, task, version, ccd)
 
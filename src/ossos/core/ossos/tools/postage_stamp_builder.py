@@ -14,18 +14,74 @@ ivo://ivoa.net/vospace/core%23httpget&view=cutout&cutout=CIRCLE+ICRS+242.1318+-1
 import argparse
 import logging
 import os
+import shutil
 import sys
+import tempfile
+import time
+from concurrent import futures
 
 from astropy import units
 from astropy.units import Quantity
 
 from ossos import (mpc, storage, parameters)
+from ossos.retry import RetryPolicy
 
 storage.FITS_EXT = ".fits"
 
-def cutout(obj, obj_dir, radius):
+# number of stamps fetched and uploaded at once.
+JOBS = 8
+# attempts at building a stamp before it is reported as failed and left for the next run.
+MAX_ATTEMPTS = 3
+# log the progress after this many stamps.
+REPORT_EVERY = 100
 
-    cutout_listing = storage.listdir(obj_dir, force=True)
+
+class Manifest(object):
+    """
+    The URIs of the postage stamps already built, kept in a file so a rerun can skip them
+    without listing the postage stamp directories.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stamps = set()
+        if os.access(filename, os.R_OK):
+            with open(filename) as fobj:
+                self.stamps = set(line.strip() for line in fobj if len(line.strip()) > 0)
+        self._fobj = None
+
+    def __contains__(self, uri):
+        return uri in self.stamps
+
+    def __len__(self):
+        return len(self.stamps)
+
+    def add(self, uri):
+        """
+        Record that the stamp at uri is built, straight away so an interrupted run loses nothing.
+        """
+        if uri in self.stamps:
+            return
+        if self._fobj is None:
+            self._fobj = open(self.filename, 'a')
+        self._fobj.write(uri + "\n")
+        self._fobj.flush()
+        self.stamps.add(uri)
+
+    def close(self):
+        if self._fobj is not None:
+            self._fobj.close()
+            self._fobj = None
+
+
+def stamps(obj, obj_dir):
+    """
+    The postage stamps to make of the observations of an object.
+
+    @param obj: the object, as read by mpc.MPCReader.
+    @param obj_dir: the VOSpace container the stamps of obj go in.
+    @return: generator of (image uri, sky coordinate, stamp uri)
+    """
     for obs in obj.mpc_observations:
         if obs.null_observation:
             logging.debug('skipping: {}'.format(obs))
@@ -41,34 +97,88 @@ def cutout(obj, obj_dir, radius):
                 logging.debug(f"Failed to map comment.frame to expnum: {ex}")
                 continue
             uri = storage.get_uri(parts['expnum'], version=parts['version'])
-            sky_coord = obs.coordinate
             # Using the WCS rather than the X/Y
             # (X/Y can be unreliable over the whole survey)
             postage_stamp_filename = f"{obj.provisional_name}_" \
                                      f"{obs.date.mjd:11.5f}_" \
                                      f"{obs.coordinate.ra.degree:09.5f}_" \
-                                     f"{obs.coordinate.dec.degeee:09.5f}.fits"
-
-            if postage_stamp_filename in cutout_listing:
-                # skipping existing cutouts
-                continue 
-
-            # ast_header = storage._get_sghead(parts['expnum'])
-            while True:
-              try:
-                hdulist = storage.ra_dec_cutout(uri, sky_coord, radius, update_wcs=True)
-
-                with open(postage_stamp_filename, 'w') as tmp_file:
-                    hdulist.writeto(tmp_file, overwrite=True, output_verify='fix+ignore')
-                    storage.copy(postage_stamp_filename, obj_dir + "/" + postage_stamp_filename)
-                os.unlink \
-                        (postage_stamp_filename)  # easier not to have them hanging around
-              except OSError as e:  # occasionally the node is not found: report and move on for later cleanup
-                logging.error("OSError: -> " +str(e))
-              except Exception as e:
-                logging.error("Exception: -> " +str(e))
+                                     f"{obs.coordinate.dec.degree:09.5f}.fits"
+            yield uri, obs.coordinate, obj_dir + "/" + postage_stamp_filename
+
+
+def make_stamp(uri, sky_coord, radius, stamp_uri):
+    """
+    Cut the postage stamp out of the image at uri and put it at stamp_uri.
+
+    @param uri: the image the stamp is cut from.
+    @param sky_coord: the centre of the stamp.
+    @param radius: the radius of the stamp.
+    @param stamp_uri: the VOSpace URI of the stamp.
+    """
+    hdulist = storage.ra_dec_cutout(uri, sky_coord, radius, update_wcs=True)
+    # each stamp gets a directory of its own so the workers don't write over each other.
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        postage_stamp_filename = os.path.join(tmp_dir, os.path.basename(stamp_uri))
+        hdulist.writeto(postage_stamp_filename, overwrite=True, output_verify='fix+ignore')
+        # build_stamps retries the whole stamp, so the upload goes straight to the client rather
+        # than through storage.copy and its own retries.
+        storage.client.copy(postage_stamp_filename, stamp_uri)
+    finally:
+        shutil.rmtree(tmp_dir)  # easier not to have them hanging around
+
+
+def build_stamps(work, radius, manifest, jobs=JOBS, max_attempts=MAX_ATTEMPTS):
+    """
+    Make the postage stamps that are not in the manifest, several at once.
+
+    A stamp that can not be made in max_attempts is reported and left for the next run.
+
+    @param work: list of (image uri, sky coordinate, stamp uri) as given by stamps.
+    @param radius: the radius of the stamps.
+    @param manifest: the Manifest of stamps already made, updated as each stamp is made.
+    @param jobs: number of stamps fetched and uploaded at once.
+    @param max_attempts: attempts at each stamp.
+    @return: number of stamps made and number that failed.
+    """
+    work = [item for item in work if item[2] not in manifest]
+    policy = RetryPolicy(max_attempts=max_attempts)
+    built = failed = 0
+    start = time.time()
+    with futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        pending = dict((executor.submit(policy.call, make_stamp, uri, sky_coord, radius, stamp_uri,
+                                        uri=stamp_uri, operation='postage_stamp'), stamp_uri)
+                       for uri, sky_coord, stamp_uri in work)
+        for future in futures.as_completed(pending):
+            stamp_uri = pending[future]
+            try:
+                future.result()
+            except Exception as ex:
+                # occasionally the node is not found: report and move on for later cleanup
+                logging.error("{}: {} -> {}".format(stamp_uri, type(ex).__name__, ex))
+                failed += 1
                 continue
-              break
+            manifest.add(stamp_uri)
+            built += 1
+            if built % REPORT_EVERY == 0:
+                logging.info("{}/{} stamps, {:.2f} stamps/s".format(built + failed, len(work),
+                                                                   built / (time.time() - start)))
+    elapsed = time.time() - start
+    if len(work) > 0:
+        sys.stderr.write("{} stamps built, {} failed, in {:.1f}s: {:.2f} stamps/s\n".format(
+            built, failed, elapsed, built / max(elapsed, 1e-6)))
+    return built, failed
+
+
+def cutout(obj, obj_dir, radius, manifest=None, jobs=JOBS):
+    """
+    Make the postage stamps of an object's observations that are not already in obj_dir.
+    """
+    if manifest is None:
+        manifest = Manifest(os.devnull)
+        for filename in storage.listdir(obj_dir, force=True):
+            manifest.stamps.add(obj_dir + "/" + filename)
+    return build_stamps(list(stamps(obj, obj_dir)), radius, manifest, jobs=jobs)
 
 
 def main():
@@ -103,6 +213,19 @@ def main():
                         default=None,
                         action="store",
                         help="A tuple of TNO IDs to rerun")
+    parser.add_argument("--manifest",
+                        default=None,
+                        action="store",
+                        help="File listing the stamps already built, skipped on a rerun "
+                             "[default: postage_stamps.VERSION.manifest]")
+    parser.add_argument("--jobs", "-j",
+                        type=int,
+                        default=JOBS,
+                        help="Number of stamps to fetch and upload at once.")
+    parser.add_argument("--max-attempts",
+                        type=int,
+                        default=MAX_ATTEMPTS,
+                        help="Attempts at each stamp before leaving it for the next run.")
 
 
     args = parser.parse_args()
@@ -115,11 +238,17 @@ def main():
         logging.basicConfig(level=logging.ERROR)
 
 
+    manifest_filename = args.manifest or "postage_stamps.{}.manifest".format(args.version)
+    # without a manifest, the stamps already in VOSpace are found by listing each object's directory once.
+    relist = not os.access(manifest_filename, os.F_OK)
+    manifest = Manifest(manifest_filename)
+
     astdir = args.astdir
     flist = os.listdir(astdir)
     if args.recheck:
         flist = [args.recheck + '.ast']
 
+    work = []
     for fn in flist:
         if not fn.endswith('.ast'):
             continue
@@ -129,16 +258,24 @@ def main():
                                                 [0]) # obj.provisional_name
                 logging.info \
                     ("Processing astrometric files in {}".format(obj_dir))
-                storage.mkdir(obj_dir)
                 obj = mpc.MPCReader(astdir + fn)
-                # assert storage.exists(obj_dir, force=True)
-                sys.stderr.write('{} beginning...'.format(obj.provisional_name))
-                # if int(obj.provisional_name[3:]) == 49:
-                assert isinstance(args.radius, Quantity)
-                cutout(obj, obj_dir, args.radius)
-                sys.stderr.write \
-                    ('{} complete.\n\n'.format(obj.provisional_name))
+                obj_work = [item for item in stamps(obj, obj_dir) if item[2] not in manifest]
+                if relist and len(obj_work) > 0 and storage.exists(obj_dir, force=True):
+                    for filename in storage.listdir(obj_dir, force=True):
+                        manifest.add(obj_dir + "/" + filename)
+                    obj_work = [item for item in obj_work if item[2] not in manifest]
+                if len(obj_work) > 0:
+                    storage.mkdir(obj_dir)
+                sys.stderr.write('{} {} stamps to build.\n'.format(obj.provisional_name, len(obj_work)))
+                work.extend(obj_work)
+
+    assert isinstance(args.radius, Quantity)
+    try:
+        built, failed = build_stamps(work, args.radius, manifest, jobs=args.jobs, max_attempts=args.max_attempts)
+    finally:
+        manifest.close()
+    return failed > 0 and -1 or 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
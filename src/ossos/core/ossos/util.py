@@ -14,7 +14,7 @@ import tempfile
 
 try:
     try:
-        import erfa as d2dtf
+        from erfa import d2dtf
     except ImportError:
         from astropy._erfa import d2dtf
 except ImportError:
@@ -149,6 +149,17 @@ def get_pixel_bounds_from_datasec_keyword(datasec):
     return (x1, x2), (y1, y2)
 
 
+def _unit_vectors(pos):
+    """
+    Convert a list of RA/DEC positions, in degrees, to unit vectors on the sphere.
+    """
+    ra = numpy.radians(pos[:, 0])
+    dec = numpy.radians(pos[:, 1])
+    return numpy.transpose([numpy.cos(dec) * numpy.cos(ra),
+                            numpy.cos(dec) * numpy.sin(ra),
+                            numpy.sin(dec)])
+
+
 def match_lists(pos1, pos2, tolerance=MATCH_TOLERANCE, spherical=False):
     """
     Given two sets of x/y positions match the lists, uniquely.
@@ -157,71 +168,57 @@ def match_lists(pos1, pos2, tolerance=MATCH_TOLERANCE, spherical=False):
     :param pos1: list of x/y positions.
     :param pos2: list of x/y positions.
     :param tolerance: float distance, in pixels, to consider a match
+    :param spherical: positions are RA/DEC in degrees and tolerance is an angular distance in degrees.
 
     Algorithm:
-        - Find all the members of pos2 that are within tolerance of pos1[idx1].
-                These pos2 members are match_group_1
-        - Find all the members of pos1 that are within tolerance of match_group_1[idx2].
-                These pos1 members are match_group_2
-        - If pos1[idx] is in match_group_2 then pos1[idx] is a match of object at match_group_1[idx2]
+        - Find the member of pos2 that is closest to, and within tolerance of, pos1[idx1].
+        - Find the member of pos1 that is closest to that pos2 member.
+        - If that is pos1[idx1] then pos1[idx1] and the pos2 member are a match.
 
+    The nearest neighbour searches are done with KD-trees, so matching scales as (N+M)log(N+M).
+    In spherical mode the positions are placed on the unit sphere and matched using the chord
+    length corresponding to tolerance.
     """
+    from scipy.spatial import cKDTree
 
     assert isinstance(pos1, numpy.ndarray)
     assert isinstance(pos2, numpy.ndarray)
 
-    # build some arrays to hold the index of things that matched between lists.
-    npts2 = npts1 = 0
-
-    if len(pos1) > 0:
-        npts1 = len(pos1[:, 0])
-    pos1_idx_array = numpy.arange(npts1, dtype=numpy.int16)
-
-    if len(pos2) > 0:
-        npts2 = len(pos2[:, 0])
-    pos2_idx_array = numpy.arange(npts2, dtype=numpy.int16)
+    npts1 = len(pos1)
+    npts2 = len(pos2)
 
-    # this is the array of final matched index, -1 indicates no match found.
-    match1 = numpy.ma.zeros(npts1, dtype=numpy.int16)
-    match1.mask = True
+    # this is the array of final matched index, masked indicates no match found.
+    match1 = numpy.ma.zeros(npts1, dtype=numpy.int64)
+    match1.mask = numpy.ones(npts1, dtype=bool)
 
-    # this is the array of matches in pos2, -1 indicates no match found.
-    match2 = numpy.ma.zeros(npts2, dtype=numpy.int16)
-    match2.mask = True
+    # this is the array of matches in pos2, masked indicates no match found.
+    match2 = numpy.ma.zeros(npts2, dtype=numpy.int64)
+    match2.mask = numpy.ones(npts2, dtype=bool)
 
     # if one of the two input arrays are zero length then there is no matching to do.
     if npts1 * npts2 == 0:
         return match1, match2
 
-    for idx1 in range(npts1):
-
-        # compute the distance source idx1 to each member of pos2
-        if not spherical :
-           sep = numpy.sqrt((pos2[:, 0] - pos1[idx1, 0]) ** 2 + (pos2[:, 1] - pos1[idx1, 1]) ** 2)
-        else:
-           sep = numpy.sqrt((numpy.cos(numpy.radians(pos1[idx1,1]))*(pos2[:, 0] - pos1[idx1, 0])) ** 2 + (pos2[:, 1] - pos1[idx1, 1]) ** 2)
-
-        # considered a match if sep is below tolerance and is the closest match available.
-        match_condition = numpy.all((sep <= tolerance, sep == sep.min()), axis=0)
-
-        # match_group_1 is list of the indexes of pos2 entries that qualified as possible matches to pos1[idx1]
-        match_group_1 = pos2_idx_array[match_condition]
+    if spherical:
+        xyz1 = _unit_vectors(pos1)
+        xyz2 = _unit_vectors(pos2)
+        tolerance = 2 * numpy.sin(numpy.radians(min(tolerance, 180.0)) / 2.0)
+    else:
+        xyz1 = numpy.asarray(pos1[:, 0:2], dtype=float)
+        xyz2 = numpy.asarray(pos2[:, 0:2], dtype=float)
 
-        # For each of those pos2 objects that could be a match to pos1[idx] find the best match in all of pos1
-        for idx2 in match_group_1:
-            # compute the distance from this pos2 object that is a possible match to pos1[idx1] to all members of pos1
-            sep = numpy.sqrt((pos1[:, 0] - pos2[idx2, 0]) ** 2 + (pos1[:, 1] - pos2[idx2, 1]) ** 2)
+    # closest member of pos2 to each member of pos1, and closest member of pos1 to each member of pos2.
+    sep1, idx1 = cKDTree(xyz2).query(xyz1, k=1, distance_upper_bound=tolerance)
+    sep2, idx2 = cKDTree(xyz1).query(xyz2, k=1, distance_upper_bound=tolerance)
 
-            # considered a match if sep is below tolerance and is the closest match available.
-            match_condition = numpy.all((sep <= tolerance, sep == sep.min()), axis=0)
-            match_group_2 = pos1_idx_array[match_condition]
+    # unmatched entries come back with infinite separation and an index equal to the length of the list.
+    candidates = numpy.flatnonzero(numpy.isfinite(sep1) & (sep1 <= tolerance))
+    mutual = idx2[idx1[candidates]] == candidates
+    matched1 = candidates[mutual]
+    matched2 = idx1[matched1]
 
-            # Are any of the pos1 members that were matches to the matched pos2 member the pos1[idx] entry?
-            if idx1 in match_group_2:
-                match1[idx1] = idx2
-                match2[idx2] = idx1
-                # this BREAK is in here since once we have a match we're done.
-                break
+    match1[matched1] = matched2
+    match2[matched2] = matched1
 
     return match1, match2
 
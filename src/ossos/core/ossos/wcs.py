@@ -89,8 +89,10 @@ class WCS(astropy_wcs.WCS):
 
     def xy2sky(self, x, y, usepv=True):
         if usepv:
+            # array inputs are projected in one pass, scalars keep the original path.
+            _xy2skypv = numpy.ndim(x) > 0 and xy2skypv_array or xy2skypv
             try:
-                return xy2skypv(x=numpy.array(x), y=numpy.array(y),
+                return _xy2skypv(x=numpy.array(x), y=numpy.array(y),
                                 crpix1=self.crpix1,
                                 crpix2=self.crpix2,
                                 crval1=self.crval1,
@@ -110,6 +112,8 @@ class WCS(astropy_wcs.WCS):
             ra = ra.to(units.degree).value
         if isinstance(dec, Quantity):
             dec = dec.to(units.degree).value
+        if numpy.ndim(ra) > 0:
+            return self._sky2xy_array(ra, dec, usepv=usepv)
         try:
             if usepv:
                 return sky2xypv(ra=ra,
@@ -127,6 +131,29 @@ class WCS(astropy_wcs.WCS):
         pos = self.wcs_world2pix([[ra, dec], ], 1)
         return pos[0][0], pos[0][1]
 
+    def _sky2xy_array(self, ra, dec, usepv=True):
+        """
+        Array version of sky2xy, returns numpy arrays of x and y.
+        """
+        ra = numpy.asarray(ra, dtype=float)
+        dec = numpy.asarray(dec, dtype=float)
+        try:
+            if usepv:
+                return sky2xypv_array(ra=ra,
+                                      dec=dec,
+                                      crpix1=self.crpix1,
+                                      crpix2=self.crpix2,
+                                      crval1=self.crval1,
+                                      crval2=self.crval2,
+                                      dc=self.dc,
+                                      pv=self.pv,
+                                      nord=self.nord)
+        except Exception as ex:
+            logger.warning("sky2xy raised exception: {0}".format(ex))
+            logger.warning("Reverted to CD-Matrix WCS to convert {0} positions".format(ra.size))
+        x, y = self.wcs_world2pix(ra, dec, 1)
+        return x, y
+
 
 def sky2xypv(ra, dec, crpix1, crpix2, crval1, crval2, dc, pv, nord, maxiter=300):
     """
@@ -243,8 +270,8 @@ def sky2xypv(ra, dec, crpix1, crpix2, crval1, crval2, dc, pv, nord, maxiter=300)
                         g += pv[1][7] * y3 + pv[1][8] * xy2 + pv[1][9] * x2y + pv[1][10] * x3
                         fx += pv[0][7] * 3 * x2 + pv[0][8] * 2 * xy + pv[0][9] * y2
                         fy += pv[0][8] * x2 + pv[0][9] * 2 * xy + pv[0][10] * 3 * y2
-                        gx += pv[0][8] * y2 + pv[1][9] * 2 * xy + pv[1][10] * 3 * x2
-                        gy += pv[1][7] * 3 * y2 + pv[0][8] * 2 * xy + pv[1][9] * x2
+                        gx += pv[1][8] * y2 + pv[1][9] * 2 * xy + pv[1][10] * 3 * x2
+                        gy += pv[1][7] * 3 * y2 + pv[1][8] * 2 * xy + pv[1][9] * x2
 
             f -= xi
             g -= eta
@@ -314,8 +341,8 @@ def xy2skypv(x, y, crpix1, crpix2, crval1, crval2, cd, pv, nord):
     y_deg = cd[1][0] * xp + cd[1][1] * yp
 
     if nord < 0:
-        xi = x
-        eta = y
+        xi = x_deg
+        eta = y_deg
     else:
         xi = pv[0][0]
         eta = pv[1][0]
@@ -369,6 +396,187 @@ def xy2skypv(x, y, crpix1, crpix2, crval1, crval2, cd, pv, nord):
     return ra * units.degree, dec * units.degree
 
 
+def _pv_terms(x, y, pv, nord):
+    """
+    Evaluate the PV distortion polynomial and its Jacobian.
+
+    Args:
+      x, y: numpy.ndarray
+        Intermediate world coordinates, degrees.
+      pv: 2d array
+      nord: int
+        order of the fit
+
+    Returns:
+      f, g, fx, fy, gx, gy: numpy.ndarray
+        The xi/eta polynomials and their partial derivatives in x and y.
+    """
+    f = numpy.full_like(x, pv[0][0])
+    g = numpy.full_like(y, pv[1][0])
+    fx = numpy.zeros_like(x)
+    fy = numpy.zeros_like(x)
+    gx = numpy.zeros_like(x)
+    gy = numpy.zeros_like(x)
+
+    if nord >= 1:
+        r = numpy.sqrt(x ** 2 + y ** 2)
+        f += pv[0][1] * x + pv[0][2] * y + pv[0][3] * r
+        g += pv[1][1] * y + pv[1][2] * x + pv[1][3] * r
+        fx += pv[0][1] + pv[0][3] * x / r
+        fy += pv[0][2] + pv[0][3] * y / r
+        gx += pv[1][2] + pv[1][3] * x / r
+        gy += pv[1][1] + pv[1][3] * y / r
+
+        if nord >= 2:
+            x2 = x ** 2
+            xy = x * y
+            y2 = y ** 2
+
+            f += pv[0][4] * x2 + pv[0][5] * xy + pv[0][6] * y2
+            g += pv[1][4] * y2 + pv[1][5] * xy + pv[1][6] * x2
+            fx += pv[0][4] * 2 * x + pv[0][5] * y
+            fy += pv[0][5] * x + pv[0][6] * 2 * y
+            gx += pv[1][5] * y + pv[1][6] * 2 * x
+            gy += pv[1][4] * 2 * y + pv[1][5] * x
+
+            if nord >= 3:
+                x3 = x ** 3
+                x2y = x2 * y
+                xy2 = x * y2
+                y3 = y ** 3
+
+                f += pv[0][7] * x3 + pv[0][8] * x2y + pv[0][9] * xy2 + pv[0][10] * y3
+                g += pv[1][7] * y3 + pv[1][8] * xy2 + pv[1][9] * x2y + pv[1][10] * x3
+                fx += pv[0][7] * 3 * x2 + pv[0][8] * 2 * xy + pv[0][9] * y2
+                fy += pv[0][8] * x2 + pv[0][9] * 2 * xy + pv[0][10] * 3 * y2
+                gx += pv[1][8] * y2 + pv[1][9] * 2 * xy + pv[1][10] * 3 * x2
+                gy += pv[1][7] * 3 * y2 + pv[1][8] * 2 * xy + pv[1][9] * x2
+
+    return f, g, fx, fy, gx, gy
+
+
+def sky2xypv_array(ra, dec, crpix1, crpix2, crval1, crval2, dc, pv, nord, maxiter=300):
+    """
+    Array version of sky2xypv.
+
+    The tangent plane projection and the PV polynomial are evaluated on whole
+    arrays and Newton's method is only iterated on the points that have not
+    yet converged.
+
+    Args:
+      ra: numpy.ndarray
+        Right ascension, degrees
+      dec: numpy.ndarray
+        Declination, degrees
+      crpix1, crpix2, crval1, crval2, dc, pv, nord, maxiter:
+        as for sky2xypv
+
+    Returns:
+      x, y: numpy.ndarray
+        Pixel coordinates
+    """
+    ra = numpy.array(ra, dtype=float, ndmin=1)
+    dec = numpy.array(dec, dtype=float, ndmin=1)
+
+    if crval1 < 180:
+        ra = numpy.where(numpy.fabs(ra - crval1) > 100, ra - 360, ra)
+    else:
+        ra = numpy.where(numpy.fabs(ra - crval1) > 100, ra + 360, ra)
+
+    ra = ra / PI180
+    dec = dec / PI180
+
+    tdec = numpy.tan(dec)
+    ra0 = crval1 / PI180
+    dec0 = crval2 / PI180
+    ctan = math.tan(dec0)
+    ccos = math.cos(dec0)
+
+    traoff = numpy.tan(ra - ra0)
+    craoff = numpy.cos(ra - ra0)
+    etar = (1 - ctan * craoff / tdec) / (ctan + craoff / tdec)
+    xir = traoff * ccos * (1 - etar * ctan)
+    xi = xir * PI180
+    eta = etar * PI180
+
+    # Initial guess
+    x = xi.copy()
+    y = eta.copy()
+
+    if nord >= 0:
+        # Reverse by Newton's method, only iterating on points not yet converged.
+        tolerance = 0.001 / 3600
+        active = numpy.arange(x.size)
+        iteration = 0
+        while active.size > 0 and iteration <= maxiter:
+            xa = x[active]
+            ya = y[active]
+            f, g, fx, fy, gx, gy = _pv_terms(xa, ya, pv, nord)
+            f -= xi[active]
+            g -= eta[active]
+            det = fx * gy - fy * gx
+            dx = (-f * gy + g * fy) / det
+            dy = (-g * fx + f * gx) / det
+            x[active] = xa + dx
+            y[active] = ya + dy
+            active = active[~((numpy.fabs(dx) < tolerance) & (numpy.fabs(dy) < tolerance))]
+            iteration += 1
+
+    xp = dc[0][0] * x + dc[0][1] * y
+    yp = dc[1][0] * x + dc[1][1] * y
+
+    return xp + crpix1, yp + crpix2
+
+
+def xy2skypv_array(x, y, crpix1, crpix2, crval1, crval2, cd, pv, nord):
+    """
+    Array version of xy2skypv.
+
+    Args:
+      x, y: numpy.ndarray
+        Input pixel coordinates
+      crpix1, crpix2, crval1, crval2, cd, pv, nord:
+        as for xy2skypv
+
+    Returns:
+      ra, dec: Quantity
+        Arrays of right ascension and declination, degrees.
+    """
+    x = numpy.array(x, dtype=float, ndmin=1)
+    y = numpy.array(y, dtype=float, ndmin=1)
+
+    xp = x - crpix1
+    yp = y - crpix2
+
+    x_deg = cd[0][0] * xp + cd[0][1] * yp
+    y_deg = cd[1][0] * xp + cd[1][1] * yp
+
+    if nord < 0:
+        xi = x_deg
+        eta = y_deg
+    else:
+        xi, eta = _pv_terms(x_deg, y_deg, pv, nord)[0:2]
+
+    xir = xi / PI180
+    etar = eta / PI180
+
+    ra0 = crval1 / PI180
+    dec0 = crval2 / PI180
+
+    ctan = math.tan(dec0)
+    ccos = math.cos(dec0)
+    raoff = numpy.arctan2(xir / ccos, 1 - etar * ctan)
+    ra = raoff + ra0
+    dec = numpy.arctan(numpy.cos(raoff) / ((1 - (etar * ctan)) / (etar + ctan)))
+
+    ra *= PI180
+    ra = numpy.where(ra < 0, ra + 360, ra)
+    ra = numpy.where(ra > 360, ra - 360, ra)
+    dec *= PI180
+
+    return ra * units.degree, dec * units.degree
+
+
 def parse_cd(header):
     """
     Parses the CD array from an astropy FITS header.
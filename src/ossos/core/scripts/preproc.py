@@ -47,6 +47,11 @@ import requests
 
 __Version__ = "2.0"
 import re, os, string, sys
+import functools
+import tempfile
+import time
+import warnings
+from concurrent import futures
 import vos
 import numpy as np
 import logging
@@ -54,6 +59,21 @@ from astropy.io import fits
 
 version = __Version__
 
+logger = logging.getLogger()
+
+### output file suffix of each OBSTYPE.
+flag = {'FLAT': 'f',
+        'BIAS': 'b',
+        'OBJECT': 'p',
+        'ZERO': 'b'
+}
+
+### number of rows of the stack combined at once.
+STRIP_ROWS = 256
+
+### numpy type of each integer BITPIX, for scaling data back to what it was read as.
+INTEGER_BITPIX = {8: 'uint8', 16: 'int16', 32: 'int32', 64: 'int64'}
+
 elixir_header = {'PHOT_C': ( 30.0000, "Fake Elixir zero point" ),
                  'PHOT_CS': ( 1.0000, "Fake Elixir zero point - scatter" ),
                  'PHOT_NS': ( 0, 'Elixir zero point - N stars' ),
@@ -84,12 +104,10 @@ def trim(hdu, datasec='DATASEC'):
     t = int(datasec[3])
     logger.info("Trimming [%d:%d,%d:%d]" % ( l, r, b, t))
     hdu.data = hdu.data[b:t, l:r]
-    hdu.header.update('DATASEC',
-                      "[%d:%d,%d:%d]" % (1, r - l + 1, 1, t - b + 1),
-                      comment="Image was trimmed")
-    hdu.header.update('ODATASEC',
-                      "[%d:%d,%d:%d]" % (l + 1, r, b + 1, t),
-                      comment="previous DATASEC")
+    hdu.header['DATASEC'] = ("[%d:%d,%d:%d]" % (1, r - l + 1, 1, t - b + 1),
+                             "Image was trimmed")
+    hdu.header['ODATASEC'] = ("[%d:%d,%d:%d]" % (l + 1, r, b + 1, t),
+                              "previous DATASEC")
     return
 
 
@@ -134,7 +152,7 @@ def overscan(hdu,
         bias /= float(len(hdu.data[b:t, bl:bh][0]))
         mean = bias.mean()
         hdu.data[b:t, al:ah] -= bias[:, np.newaxis]
-        hdu.header.update("BIAS%d" % (idx ), mean, comment="Mean bias level")
+        hdu.header["BIAS%d" % (idx )] = (mean, "Mean bias level")
         del (bias)
 
     ### send back the mean bias level subtracted
@@ -192,6 +210,398 @@ def get_from_dbimages(file_id, ext='o.fits.fz', calibrator=False):
     return fits_handles[ext][file_id]
 
 
+calibrations = {}
+
+
+def get_calibration(filename, ccd):
+    """
+    Get the data of one CCD of a calibration frame, reading it only the first time it is asked for.
+
+    @param filename: the bias or flat frame.
+    @param ccd: the CCD wanted.
+    @return: numpy.ndarray
+    """
+    key = (filename, int(ccd))
+    if key not in calibrations:
+        logger.info("Reading ccd {} of calibration frame {}".format(ccd, filename))
+        calibrations[key] = np.asarray(get_from_dbimages(filename, calibrator=True)[int(ccd) + 1].data,
+                                       dtype='float32')
+    return calibrations[key]
+
+
+def release_calibrations(ccd):
+    """
+    Free up the memory used by the calibration frames of ccd.
+    """
+    for key in [key for key in calibrations if key[1] == int(ccd)]:
+        del (calibrations[key])
+
+
+def get_flat(header):
+    """
+    The flat field that goes with the run and filter of the image with this header.
+    """
+    qrunid = header.get('QRUNID', header.get('CRUNID', '13A'))[0:3]
+    filter = header.get('FILTER', header.get('CRUNID', '13A'))[0]
+    flat_key = qrunid + "_" + filter
+    flat = flats.get(flat_key, flats.get("ALL", None))
+    if flat is None:
+        raise ValueError("No available flat for {}".format(qrunid))
+    return flat
+
+
+def stage(file_ids, ccd):
+    """
+    Retrieve the images, and the flats they need, before the CCDs are handed out to worker processes.
+
+    @param file_ids: the exposures to be processed.
+    @param ccd: a CCD whose header gives the run and filter of each exposure.
+    """
+    for file_id in file_ids:
+        hdulist = get_from_dbimages(file_id)
+        if opt.flat:
+            get_from_dbimages(get_flat(hdulist[int(ccd) + 1].header), calibrator=True)
+
+
+def init_worker(options, flat_list):
+    """
+    Set up a worker process with the options and flats of the parent.
+
+    They are handed over rather than inherited so the workers also run where processes are spawned, not forked.
+    The FITS handles inherited from a forked parent are forgotten, so each worker reads through its own files.
+
+    @param options: the parsed command line.
+    @param flat_list: the flats to use, keyed by run and filter, see get_flat.
+    """
+    global opt, args, flats, vos_client
+    opt = args = options
+    flats = flat_list
+    vos_client = vos.Client()
+    fits_handles.clear()
+    calibrations.clear()
+
+
+def process_ccd(ccd, file_ids, part=False):
+    """
+    Process, or combine, one CCD of each of the file_ids into the output file(s).
+
+    The processed frames waiting to be combined are kept in a scratch directory that is removed when done,
+    whether or not the processing succeeds.
+
+    @param ccd: the CCD to process.
+    @param file_ids: the exposures to process.
+    @param part: write the CCD into a file of its own, to be appended to the output by append_part.
+    @return: the (output file, part file) pairs still to be appended, and the seconds and pixels spent on each file_id.
+    """
+    with tempfile.TemporaryDirectory(prefix="preproc", dir=".") as scratch:
+        return _process_ccd(ccd, file_ids, part, scratch)
+
+
+def _process_ccd(ccd, file_ids, part, scratch):
+    logger.info("Working on ccd " + str(ccd))
+    mstack = []
+    parts = []
+    timings = {}
+    nim = 0
+    for file_id in file_ids:
+
+        nim += 1
+        start = time.time()
+        hdu = get_from_dbimages(file_id)[int(ccd) + 1]
+
+        ### reopen the output file for each extension.
+        ### Create an output MEF file based on extension name if
+        ### opt.split is set.
+        if not opt.outfile and not opt.combine:
+            imtype = hdu.header.get('OBSTYPE')
+            outfile = str(hdu.header.get('EXPNUM')) + flag[imtype]
+        elif (opt.combine or len(file_ids) < 2) and opt.outfile:
+            re.match(r"(^.*)\.fits.fz", opt.outfile)
+            outfile = opt.outfile
+        else:
+            logger.error(("Mulitple input images needs one output "
+                          "but --output option not set? [Logic Error]"))
+            sys.exit(-1)
+        subs = "."
+        if opt.dist:
+            subs = opt.dist
+            object = hdu.header.get('OBJECT')
+            nccd = hdu.header.get('EXTNAME')
+            for dirs in [nccd, object]:
+                subs = subs + "/" + dirs
+                if not os.access(subs, os.F_OK):
+                    os.makedirs(subs)
+        subs = subs + "/"
+        if opt.split:
+            nccd = hdu.header.get('EXTVER')
+            outfile = outfile + string.zfill(str(nccd), 2)
+        outfile = subs + outfile + ".fits"
+        ### exit if the file exist and this is the ccd or
+        ### were splitting so every file should only have one
+        ### extension
+        if os.access(outfile, os.W_OK) and (ccd == 0 or opt.split) and not opt.combine:
+            sys.exit("Output file " + outfile + " already exists")
+
+        ### do the overscan for each file
+        logger.info("Processing " + file_id)
+
+        if opt.overscan:
+            logger.info("Overscan subtracting")
+            overscan(hdu)
+        if opt.bias:
+            logger.info("Subtracting bias frame " + opt.bias)
+            np.subtract(hdu.data, get_calibration(opt.bias, ccd), out=hdu.data)
+        if opt.trim:
+            logger.info("Trimming image")
+            trim(hdu)
+        if opt.flat:
+            flat = get_flat(hdu.header)
+            logger.info("Dividing by flat field " + flat)
+            np.divide(hdu.data, get_calibration(flat, ccd), out=hdu.data)
+            hdu.header["Flat"] = (flat, "Flat Image")
+        if opt.normal:
+            logger.info("Normalizing the frame")
+            (h, b) = np.histogram(hdu.data, bins=1000)
+            idx = h.argsort()
+            mode = float((b[idx[-1]] + b[idx[-2]]) / 2.0)
+            np.divide(hdu.data, mode, out=hdu.data)
+
+        if opt.flip:
+            if ccd < 18:
+                logger.info("Flipping the x and y axis")
+                hdu.data = hdu.data[::-1, ::-1]
+                hdu.header['CRPIX2'] = hdu.data.shape[0] - hdu.header['CRPIX2']
+                hdu.header['CRPIX1'] = hdu.data.shape[1] - hdu.header['CRPIX1']
+                hdu.header['CD1_1'] = -1.0 * hdu.header['CD1_1']
+                hdu.header['CD2_2'] = -1.0 * hdu.header['CD2_2']
+
+        hdu.header['CADCPROC'] = (float(version), 'Version of cadcproc')
+        ### write out this image if not combining
+        if args.megapipe:
+            for keyword in elixir_header:
+                hdu.header[keyword] = (hdu.header.get(keyword, elixir_header[keyword][0]),
+                                       elixir_header[keyword][1])
+
+        pixels = hdu.data.size
+        if (not opt.combine or len(file_ids) == 1) and part:
+            ### leave the image for the writer in the parent process.
+            combined = "{}.ccd{:02d}.part".format(outfile, int(ccd))
+            logger.info("writing data to " + combined)
+            pdu = get_from_dbimages(file_id)[0]
+            hdul = fits.HDUList([fits.PrimaryHDU(header=pdu.header),
+                                 fits.ImageHDU(data=hdu.data, header=hdu.header)])
+            if opt.short:
+                logger.info("Scaling to interger")
+                hdul[-1].scale('int16', bzero=32768)
+            hdul.writeto(combined, overwrite=True)
+            parts.append((outfile, combined))
+            hdu = None
+            hdul = None
+            nim = 0
+        elif not opt.combine or len(file_ids) == 1:
+            logger.info("writing data to " + outfile)
+            ### write out the image now (don't overwrite
+            ### files that exist at the start of this process
+            if not opt.split:
+                if not os.access(outfile, os.R_OK):
+                    pdu = get_from_dbimages(file_id)[0]
+                    hdul = fits.HDUList(fits.PrimaryHDU(header=pdu.header))
+                    hdul.writeto(outfile)
+                    hdul.close()
+            hdul = fits.open(outfile, 'append')
+            hdul.append(fits.ImageHDU(data=hdu.data,
+                                      header=hdu.header))
+            if opt.short:
+                logger.info("Scaling to interger")
+                hdul[-1].scale('int16', bzero=32768)
+            hdul.close()
+            hdu = None
+            hdul = None
+            nim = 0
+        else:
+            ### keep the processed image on disk, not in memory, until
+            ### all images are ready to combine.
+            logger.info("Saving the data for later")
+            filename = os.path.join(scratch, "{}.npy".format(len(mstack)))
+            data = np.lib.format.open_memmap(filename, mode='w+', dtype='float32', shape=hdu.data.shape)
+            data[:] = hdu.data
+            data.flush()
+            del (data)
+            mstack.append(np.load(filename, mmap_mode='r'))
+        timings[file_id] = (time.time() - start, pixels)
+
+    ### free up the memory being used by the bias and flat
+    release_calibrations(ccd)
+
+    ### last image has been processed so combine the stack
+    ### if this is a combine and we have more than on hdu
+
+    if opt.combine and len(file_ids) > 1:
+        logger.info("Median combining " + str(nim) + " images")
+        header = fits.Header()
+        header[args.extname_kw] = (hdu.header.get(args.extname_kw, args.extname_kw), 'Extension Name')
+        header['QRUNID'] = (hdu.header.get('QRUNID', ''), 'CFHT QSO Run flat built for')
+        header['FILTER'] = (hdu.header.get('FILTER', ''), 'Filter flat works for')
+        header['DETSIZE'] = hdu.header.get('DETSIZE', '')
+        header['DETSEC'] = hdu.header.get('DETSEC', '')
+        for im in file_ids:
+            header['comment'] = str(im) + " used to make this flat"
+
+        combined = outfile
+        if part:
+            combined = "{}.ccd{:02d}.part".format(outfile, int(ccd))
+            if os.access(combined, os.F_OK):
+                os.unlink(combined)
+        elif opt.split and os.access(outfile, os.F_OK):
+            os.unlink(outfile)
+        elif not opt.split and not os.access(outfile, os.W_OK):
+            logger.info("Creating output image " + outfile)
+            fits.HDUList([fits.PrimaryHDU()]).writeto(outfile)
+        logger.info("writing median combined stack to file " + combined)
+        combine(mstack, header, combined, percentile=opt.percentile, sigma=opt.sigma, short=opt.short)
+        del (mstack)
+        if part:
+            parts.append((outfile, combined))
+    del (hdu)
+    return parts, timings
+
+
+def _strip_percentile(cube, percentile, sigma=None, iterations=5):
+    """
+    The percentile along the first axis of cube, after rejecting values more than sigma standard
+    deviations from the median of their column if sigma is given.
+    """
+    if sigma is None:
+        return np.percentile(cube, percentile, axis=0)
+    cube = np.array(cube, dtype='float32')
+    for iteration in range(iterations):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(cube, axis=0)
+            std = np.nanstd(cube, axis=0)
+            reject = np.fabs(cube - median) > sigma * std
+        if not reject.any():
+            break
+        cube[reject] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanpercentile(cube, percentile, axis=0)
+
+
+def combine(images, header, outfile, percentile=40, sigma=None, rows=STRIP_ROWS, short=False):
+    """
+    Combine images into one, taking the percentile of the stack at each pixel.
+
+    The stack is combined in strips of rows, so only rows x NAXIS1 x len(images) pixels are in memory
+    at once, and each strip is written to outfile as soon as it is done.
+
+    @param images: the 2D arrays to combine, memory mapped, all the same shape.
+    @param header: cards to add to the header of the combined image.
+    @param outfile: the combined image is appended to this file, or written as the primary if it does not exist.
+    @param percentile: percentile of the stack to keep, 50 is the median.
+    @param sigma: reject values more than sigma standard deviations from the median before combining.
+    @param rows: number of rows in each strip.
+    @param short: write the combined image as ushort (Int16,BSCALE=1,BZERO=32768)
+    """
+    naxis2, naxis1 = images[0].shape
+    extension = os.access(outfile, os.F_OK)
+    structure = fits.Header()
+    if extension:
+        structure['XTENSION'] = 'IMAGE'
+    else:
+        structure['SIMPLE'] = True
+    structure['BITPIX'] = short and 16 or -32
+    structure['NAXIS'] = 2
+    structure['NAXIS1'] = naxis1
+    structure['NAXIS2'] = naxis2
+    if extension:
+        structure['PCOUNT'] = 0
+        structure['GCOUNT'] = 1
+    if short:
+        structure['BSCALE'] = 1
+        structure['BZERO'] = 32768
+    structure.extend(header, unique=True)
+    output = fits.StreamingHDU(outfile, structure)
+    for start in range(0, naxis2, rows):
+        strip = _strip_percentile(np.array([image[start:start + rows] for image in images]), percentile, sigma)
+        if short:
+            strip = (np.clip(np.around(strip), 0, 65535) - 32768).astype('>i2')
+        else:
+            strip = strip.astype('>f4')
+        output.write(strip)
+    output.close()
+
+
+def append_part(outfile, part):
+    """
+    Move the CCD in part into an extension of outfile.
+
+    The CCD is the last HDU of part; if part has more than one HDU its primary header is used
+    for the primary of outfile, when outfile has to be created.
+    """
+    with fits.open(part, uint=False) as hdulist:
+        if not os.access(outfile, os.W_OK):
+            logger.info("Creating output image " + outfile)
+            header = len(hdulist) > 1 and hdulist[0].header or None
+            fits.HDUList([fits.PrimaryHDU(header=header)]).writeto(outfile)
+        ### the scaling cards leave the header when the data is read, so note them first
+        ### and scale the CCD back the same way, eg. --short parts are int16 with BZERO=32768
+        bitpix = hdulist[-1].header['BITPIX']
+        bzero = hdulist[-1].header.get('BZERO', 0)
+        bscale = hdulist[-1].header.get('BSCALE', 1)
+        hdu = fits.ImageHDU(data=hdulist[-1].data, header=hdulist[-1].header)
+        if bitpix in INTEGER_BITPIX and (bzero != 0 or bscale != 1):
+            hdu.scale(INTEGER_BITPIX[bitpix], bzero=bzero, bscale=bscale)
+        with fits.open(outfile, 'append') as fitsobj:
+            fitsobj.append(hdu)
+    os.unlink(part)
+
+
+def process_ccds(file_ids, ccds, jobs=1):
+    """
+    Process, or combine, the ccds of each of the file_ids into the output file(s).
+
+    @param file_ids: the exposures to process.
+    @param ccds: the CCDs to process, in the order they go in the outputs.
+    @param jobs: number of CCDs to process at once, in worker processes.
+    @return: for each CCD, the seconds and pixels spent on each file_id.
+    """
+    if jobs > 1:
+        ### process the CCDs in parallel, each into files of their own,
+        ### and then gather those into the outputs in CCD order, so only
+        ### this process writes to the output MEFs.
+        stage(file_ids, ccds[0])
+        with futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                                         initargs=(opt, flats)) as executor:
+            results = list(executor.map(functools.partial(process_ccd, file_ids=file_ids, part=not opt.split), ccds))
+    else:
+        results = [process_ccd(ccd, file_ids) for ccd in ccds]
+    for parts, timings in results:
+        for outfile, part in parts:
+            append_part(outfile, part)
+    return [timings for parts, timings in results]
+
+
+def report_throughput(timings, elapsed):
+    """
+    Log the time spent on each exposure and the rate the run got through them.
+
+    @param timings: for each CCD processed, the seconds and pixels spent on each file_id.
+    @param elapsed: wall clock seconds for the whole run.
+    """
+    exposures = {}
+    for ccd_timings in timings:
+        for file_id in ccd_timings:
+            seconds, pixels = exposures.get(file_id, (0, 0))
+            exposures[file_id] = (seconds + ccd_timings[file_id][0], pixels + ccd_timings[file_id][1])
+    for file_id in exposures:
+        seconds, pixels = exposures[file_id]
+        logger.info("{}: {} CCDs {:.1f}s {:.1f} Mpix/s".format(file_id, len(timings), seconds,
+                                                            pixels / max(seconds, 1e-6) / 1e6))
+    logger.info("{} exposures in {:.1f}s, {:.2f} exposures/s".format(len(exposures), elapsed,
+                                                                    len(exposures) / max(elapsed, 1e-6)))
+
+
 if __name__ == '__main__':
     ### Must be running as a script
     import argparse
@@ -235,6 +645,21 @@ if __name__ == '__main__':
     parser.add_argument("--combine",
                         action="store_true",
                         help="Combine multiple images into single OUTFILE")
+    parser.add_argument("--percentile",
+                        action="store",
+                        type=float,
+                        default=40,
+                        help="Percentile of the stack to keep when combining")
+    parser.add_argument("--sigma",
+                        action="store",
+                        type=float,
+                        default=None,
+                        help="Reject pixels this many standard deviations from the median before combining")
+    parser.add_argument("--jobs",
+                        action="store",
+                        type=int,
+                        default=1,
+                        help="Number of CCDs to process in parallel processes")
     parser.add_argument("--extname_kw",
                         action="store",
                         default="EXTNAME",
@@ -282,7 +707,6 @@ if __name__ == '__main__':
     (args) = parser.parse_args()
     opt = args
 
-    logger = logging.getLogger()
     logger.addHandler(logging.StreamHandler())
     log_level = opt.verbose and logging.INFO or logging.CRITICAL
     log_level = opt.debug and logging.DEBUG or log_level
@@ -316,7 +740,6 @@ if __name__ == '__main__':
                             opt.bias])
             uri = os.path.normpath(uri)
             vos_client.copy(uri, opt.bias)
-        bias = fits.open(opt.bias, "readonly")
     else:
         opt.bias = None
 
@@ -327,178 +750,7 @@ if __name__ == '__main__':
         else:
             flats["ALL"] = opt.flat
 
-    flag = {'FLAT': 'f',
-            'BIAS': 'b',
-            'OBJECT': 'p',
-            'ZERO': 'b'
-    }
-
     ccds = args.ccds
 
-    for ccd in ccds:
-        logger.info("Working on ccd " + str(ccd))
-        stack = []
-        mstack = []
-        nim = 0
-        for file_id in file_ids:
-
-            nim += 1
-            hdu = get_from_dbimages(file_id)[int(ccd) + 1]
-
-            ### reopen the output file for each extension.
-            ### Create an output MEF file based on extension name if
-            ### opt.split is set.
-            if not opt.outfile and not opt.combine:
-                imtype = hdu.header.get('OBSTYPE')
-                outfile = str(hdu.header.get('EXPNUM')) + flag[imtype]
-            elif (opt.combine or len(file_ids) < 2) and opt.outfile:
-                re.match(r"(^.*)\.fits.fz", opt.outfile)
-                outfile = opt.outfile
-            else:
-                logger.error(("Mulitple input images needs one output "
-                              "but --output option not set? [Logic Error]"))
-                sys.exit(-1)
-            subs = "."
-            if opt.dist:
-                subs = opt.dist
-                object = hdu.header.get('OBJECT')
-                nccd = hdu.header.get('EXTNAME')
-                for dirs in [nccd, object]:
-                    subs = subs + "/" + dirs
-                    if not os.access(subs, os.F_OK):
-                        os.makedirs(subs)
-            subs = subs + "/"
-            if opt.split:
-                nccd = hdu.header.get('EXTVER')
-                outfile = outfile + string.zfill(str(nccd), 2)
-            outfile = subs + outfile + ".fits"
-            ### exit if the file exist and this is the ccd or
-            ### were splitting so every file should only have one
-            ### extension
-            if os.access(outfile, os.W_OK) and (ccd == 0 or opt.split) and not opt.combine:
-                sys.exit("Output file " + outfile + " already exists")
-
-            ### do the overscan for each file
-            logger.info("Processing " + file_id)
-
-            if opt.overscan:
-                logger.info("Overscan subtracting")
-                overscan(hdu)
-            if opt.bias:
-                logger.info("Subtracting bias frame " + opt.bias)
-                hdu.data -= bias[ccd + 1].data
-            if opt.trim:
-                logger.info("Trimming image")
-                trim(hdu)
-            if opt.flat:
-                qrunid = hdu.header.get('QRUNID',hdu.header.get('CRUNID','13A'))[0:3]
-                filter = hdu.header.get('FILTER', hdu.header.get('CRUNID', '13A'))[0]
-                flat_key = qrunid + "_" + filter
-                flat = flats.get(flat_key, flats.get("ALL", None))
-                if flat is None:
-                    raise ValueError("No available flat for {}".format(qrunid))
-                flat = get_from_dbimages(flat, calibrator=True)
-                logger.info("Dividing by flat field " + flat.filename())
-                hdu.data /= flat[ccd + 1].data
-                hdu.header.update("Flat", flat.filename(), comment="Flat Image")
-            if opt.normal:
-                logger.info("Normalizing the frame")
-                (h, b) = np.histogram(hdu.data, bins=1000)
-                idx = h.argsort()
-                mode = float((b[idx[-1]] + b[idx[-2]]) / 2.0)
-                hdu.data /= mode
-
-            if opt.flip:
-                if ccd < 18:
-                    logger.info("Flipping the x and y axis")
-                    hdu.data = hdu.data[::-1, ::-1]
-                    hdu.header['CRPIX2'] = hdu.data.shape[0] - hdu.header['CRPIX2']
-                    hdu.header['CRPIX1'] = hdu.data.shape[1] - hdu.header['CRPIX1']
-                    hdu.header['CD1_1'] = -1.0 * hdu.header['CD1_1']
-                    hdu.header['CD2_2'] = -1.0 * hdu.header['CD2_2']
-
-            hdu.header.update('CADCPROC', float(version),
-                              comment='Version of cadcproc')
-            ### write out this image if not combining
-            if args.megapipe:
-                for keyword in elixir_header:
-                    hdu.header.update(keyword, hdu.header.get(keyword, default=elixir_header[keyword][0]),
-                                      elixir_header[keyword][1])
-
-            if not opt.combine or len(file_ids) == 1:
-                logger.info("writing data to " + outfile)
-                ### write out the image now (don't overwrite
-                ### files that exist at the start of this process
-                if not opt.split:
-                    if not os.access(outfile, os.R_OK):
-                        pdu = get_from_dbimages(file_id)[0]
-                        hdul = fits.HDUList(fits.PrimaryHDU(header=pdu.header))
-                        hdul.writeto(outfile)
-                        hdul.close()
-                hdul = fits.open(outfile, 'append')
-                hdul.append(fits.ImageHDU(data=hdu.data,
-                                          header=hdu.header))
-                if opt.short:
-                    logger.info("Scaling to interger")
-                    hdul[-1].scale('int16', bzero=32768)
-                hdul.close()
-                hdu = None
-                hdul = None
-                nim = 0
-            else:
-                logger.info("Saving the data for later")
-                data = hdu.data
-                naxis1 = hdu.data.shape[0]
-                naxis2 = hdu.data.shape[1]
-                mstack.append(data)
-
-        ### free up the memory being used by the bias and flat
-        if opt.bias:
-            bias[ccd + 1].data = None
-        if opt.flat:
-            flat[ccd + 1].data = None
-
-        ### last image has been processed so combine the stack
-        ### if this is a combine and we have more than on hdu
-
-        if opt.combine and len(file_ids) > 1:
-            logger.info("Median combining " + str(nim) + " images")
-            mstack = np.vstack(mstack)
-            mstack.shape = [len(file_ids), naxis1, naxis2]
-            data = np.percentile(mstack, 40, axis=0)
-            del (mstack)
-            stack = fits.ImageHDU(data)
-            stack.header[args.extname_kw] = (hdu.header.get(args.extname_kw, args.extname_kw), 'Extension Name')
-            stack.header['QRUNID'] = (hdu.header.get('QRUNID', ''), 'CFHT QSO Run flat built for')
-            stack.header['FILTER'] = (hdu.header.get('FILTER', ''), 'Filter flat works for')
-            stack.header['DETSIZE'] = hdu.header.get('DETSIZE', '')
-            stack.header['DETSEC'] = hdu.header.get('DETSEC', '')
-
-            for im in file_ids:
-                hdu.header['comment'] = str(im) + " used to make this flat"
-            logger.info("writing median combined stack to file " + outfile)
-            if opt.split:
-                fitsobj = fits.open(outfile, 'update')
-                fitsobj[0] = hdu
-                if opt.short:
-                    logger.info("Scaling data to ushort")
-                    fitsobj[0].scale(type='int16', bzero=32768)
-                fitsobj.close()
-            else:
-                if not os.access(outfile, os.W_OK):
-                    logger.info("Creating output image " + outfile)
-                    fitsobj = fits.HDUList()
-                    pdu = fits.PrimaryHDU()
-                    fitsobj.append(fits.PrimaryHDU())
-                    fitsobj.writeto(outfile)
-                    fitsobj.close()
-                fitsobj = fits.open(outfile, 'append')
-                fitsobj.append(stack)
-                if opt.short:
-                    logger.info("Scaling data to ushort")
-                    fitsobj[-1].scale(type='int16', bzero=32768)
-                fitsobj.close()
-        del (stack)
-        del (hdu)
-    
-
+    start = time.time()
+    report_throughput(process_ccds(file_ids, ccds, jobs=opt.jobs), time.time() - start)
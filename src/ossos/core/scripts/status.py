@@ -9,7 +9,7 @@ import os
 import time
 
 
-def main(expnum):
+def main(expnums, jobs=8):
    
     commands= ['mkpsf', 
                'step1', 
@@ -17,24 +17,31 @@ def main(expnum):
                'step3', 
                'combine']
 
-    tags = storage.get_tags(expnum)
-    for ccd in range(36):
-        for command in commands:
-            tag = storage.tag_uri(storage.get_process_tag(command, ccd, 'p'))
-            if tags.get(tag, None) != storage.SUCCESS:
-                sys.stderr.write("FAILED: {} {} {}\n".format(expnum, ccd, command))
-                continue
-            tag = storage.tag_uri(storage.get_process_tag('fk'+command, ccd, 's'))
-            if tags.get(tag, None) != storage.SUCCESS:
-                sys.stderr.write("FAILED: {} {} {}\n".format(expnum, ccd, command))
-                continue
+    # read the tags of all the exposures in one pass.
+    all_tags = storage.prefetch_tags(expnums, jobs=jobs)
+    for expnum in expnums:
+        tags = all_tags.get(str(expnum), None)
+        if tags is None:
+            sys.stderr.write("FAILED: {} could not read tags\n".format(expnum))
+            continue
+        for ccd in range(36):
+            for command in commands:
+                tag = storage.tag_uri(storage.get_process_tag(command, ccd, 'p'))
+                if tags.get(tag, None) != storage.SUCCESS:
+                    sys.stderr.write("FAILED: {} {} {}\n".format(expnum, ccd, command))
+                    continue
+                tag = storage.tag_uri(storage.get_process_tag('fk'+command, ccd, 's'))
+                if tags.get(tag, None) != storage.SUCCESS:
+                    sys.stderr.write("FAILED: {} {} {}\n".format(expnum, ccd, command))
+                    continue
             
 if __name__=='__main__':
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("expnum", help="which exposure to check")
+    parser.add_argument("expnum", nargs='+', help="which exposures to check")
+    parser.add_argument("--jobs", "-j", type=int, default=8, help="number of exposures to read tags of at once")
     args = parser.parse_args()
 
-    main(args.expnum)
+    main(args.expnum, jobs=args.jobs)
 
 
@@ -33,7 +33,8 @@ console_scripts = ['mkpsf = ossos.pipeline.mkpsf:main', 'step3 = ossos.pipeline.
                    'align = ossos.pipeline.align:main',
                    'plant = ossos.pipeline.plant:main',
                    'astrom_mag_check = ossos.pipeline.astrom_mag_check:main',
-                   'scramble = ossos.pipeline.scramble:main']
+                   'scramble = ossos.pipeline.scramble:main',
+                   'scheduler = ossos.pipeline.scheduler:main']
 
 gui_scripts = ['validate = ossos.tools.validate:main']
 
@@ -1,4 +1,8 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase
+
 from ossos import mop_file
 from ossos import match
 
@@ -26,3 +30,25 @@ class TestMOPHeader(TestCase):
         match_mopfile = match.match_mopfiles(cand_detections, real_detections)
         self.assertEqual(match_mopfile.data['real'][0], 0)
         self.assertEqual(match_mopfile.data['real'][1], -1)
+
+    def test_parser_zeropoints(self):
+        lines = open("data/15BS+1+1_p39.cands.comb").read().split('\n')
+        directory = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        try:
+            os.chdir(directory)
+            with open("1832046p39.zeropoint.used", 'w') as fobj:
+                fobj.write("26.12\n")
+            header = mop_file.MOPHeader('jmp').parser(lines)
+            data = mop_file.MOPDataParser(header).parse(lines)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+        self.assertEqual(list(data["ZP_1832046p39"]), [26.12] * len(data))
+        self.assertEqual(list(data["ZP_1832036p39"]), [0] * len(data))
+
+    def test_parser_short_record(self):
+        lines = open("data/15BS+1+1_p39.cands.comb").read().split('\n')
+        header = mop_file.MOPHeader('jmp').parser(lines)
+        del lines[2]
+        self.assertRaises(ValueError, mop_file.MOPDataParser(header).parse, lines)
@@ -0,0 +1,48 @@
+from unittest import TestCase
+
+__author__ = 'jjk'
+
+import numpy
+
+from ossos import util
+
+
+class TestMatch_lists(TestCase):
+    """
+    Test that util.match_lists returns unique, mutual, matches.
+    """
+
+    def test_match_lists_planar(self):
+        pos1 = numpy.array([[10.0, 10.0], [100.0, 100.0], [500.0, 500.0]])
+        pos2 = numpy.array([[101.0, 99.0], [9.0, 11.0], [900.0, 900.0]])
+        match1, match2 = util.match_lists(pos1, pos2, tolerance=5)
+        self.assertEqual(list(match1.filled(-1)), [1, 0, -1])
+        self.assertEqual(list(match2.filled(-1)), [1, 0, -1])
+
+    def test_match_lists_unique(self):
+        """Two sources close to the same position only match once."""
+        pos1 = numpy.array([[10.0, 10.0], [12.0, 10.0]])
+        pos2 = numpy.array([[11.5, 10.0]])
+        match1, match2 = util.match_lists(pos1, pos2, tolerance=5)
+        self.assertEqual(list(match1.filled(-1)), [-1, 0])
+        self.assertEqual(list(match2.filled(-1)), [1])
+
+    def test_match_lists_spherical(self):
+        pos1 = numpy.array([[359.9999, 10.0], [180.0, -30.0]])
+        pos2 = numpy.array([[180.0, -30.0001], [0.0001, 10.0]])
+        match1, match2 = util.match_lists(pos1, pos2, tolerance=1.0/3600.0, spherical=True)
+        self.assertEqual(list(match1.filled(-1)), [1, 0])
+
+    def test_match_lists_large_index(self):
+        """Indexes beyond the range of int16 are preserved."""
+        npts = 40000
+        pos1 = numpy.transpose([numpy.arange(npts) * 10.0, numpy.zeros(npts)])
+        pos2 = pos1[::-1] + 0.5
+        match1, match2 = util.match_lists(pos1, pos2, tolerance=1)
+        self.assertEqual(match1[0], npts - 1)
+        self.assertEqual(match2[0], npts - 1)
+
+    def test_match_lists_empty(self):
+        match1, match2 = util.match_lists(numpy.array([]), numpy.array([[1.0, 1.0]]))
+        self.assertEqual(len(match1), 0)
+        self.assertTrue(match2.mask.all())
@@ -1,4 +1,5 @@
 from unittest import TestCase
+import numpy
 from astropy import units
 
 from ossos import cameras
@@ -44,3 +45,29 @@ class TestCamera(TestCase):
 
     def test_separation(self):
         self.fail()
+
+    def test_coverage(self):
+        ra = numpy.array([0.0, 0.3, 10.0])
+        dec = numpy.array([0.0, -0.2, 5.0])
+        target_ra = numpy.linspace(-1, 1, 41)
+        target_dec = numpy.linspace(-1, 1, 41)
+        coverage = cameras.Camera.coverage(ra, dec, target_ra, target_dec)
+
+        for idx in range(len(ra)):
+            ccds = cameras.Camera(ra[idx] * units.degree, dec[idx] * units.degree).geometry
+            for jdx in range(len(target_ra)):
+                expected = any(ccd[0] <= target_ra[jdx] <= ccd[2] and ccd[1] <= target_dec[jdx] <= ccd[3]
+                               for ccd in ccds)
+                self.assertEqual(coverage[idx, jdx], expected)
+        self.assertFalse(coverage[2].any())
+
+    def test_coverage_across_ra_zero(self):
+        target_ra = numpy.linspace(-1, 1, 41)
+        target_dec = numpy.linspace(-1, 1, 41)
+        expected = cameras.Camera.coverage(numpy.array([-0.05]), numpy.array([0.0]), target_ra, target_dec)
+
+        # the same field and targets with every RA in [0, 360).
+        coverage = cameras.Camera.coverage(numpy.array([359.95]), numpy.array([0.0]), target_ra % 360, target_dec)
+
+        self.assertTrue(expected.any())
+        self.assertTrue(numpy.array_equal(coverage, expected))
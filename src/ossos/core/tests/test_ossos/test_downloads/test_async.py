@@ -1,13 +1,18 @@
 __author__ = "David Rusk <drusk@uvic.ca>"
 
+import threading
 import unittest
 
+from hamcrest import assert_that, equal_to
 from mock import Mock
 
 from ossos.astrom import SourceReading
+from ossos.downloads import async_download
+from ossos.downloads.async_download import AsynchronousDownloadManager
+from ossos.downloads.async_download import DownloadQueue
 from ossos.downloads.async_download import DownloadRequest
 from ossos.downloads.async_download import DownloadThread
-from ossos.downloads.cutouts import ImageCutoutDownloader
+from ossos.downloads.cutouts.downloader import ImageCutoutDownloader
 from ossos.downloads.cutouts.source import SourceCutout
 
 
@@ -46,5 +51,114 @@ class DownloadThreadTest(unittest.TestCase):
         request.execute.assert_called_once_with(downloader)
 
 
+class DownloadQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.queue = DownloadQueue(max_prefetch=1)
+        self.worker = Mock(spec=DownloadThread)
+        self.worker.is_stopping.return_value = False
+
+    def request(self, reading=None, focus=(10, 10), callback=None):
+        return DownloadRequest(reading or Mock(spec=SourceReading), focus=focus, callback=callback)
+
+    def test_current_before_prefetch_and_ties_in_submission_order(self):
+        requests = [self.request() for i in range(4)]
+        self.queue.put(requests[0], async_download.PREFETCH_PRIORITY)
+        self.queue.put(requests[1], async_download.PREFETCH_PRIORITY)
+        self.queue.put(requests[2], async_download.CURRENT_PRIORITY)
+        self.queue.put(requests[3], async_download.CURRENT_PRIORITY)
+
+        taken = []
+        for i in range(3):
+            taken.append(self.queue.get(self.worker))
+        assert_that(taken, equal_to([requests[2], requests[3], requests[0]]))
+        assert_that(len(self.queue), equal_to(1))
+
+    def test_identical_requests_downloaded_once(self):
+        reading = Mock(spec=SourceReading)
+        callbacks = [Mock(), Mock()]
+        self.queue.put(self.request(reading, callback=callbacks[0]))
+        self.queue.put(self.request(reading, callback=callbacks[1]), async_download.CURRENT_PRIORITY)
+
+        request = self.queue.get(self.worker)
+        assert_that(request.priority, equal_to(async_download.CURRENT_PRIORITY))
+        assert_that(len(self.queue), equal_to(0))
+
+        downloader = Mock()
+        request.execute(downloader)
+        self.queue.task_done(request)
+        assert_that(downloader.download_cutout.call_count, equal_to(1))
+        for callback in callbacks:
+            callback.assert_called_once_with(downloader.download_cutout.return_value)
+        assert_that(self.queue.get_statistics()['deduplicated'], equal_to(1))
+
+    def test_stale_requests_cancelled_until_prioritized(self):
+        stale, current = Mock(spec=SourceReading), Mock(spec=SourceReading)
+        self.queue.put(self.request(stale))
+        self.queue.put(self.request(current))
+
+        assert_that(self.queue.cancel({stale}), equal_to(1))
+        self.queue.prioritize({current}, async_download.CURRENT_PRIORITY)
+        assert_that(len(self.queue), equal_to(1))
+        assert_that(self.queue.get(self.worker).reading, equal_to(current))
+
+        # going back to the stale reading queues its request again.
+        self.queue.prioritize({stale}, async_download.CURRENT_PRIORITY)
+        assert_that(self.queue.get(self.worker).reading, equal_to(stale))
+
+    def test_cancelled_requests_forgotten(self):
+        stale = Mock(spec=SourceReading)
+        self.queue.put(self.request(stale))
+        self.queue.cancel({stale})
+
+        assert_that(self.queue.forget_cancelled(), equal_to(1))
+        self.queue.prioritize({stale}, async_download.CURRENT_PRIORITY)
+        assert_that(len(self.queue), equal_to(0))
+
+    def test_prefetch_leaves_workers_for_current(self):
+        self.queue.put(self.request())
+        self.queue.put(self.request())
+        first = self.queue.get(self.worker)
+        assert_that(first.prefetching, equal_to(True))
+
+        # the second prefetch has to wait for the first, but a current request doesn't.
+        current = self.request()
+        self.queue.put(current, async_download.CURRENT_PRIORITY)
+        assert_that(self.queue.get(self.worker), equal_to(current))
+        self.queue.task_done(first)
+        assert_that(self.queue.get(self.worker).prefetching, equal_to(True))
+
+        statistics = self.queue.get_statistics()
+        assert_that(statistics['wait']['count'], equal_to(3))
+        assert_that(statistics['depth']['count'], equal_to(3))
+        assert_that(statistics['latency']['count'], equal_to(1))
+
+    def test_stopping_worker_not_given_work(self):
+        self.queue.put(self.request())
+        self.worker.is_stopping.return_value = True
+
+        assert_that(self.queue.get(self.worker), equal_to(None))
+
+
+class AsynchronousDownloadManagerTest(unittest.TestCase):
+    def test_wait_for_downloads_to_stop(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def download_cutout(reading, focus=None, needs_apcor=False):
+            started.set()
+            release.wait(5)
+
+        downloader = Mock()
+        downloader.download_cutout.side_effect = download_cutout
+        manager = AsynchronousDownloadManager(downloader, Mock(), max_threads=2, reserved_threads=1)
+        manager.submit_request(DownloadRequest(Mock(spec=SourceReading), focus=(1, 1)))
+        assert_that(started.wait(5), equal_to(True))
+
+        manager.stop_download()
+        assert_that(manager.wait_for_downloads_to_stop(timeout=0.1), equal_to(False))
+        release.set()
+        assert_that(manager.wait_for_downloads_to_stop(timeout=5), equal_to(True))
+
+
 if __name__ == '__main__':
     unittest.main()
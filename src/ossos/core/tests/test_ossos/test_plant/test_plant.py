@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 from ossos.plant import KBOGenerator
 # from ossos.pipeline import plant
@@ -6,6 +9,7 @@ from astropy.io import fits
 from ossos import util
 from tempfile import NamedTemporaryFile
 import json
+import numpy
 
 
 class PlantTest(unittest.TestCase):
@@ -41,3 +45,94 @@ class PlantTest(unittest.TestCase):
         plant.plant_kbos(filename, psf, kbos, shifts, "fk")
 
         self.assertEqual(len(kbos), self.number)
+
+
+class PlantKBOsTest(unittest.TestCase):
+
+    def setUp(self):
+        from ossos.pipeline import plant as plant_pipeline
+        self.plant = plant_pipeline
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        header = fits.Header()
+        for keyword, value in (('FUNCTION', 'gauss'), ('PSFHEIGH', 1000.0), ('PSFMAG', 20.0),
+                               ('PSFRAD', 12.0), ('XPSF', 50.0), ('YPSF', 40.0), ('VARORDER', 0),
+                               ('PAR1', 1.5), ('PAR2', 1.5)):
+            header[keyword] = value
+        fits.PrimaryHDU(data=numpy.zeros((51, 51)), header=header).writeto('psf.fits')
+        self.shifts = {'nmag': 10, 'emag': 0.01, 'dmag': 0.0, 'dmjd': 0.0,
+                       'CRVAL1': 0.0, 'CRVAL2': 0.0, 'CRPIX1': 0.0, 'CRPIX2': 0.0,
+                       'CD1_1': 1.0, 'CD1_2': 0.0, 'CD2_1': 0.0, 'CD2_2': 1.0}
+        self.kbos = KBOGenerator.get_kbos(n=5, rate=(0.5, 1.5), angle=(-10, 10), mag=(21.0, 22.0),
+                                          x=(50, 150), y=(50, 150), seed=1)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def write_image(self, data):
+        header = fits.Header()
+        header['PIXSCAL1'] = 0.185
+        header['EXPTIME'] = 287.0
+        fits.PrimaryHDU(data=data, header=header).writeto('image.fits')
+
+    def plant_kbos(self, seed):
+        self.plant.plant_kbos('image.fits', 'psf.fits', self.kbos, self.shifts, 'fk',
+                              rng=numpy.random.default_rng(seed))
+        with fits.open('fkimage.fits', do_not_scale_image_data=True) as hdulist:
+            return hdulist[0].header, numpy.array(hdulist[0].data)
+
+    def test_scaling_preserved(self):
+        self.write_image(numpy.full((200, 200), 1000, dtype='uint16'))
+
+        header, data = self.plant_kbos(seed=3)
+
+        self.assertEqual(header['BITPIX'], 16)
+        self.assertEqual(header['BZERO'], 32768)
+        self.assertTrue(data.max() > 1000 - 32768)
+
+    def test_float_image_stays_float(self):
+        self.write_image(numpy.full((200, 200), 1000.5, dtype='float32'))
+
+        header, data = self.plant_kbos(seed=3)
+
+        self.assertEqual(header['BITPIX'], -32)
+        self.assertNotIn('BZERO', header)
+
+    def test_seeded_planting_reproducible(self):
+        self.write_image(numpy.full((200, 200), 1000, dtype='uint16'))
+
+        header, first = self.plant_kbos(seed=3)
+        os.unlink('fkimage.fits')
+        header, second = self.plant_kbos(seed=3)
+
+        self.assertTrue(numpy.array_equal(first, second))
+
+
+class KBOGeneratorSampleTest(unittest.TestCase):
+
+    def get_kbos(self, n, seed):
+        return KBOGenerator.get_kbos(n=n, rate=(0.5, 15), angle=(-10, 50), mag=(21.0, 25.5),
+                                     x=(33, 2080), y=(1, 4612), seed=seed)
+
+    def test_seed_reproducible(self):
+        kbos = self.get_kbos(100, seed=42)
+        self.assertTrue(numpy.all(kbos.as_array() == self.get_kbos(100, seed=42).as_array()))
+        self.assertFalse(numpy.all(kbos['x'] == self.get_kbos(100, seed=43)['x']))
+
+    def test_columns_in_range(self):
+        kbos = self.get_kbos(20000, seed=1)
+
+        self.assertEqual(len(kbos), 20000)
+        self.assertEqual(list(kbos['id'][:3]), [1, 2, 3])
+        for name, low, high in (('x', 33, 2080), ('y', 1, 4612), ('mag', 21.0, 25.5),
+                                ('sky_rate', 0.5, 15), ('angle', -10, 50)):
+            self.assertTrue(kbos[name].min() >= low and kbos[name].max() <= high, name)
+
+    def test_magnitude_step(self):
+        kbos = self.get_kbos(20000, seed=1)
+
+        # density is 0.3 below 23.3 and 0.7 above.
+        expected = 0.3 * 2.3 / (0.3 * 2.3 + 0.7 * 2.2)
+        self.assertAlmostEqual((kbos['mag'] < 23.3).mean(), expected, delta=0.02)
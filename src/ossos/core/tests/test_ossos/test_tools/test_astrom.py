@@ -237,6 +237,44 @@ class ParserTest(FileReadingTestCase):
         assert_that(obs0.ccdnum, equal_to("00"))
         assert_that(obs0.is_fake(), equal_to(True))
 
+    def test_stream_sources(self):
+        astrom_data = self.parse(FK_FILE)
+        streamed_data = self.parser.parse(self.get_abs_path(FK_FILE), stream=True)
+
+        assert_that([obs.rawname for obs in streamed_data.observations],
+                    equal_to([obs.rawname for obs in astrom_data.observations]))
+        assert_that(streamed_data.sys_header, equal_to(astrom_data.sys_header))
+        streamed_sources = list(streamed_data.get_sources())
+        assert_that(streamed_sources, has_length(21))
+        for source, streamed_source in zip(astrom_data.get_sources(), streamed_sources):
+            for reading, streamed_reading in zip(source.get_readings(), streamed_source.get_readings()):
+                assert_that((streamed_reading.x, streamed_reading.y, streamed_reading.ra, streamed_reading.dec),
+                            equal_to((reading.x, reading.y, reading.ra, reading.dec)))
+
+    def test_streamed_sources_counted_and_reiterable(self):
+        astrom_data = self.parse(FK_FILE)
+        streamed_data = self.parser.parse(self.get_abs_path(FK_FILE), stream=True)
+
+        assert_that(streamed_data.get_source_count(), equal_to(21))
+        assert_that(streamed_data.get_reading_count(), equal_to(astrom_data.get_reading_count()))
+        assert_that(list(streamed_data.get_sources()), has_length(21))
+        assert_that(list(streamed_data.get_sources()), has_length(21))
+
+    def test_sky_coord_built_on_access(self):
+        reading = self.parse(TEST_FILE_1).sources[0].get_reading(0)
+
+        assert_that(reading._sky_coord, equal_to(None))
+        assert_that(reading.ra, equal_to(26.6833367))
+        assert_that(reading.sky_coord.ra.degree, close_to(26.6833367, 1e-9))
+        assert_that(reading.reference_sky_coord, same_instance(reading.reference_reading.sky_coord))
+
+    def test_cutout_includes_all_readings(self):
+        source = self.parse(TEST_FILE_1).sources[0]
+
+        for reading in source.get_readings():
+            sep = reading.reference_sky_coord.separation(reading.sky_coord)
+            assert_that(reading.uncertainty_ellipse.a * 2.5 >= sep, equal_to(True))
+
 
 class GeneralAstromWriterTest(FileReadingTestCase):
     def setUp(self):
@@ -0,0 +1,146 @@
+import shutil
+import tempfile
+import unittest
+
+import numpy
+from astropy.io import fits
+from hamcrest import assert_that, equal_to, none
+
+from ossos.cache import PersistentCache, TileCache
+
+
+class PersistentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = PersistentCache(directory=self.directory, max_size=100000, ttl=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get_header(self):
+        header = fits.Header()
+        header['EXPNUM'] = 1616681
+        self.cache.put("vos:OSSOS/dbimages/1616681/1616681p.fits", header, mtime="2014-01-01")
+
+        cached = self.cache.get("vos:OSSOS/dbimages/1616681/1616681p.fits")
+
+        assert_that(cached['EXPNUM'], equal_to(1616681))
+        assert_that(self.cache.get("missing"), none())
+        assert_that(self.cache.hits, equal_to(1))
+        assert_that(self.cache.misses, equal_to(1))
+
+    def test_shared_between_instances(self):
+        self.cache.put("fwhm", 3.5)
+        other = PersistentCache(directory=self.directory, max_size=100000, ttl=3600)
+        assert_that(other.get("fwhm"), equal_to(3.5))
+
+    def test_least_recently_used_evicted(self):
+        cache = PersistentCache(directory=self.directory, max_size=2500, ttl=3600)
+        cache.put("first", b"x" * 1000)
+        cache.put("second", b"x" * 1000)
+        cache.get("first")
+        cache.put("third", b"x" * 1000)
+
+        assert_that("second" in cache, equal_to(False))
+        assert_that("first" in cache, equal_to(True))
+        assert_that("third" in cache, equal_to(True))
+        assert_that(cache.stats()['evictions'], equal_to(1))
+
+    def test_expired_entry_revalidated_on_modification_date(self):
+        cache = PersistentCache(directory=self.directory, max_size=100000, ttl=-1, revalidate_interval=-1)
+        cache.put("zeropoint", 26.0, mtime="2014-01-01")
+
+        assert_that(cache.get("zeropoint", revalidate=lambda: "2014-01-01"), equal_to(26.0))
+        assert_that(cache.get("zeropoint", revalidate=lambda: "2015-01-01"), none())
+        assert_that("zeropoint" in cache, equal_to(False))
+
+    def test_modified_source_dropped_before_ttl(self):
+        cache = PersistentCache(directory=self.directory, max_size=100000, ttl=3600, revalidate_interval=-1)
+        cache.put("fwhm", 3.5, mtime="2014-01-01")
+
+        assert_that(cache.get("fwhm", revalidate=lambda: "2014-01-02"), none())
+        assert_that("fwhm" in cache, equal_to(False))
+
+    def test_revalidation_memoized(self):
+        cache = PersistentCache(directory=self.directory, max_size=100000, ttl=3600, revalidate_interval=3600)
+        cache.put("fwhm", 3.5, mtime="2014-01-01")
+        calls = []
+
+        def revalidate():
+            calls.append(1)
+            return "2014-01-01"
+
+        assert_that(cache.get("fwhm", revalidate=revalidate), equal_to(3.5))
+        assert_that(len(calls), equal_to(0))
+
+        # another process has no memo and checks the source.
+        other = PersistentCache(directory=self.directory, max_size=100000, ttl=3600, revalidate_interval=3600)
+        assert_that(other.get("fwhm", revalidate=revalidate), equal_to(3.5))
+        assert_that(other.get("fwhm", revalidate=revalidate), equal_to(3.5))
+        assert_that(len(calls), equal_to(1))
+
+    def test_unreachable_source_falls_back_to_ttl(self):
+        cache = PersistentCache(directory=self.directory, max_size=100000, ttl=3600, revalidate_interval=-1)
+        cache.put("fwhm", 3.5, mtime="2014-01-01")
+        assert_that(cache.get("fwhm", revalidate=lambda: None), equal_to(3.5))
+
+    def test_expired_entry_without_revalidation_dropped(self):
+        cache = PersistentCache(directory=self.directory, max_size=100000, ttl=-1)
+        cache.put("zeropoint", 26.0, mtime="2014-01-01")
+        assert_that(cache.get("zeropoint"), none())
+
+
+class TileCacheTest(unittest.TestCase):
+
+    image_uri = "vos:OSSOS/dbimages/1616681/1616681p.fits"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = TileCache(directory=self.directory, max_size=10 ** 6)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def tile(self, xoffset, yoffset, shape=(100, 100)):
+        header = fits.Header()
+        header['EXTNO'] = 3
+        header['XOFFSET'] = xoffset
+        header['YOFFSET'] = yoffset
+        return fits.ImageHDU(data=numpy.ones(shape, dtype='float32'), header=header)
+
+    def test_add_and_open(self):
+        key = self.cache.add(self.image_uri, self.tile(1000, 2000))
+
+        tiles = self.cache.tiles(self.image_uri)
+        assert_that(len(tiles), equal_to(1))
+        assert_that(tiles[0][0], equal_to(key))
+        assert_that(tiles[0][1]['XOFFSET'], equal_to(1000))
+        with self.cache.open(key) as hdulist:
+            assert_that(hdulist[1].data.shape, equal_to((100, 100)))
+        assert_that(self.cache.tiles("vos:OSSOS/dbimages/1616682/1616682p.fits"), equal_to([]))
+
+    def test_most_recently_used_first(self):
+        first = self.cache.add(self.image_uri, self.tile(0, 0))
+        second = self.cache.add(self.image_uri, self.tile(500, 500))
+        self.cache.open(first).close()
+
+        assert_that([key for key, header in self.cache.tiles(self.image_uri)], equal_to([first, second]))
+
+    def test_least_recently_used_evicted(self):
+        first = self.cache.add(self.image_uri, self.tile(0, 0))
+        size = self.cache.stats()['size']
+        cache = TileCache(directory=self.directory, max_size=int(size * 2.5))
+        second = cache.add(self.image_uri, self.tile(500, 500))
+        cache.open(first).close()
+        cache.add(self.image_uri, self.tile(900, 900))
+
+        keys = [key for key, header in cache.tiles(self.image_uri)]
+        assert_that(len(keys), equal_to(2))
+        assert_that(second in keys, equal_to(False))
+        assert_that(cache.open(second), none())
+        assert_that(cache.stats()['evictions'], equal_to(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 __author__ = "David Rusk <drusk@uvic.ca>"
 
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy
+from astropy.io import fits
+from hamcrest import assert_that, close_to, equal_to
+
 from tests.base_tests import FileReadingTestCase
 from ossos import daophot
 
@@ -71,5 +78,132 @@ class DaophotTest(FileReadingTestCase):
         assert_that(magerr, close_to(0.290, 0.0011))
 
 
+class NumpyPhotTest(unittest.TestCase):
+    """Measure a noiseless Gaussian star on a flat sky, where the answers are known."""
+
+    def setUp(self):
+        self.flux = 50000.0
+        self.sky = 1000.0
+        self.x = 60.3
+        self.y = 40.7
+        sigma = 1.5
+        rows, cols = numpy.mgrid[1:81, 1:121]
+        data = self.sky + self.flux * numpy.exp(-((cols - self.x) ** 2 + (rows - self.y) ** 2) / (2 * sigma ** 2)) / (
+            2 * numpy.pi * sigma ** 2)
+        header = fits.Header()
+        header['PHOTZP'] = 30.0
+        handle, self.filename = tempfile.mkstemp(suffix='.fits')
+        os.close(handle)
+        fits.PrimaryHDU(data=data.astype('float32'), header=header).writeto(self.filename, overwrite=True)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_centroid_and_magnitude(self):
+        table = daophot.phot(self.filename, [self.x + 0.8, 10.0], [self.y - 0.6, 10.0], aperture=10, sky=12,
+                             swidth=5, apcor=0.0, zmag=30.0, backend=daophot.NUMPY)
+
+        # the 5 pixel centroid box, as IRAF, is biased towards the centre of the pixel.
+        assert_that(table['XCENTER'][0], close_to(self.x, 0.15))
+        assert_that(table['YCENTER'][0], close_to(self.y, 0.15))
+        assert_that(table['MSKY'][0], close_to(self.sky, 0.01))
+        assert_that(table['MAG'][0], close_to(30.0 - 2.5 * numpy.log10(self.flux), 0.01))
+        assert_that(table['PIER'][0], equal_to(0))
+        # the second position runs off the image.
+        assert_that(table['PIER'][1], equal_to(daophot.APERT_OUTOFBOUNDS))
+        assert_that(bool(table['MAG'].mask[1]), equal_to(True))
+
+    def test_no_centroid(self):
+        table = daophot.phot(self.filename, self.x + 0.8, self.y, aperture=10, sky=12, swidth=5, apcor=0.0,
+                             zmag=30.0, centroid=False, backend=daophot.NUMPY)
+
+        assert_that(table['XCENTER'][0], equal_to(self.x + 0.8))
+
+
+class AddStarsTest(unittest.TestCase):
+    """Plant stars with an analytic gaussian PSF and a lookup table of corrections."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # gaussian with half width at half maximum PAR1 integrates to height * 2 pi sigma**2.
+        sigma = 1.5 / numpy.sqrt(2 * numpy.log(2))
+        self.flux = 1000.0 * 2 * numpy.pi * sigma ** 2
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_psf(self, correction, function='gauss', par=(1.5, 1.5)):
+        filename = os.path.join(self.directory, 'psf.fits')
+        header = fits.Header()
+        for keyword, value in (('FUNCTION', function), ('PSFHEIGH', 1000.0), ('PSFMAG', 20.0),
+                               ('PSFRAD', 12.0), ('XPSF', 50.0), ('YPSF', 40.0), ('VARORDER', 0)):
+            header[keyword] = value
+        for index, value in enumerate(par):
+            header['PAR{}'.format(index + 1)] = value
+        fits.PrimaryHDU(data=numpy.ones((51, 51)) * correction, header=header).writeto(filename, overwrite=True)
+        return daophot.PSF(filename)
+
+    def test_add_stars(self):
+        data = numpy.zeros((80, 100))
+
+        daophot.add_stars(data, self.write_psf(0.0), [40.3, 70.0], [30.6, 50.0], [20.0, 21.0], noise=False)
+
+        bright = data[18:43, 28:53]
+        assert_that(bright.sum(), close_to(self.flux, 1.0))
+        assert_that(numpy.unravel_index(bright.argmax(), bright.shape), equal_to((12, 11)))
+        faint = data[38:63, 57:82]
+        assert_that(faint.sum() / bright.sum(), close_to(10 ** -0.4, 1e-4))
+
+    def test_lookup_table(self):
+        data = numpy.zeros((80, 100))
+
+        daophot.add_stars(data, self.write_psf(1.0), [40.0], [30.0], [20.0], noise=False)
+
+        # the correction is added to each pixel within PSFRAD of the star.
+        offsets = numpy.arange(-12, 13)
+        npix = (offsets[:, None] ** 2 + offsets[None, :] ** 2 <= 144).sum()
+        assert_that(data.sum(), close_to(self.flux + npix, 1.0))
+
+    def test_poisson_noise(self):
+        data = numpy.zeros((80, 100))
+
+        daophot.add_stars(data, self.write_psf(0.0), [40.0], [30.0], [20.0], noise=True)
+
+        assert_that(numpy.all(data == numpy.rint(data)), equal_to(True))
+        assert_that(data.sum(), close_to(self.flux, 5 * numpy.sqrt(self.flux)))
+
+    def test_penny_profiles(self):
+        dx, dy = numpy.meshgrid(numpy.linspace(-5, 5, 11), numpy.linspace(-4, 4, 9))
+        gauss = self.write_psf(0.0).profile(dx, dy)
+        lorentz = self.write_psf(0.0, function='lorentz', par=(1.5, 1.5, 0.0)).profile(dx, dy)
+
+        # all core is the gaussian and all wings the lorentzian, the peak is 1 whatever the mix.
+        penny = self.write_psf(0.0, function='penny1', par=(1.5, 1.5, 0.0, 0.0)).profile(dx, dy)
+        assert_that(numpy.allclose(penny, gauss), equal_to(True))
+        penny = self.write_psf(0.0, function='penny1', par=(1.5, 1.5, 1.0, 0.0)).profile(dx, dy)
+        assert_that(numpy.allclose(penny, lorentz), equal_to(True))
+        penny1 = self.write_psf(0.0, function='penny1', par=(1.5, 1.5, 0.3, 0.1)).profile(dx, dy)
+        assert_that(penny1[4, 5], close_to(1.0, 1e-12))
+        assert_that(numpy.allclose(penny1, 0.7 * numpy.exp(-numpy.log(2) * ((dx / 1.5) ** 2 + (dy / 1.5) ** 2 +
+                                                                           0.1 * dx * dy)) + 0.3 * lorentz),
+                    equal_to(True))
+
+        # penny2 only differs in tilting the wings too.
+        penny2 = self.write_psf(0.0, function='penny2', par=(1.5, 1.5, 0.3, 0.1, 0.0)).profile(dx, dy)
+        assert_that(numpy.allclose(penny2, penny1), equal_to(True))
+        penny2 = self.write_psf(0.0, function='penny2', par=(1.5, 1.5, 0.3, 0.1, 0.2)).profile(dx, dy)
+        assert_that(numpy.allclose(penny2 - penny1, 0.3 / (1 + (dx / 1.5) ** 2 + (dy / 1.5) ** 2 + 0.2 * dx * dy) -
+                                   0.3 * lorentz), equal_to(True))
+
+    def test_seeded_noise_reproducible(self):
+        psf = self.write_psf(0.0)
+        first = daophot.add_stars(numpy.zeros((80, 100)), psf, [40.0], [30.0], [20.0],
+                                  rng=numpy.random.default_rng(42))
+        second = daophot.add_stars(numpy.zeros((80, 100)), psf, [40.0], [30.0], [20.0],
+                                   rng=numpy.random.default_rng(42))
+
+        assert_that(numpy.array_equal(first, second), equal_to(True))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from astropy.io import fits
+from hamcrest import assert_that, equal_to, close_to
+
+from ossos import wcs
+from ossos.pipeline import measure3
+from tests.base_tests import FileReadingTestCase
+
+FRAMES = ['1616687p10', '1616698p10', '1616709p10']
+
+
+class Measure3Test(FileReadingTestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        astrom_lines = open(self.get_abs_path("data/1616687p10.measure3.cands.astrom")).readlines()
+        os.chdir(self.directory)
+        with open("1616687p10.cands.comb", 'w') as cands_file:
+            for line in astrom_lines:
+                if "X_0" in line:
+                    cands_file.write("##   X        Y        X_0     Y_0    FLUX    SIZE   MAX_INT  ELON\n")
+                elif line.startswith('#') or len(line.strip()) == 0:
+                    cands_file.write(line)
+                else:
+                    cands_file.write(" ".join(line.split()[0:4]) + "  100.0  3.0  200.0  1.1\n")
+        self.headers = {}
+        for idx, frame in enumerate(FRAMES):
+            header = fits.Header()
+            for keyword, value in (('NAXIS', 2), ('NAXIS1', 2112), ('NAXIS2', 4644),
+                                   ('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'),
+                                   ('CRPIX1', 7442.65 - idx), ('CRPIX2', -128.69),
+                                   ('CRVAL1', 211.82842), ('CRVAL2', -11.83331),
+                                   ('CD1_1', -5.1e-5), ('CD1_2', 0.0), ('CD2_1', 0.0), ('CD2_2', 5.1e-5),
+                                   ('NORDFIT', 3)):
+                header[keyword] = value
+            for axis in (1, 2):
+                for term in range(11):
+                    # a small distortion, so the PV terms matter.
+                    header['PV{}_{}'.format(axis, term)] = {1: 1.0, 4: 1.0e-3}.get(term, 0.0)
+            fits.PrimaryHDU(header=header).writeto("{}.fits".format(frame))
+            self.headers[frame] = header
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_read_cands(self):
+        header_lines, base_names, coords = measure3.read_cands("1616687p10.cands.comb")
+
+        assert_that(base_names, equal_to(FRAMES))
+        assert_that(coords.shape[1:], equal_to((3, 4)))
+        assert_that(coords[0, 1, 0], equal_to(785.65))
+        assert_that(coords[0, 1, 3], equal_to(3339.91))
+
+    def test_run_in_process(self):
+        measure3.run("1616687p10")
+
+        lines = [line.split() for line in open("1616687p10.measure3.cands.astrom")
+                 if not line.startswith('#') and len(line.strip()) > 0]
+        header_lines, base_names, coords = measure3.read_cands("1616687p10.cands.comb")
+        assert_that(len(lines), equal_to(coords.shape[0] * 3))
+        for jdx, values in enumerate(lines):
+            frame_wcs = wcs.WCS(self.headers[FRAMES[jdx % 3]])
+            ra, dec = frame_wcs.xy2sky(float(values[0]), float(values[1]))
+            assert_that(float(values[4]), close_to(ra.to('degree').value, 1e-7))
+            assert_that(float(values[5]), close_to(dec.to('degree').value, 1e-7))
+        assert_that(os.access(measure3.SUCCESS_FILE, os.F_OK), equal_to(True))
+
+
+if __name__ == '__main__':
+    unittest.main()
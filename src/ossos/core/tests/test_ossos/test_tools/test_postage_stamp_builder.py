@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from astropy import units
+from astropy.io import fits
+from hamcrest import assert_that, equal_to, contains_inanyorder
+from mock import patch, Mock
+
+from ossos.tools import postage_stamp_builder
+
+WORK = [("vos:OSSOS/dbimages/{0}/{0}p.fits".format(expnum), None,
+         "vos:OSSOS/postage_stamps/v8/o3e01/o3e01_{}.fits".format(expnum))
+        for expnum in (1616681, 1616692, 1616703)]
+
+
+class BuildStampsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "postage_stamps.v8.manifest")
+        self.calls = []
+        self.failures = {}
+        sleep = patch("ossos.retry.time.sleep")
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_stamp(self, uri, sky_coord, radius, stamp_uri):
+        self.calls.append(stamp_uri)
+        if self.failures.get(stamp_uri, 0) > 0:
+            self.failures[stamp_uri] -= 1
+            raise IOError("Connection reset by peer")
+
+    def build(self, max_attempts=3):
+        manifest = postage_stamp_builder.Manifest(self.filename)
+        try:
+            with patch("ossos.tools.postage_stamp_builder.make_stamp", self.make_stamp):
+                return postage_stamp_builder.build_stamps(WORK, 36 * units.arcsec, manifest,
+                                                          jobs=2, max_attempts=max_attempts)
+        finally:
+            manifest.close()
+
+    def test_rerun_skips_manifest(self):
+        assert_that(self.build(), equal_to((3, 0)))
+        assert_that(self.calls, contains_inanyorder(*[item[2] for item in WORK]))
+
+        self.calls = []
+        assert_that(self.build(), equal_to((0, 0)))
+        assert_that(self.calls, equal_to([]))
+
+    def test_retries_are_bounded(self):
+        self.failures = {WORK[0][2]: 1, WORK[1][2]: 10}
+        assert_that(self.build(max_attempts=3), equal_to((2, 1)))
+        assert_that(self.calls.count(WORK[0][2]), equal_to(2))
+        assert_that(self.calls.count(WORK[1][2]), equal_to(3))
+
+        # the failed stamp is not in the manifest, so the next run tries it again.
+        self.calls = []
+        self.failures = {}
+        assert_that(self.build(), equal_to((1, 0)))
+        assert_that(self.calls, equal_to([WORK[1][2]]))
+
+    def test_upload_retried_only_by_build_stamps(self):
+        upload = Mock(side_effect=IOError("Connection reset by peer"))
+        manifest = postage_stamp_builder.Manifest(self.filename)
+        try:
+            with patch("ossos.storage.ra_dec_cutout", return_value=fits.HDUList([fits.PrimaryHDU()])), \
+                    patch("ossos.storage.client.copy", upload):
+                result = postage_stamp_builder.build_stamps(WORK[:1], 36 * units.arcsec, manifest,
+                                                            jobs=1, max_attempts=3)
+        finally:
+            manifest.close()
+        assert_that(result, equal_to((0, 1)))
+        assert_that(upload.call_count, equal_to(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
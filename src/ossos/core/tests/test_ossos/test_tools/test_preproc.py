@@ -0,0 +1,101 @@
+import argparse
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+from astropy.io import fits
+from hamcrest import assert_that, equal_to
+
+PREPROC = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'scripts', 'preproc.py')
+
+
+def load_preproc():
+    spec = importlib.util.spec_from_file_location('preproc', PREPROC)
+    module = importlib.util.module_from_spec(spec)
+    # the worker processes find the functions they are handed by module name.
+    sys.modules['preproc'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+preproc = load_preproc()
+
+CCDS = [0, 1]
+
+
+class PreprocTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.file_ids = [self.exposure(1616681 + i, [1018, 1234]) for i in range(3)]
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def exposure(self, expnum, values):
+        primary = fits.PrimaryHDU()
+        primary.header['EXPNUM'] = expnum
+        hdulist = fits.HDUList([primary])
+        for ccd in CCDS:
+            data = numpy.full((20, 30), values[ccd], dtype='float32')
+            data[0, 0] = 65535
+            hdu = fits.ImageHDU(data=data)
+            hdu.header['EXTNAME'] = 'ccd{:02d}'.format(ccd)
+            hdu.header['OBSTYPE'] = 'OBJECT'
+            hdu.header['EXPNUM'] = expnum
+            hdulist.append(hdu)
+        filename = "{}o.fits".format(expnum)
+        hdulist.writeto(filename)
+        return filename
+
+    def run_preproc(self, file_ids, outfile, jobs, combine=False):
+        options = argparse.Namespace(outfile=outfile, combine=combine, split=False, dist=None, overscan=False,
+                                     bias=None, trim=False, flat=None, normal=False, flip=False, megapipe=False,
+                                     short=True, percentile=40, sigma=None, extname_kw='EXTNAME', jobs=jobs)
+        preproc.init_worker(options, {})
+        preproc.process_ccds(file_ids, CCDS, jobs=jobs)
+        with fits.open(outfile + ".fits") as hdulist:
+            return [(hdu.header.get('EXTNAME'), hdu.header.get('BZERO'), hdu.data.copy())
+                    for hdu in hdulist[1:]]
+
+    def check_parallel_matches_serial(self, file_ids, combine):
+        serial = self.run_preproc(file_ids, "serial", 1, combine=combine)
+        parallel = self.run_preproc(file_ids, "parallel", 2, combine=combine)
+
+        assert_that(len(parallel), equal_to(len(CCDS)))
+        for (name, bzero, data), (parallel_name, parallel_bzero, parallel_data) in zip(serial, parallel):
+            assert_that(parallel_name, equal_to(name))
+            assert_that(parallel_bzero, equal_to(bzero))
+            assert_that(parallel_data.tolist(), equal_to(data.tolist()))
+        assert_that([int(data[1, 1]) for name, bzero, data in parallel], equal_to([1018, 1234]))
+        assert_that([int(data[0, 0]) for name, bzero, data in parallel], equal_to([65535, 65535]))
+        assert_that([name for name in os.listdir('.') if name.endswith('.part')], equal_to([]))
+
+    def test_combine_parallel_matches_serial(self):
+        self.check_parallel_matches_serial(self.file_ids, combine=True)
+
+    def test_calibrate_parallel_matches_serial(self):
+        self.check_parallel_matches_serial(self.file_ids[:1], combine=False)
+
+    def test_append_part_keeps_short_scaling(self):
+        images = [numpy.full((20, 30), 1018, dtype='float32') for i in range(3)]
+        preproc.combine(images, fits.Header(), "ccd00.part", short=True)
+        fits.HDUList([fits.PrimaryHDU()]).writeto("combined.fits")
+
+        preproc.append_part("combined.fits", "ccd00.part")
+
+        with fits.open("combined.fits") as hdulist:
+            assert_that(hdulist[1].header['BZERO'], equal_to(32768))
+            assert_that(hdulist[1].data.tolist(), equal_to(images[0].tolist()))
+        assert_that(os.access("ccd00.part", os.F_OK), equal_to(False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import errno
+import unittest
+
+from hamcrest import assert_that, equal_to, less_than_or_equal_to, greater_than_or_equal_to
+from mock import Mock, patch
+
+from ossos import retry
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = retry.RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=10.0, jitter=0.5)
+
+    @patch("ossos.retry.time.sleep")
+    def test_retries_until_success(self, sleep):
+        func = Mock(side_effect=[IOError(errno.EAGAIN, "busy"), IOError(errno.EAGAIN, "busy"), "done"])
+
+        assert_that(self.policy.call(func, "vos:OSSOS/dbimages"), equal_to("done"))
+        assert_that(func.call_count, equal_to(3))
+        assert_that(sleep.call_count, equal_to(2))
+
+    @patch("ossos.retry.time.sleep")
+    def test_gives_up_after_max_attempts(self, sleep):
+        func = Mock(side_effect=IOError(errno.EAGAIN, "busy"))
+
+        self.assertRaises(IOError, self.policy.call, func)
+        assert_that(func.call_count, equal_to(3))
+
+    @patch("ossos.retry.time.sleep")
+    def test_missing_file_not_retried(self, sleep):
+        func = Mock(side_effect=IOError(errno.ENOENT, "no such node"))
+
+        self.assertRaises(IOError, self.policy.call, func)
+        assert_that(func.call_count, equal_to(1))
+        assert_that(sleep.call_count, equal_to(0))
+
+    def test_delay_is_exponential_with_jitter(self):
+        for attempt, nominal in [(1, 1.0), (2, 2.0), (3, 4.0), (6, 10.0)]:
+            delay = self.policy.delay(attempt)
+            assert_that(delay, greater_than_or_equal_to(nominal * 0.5))
+            assert_that(delay, less_than_or_equal_to(nominal * 1.5))
+
+    @patch("ossos.retry.time.sleep")
+    def test_metrics_recorded_per_uri(self, sleep):
+        metrics = retry.TransferMetrics(filename="")
+        func = Mock(side_effect=[IOError(errno.EAGAIN, "busy"), b"data"])
+
+        with patch("ossos.retry.metrics", metrics):
+            self.policy.call(func, uri="vos:OSSOS/dbimages/1616681/1616681p.fits", operation="copy",
+                             size=lambda result: len(result))
+
+        total = metrics.summary()["vos:OSSOS/dbimages/1616681/1616681p.fits"]
+        assert_that(total['transfers'], equal_to(1))
+        assert_that(total['retries'], equal_to(1))
+        assert_that(total['bytes'], equal_to(4))
+        assert_that(total['failures'], equal_to(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from concurrent import futures
+
+from hamcrest import assert_that, equal_to, contains_inanyorder
+from mock import patch
+
+from ossos.pipeline import scheduler
+
+TRIPLET = [1616681, 1616682, 1616683]
+
+
+class BuildGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = scheduler.build_graph([TRIPLET], [22])
+        self.by_name = dict((repr(node), node) for node in self.nodes)
+
+    def test_one_node_per_exposure_or_triplet(self):
+        # mk_mopheader, mkpsf, step1 per exposure, step2, step3, combine for the triplet.
+        assert_that(len(self.nodes), equal_to(3 * 3 + 2 + 3))
+
+    def test_triplet_stage_waits_for_each_exposure(self):
+        step2 = self.by_name['step21616681p22']
+        assert_that([repr(node) for node in step2.depends_on],
+                    contains_inanyorder('step11616681p22', 'step11616682p22', 'step11616683p22'))
+
+    def test_unscheduled_dependency_ignored(self):
+        assert_that(len(self.by_name['mk_mopheader1616681p22'].depends_on), equal_to(0))
+
+    def test_scrambled_images_wait_for_scramble(self):
+        nodes = scheduler.build_graph([TRIPLET], [22], stages=['scramble', 'mkpsf'], version='s')
+        by_name = dict((repr(node), node) for node in nodes)
+        assert_that([repr(node) for node in by_name['mkpsf1616682s22'].depends_on],
+                    equal_to(['scramble1616681p22']))
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = scheduler.build_graph([TRIPLET], [22], stages=['mkpsf', 'step1', 'step2'])
+        self.run = []
+
+    def execute(self, stage_name, expnums, ccd, version, prefix, dry_run, force, options, workdir):
+        self.run.append("{}{}".format(stage_name, expnums[0]))
+        return not (stage_name == 'step1' and expnums[0] == 1616682)
+
+    @patch("ossos.pipeline.scheduler.futures.ProcessPoolExecutor", futures.ThreadPoolExecutor)
+    @patch("ossos.pipeline.scheduler.storage.prefetch_tags")
+    @patch("ossos.pipeline.scheduler.storage.get_status")
+    def test_resume_and_block_on_failure(self, get_status, prefetch_tags):
+        get_status.side_effect = lambda task, prefix, expnum, version, ccd: task == 'mkpsf' and expnum == 1616681
+        with patch("ossos.pipeline.scheduler._execute", self.execute):
+            summary = scheduler.schedule(self.nodes, jobs=2)
+
+        assert_that(self.run, contains_inanyorder('mkpsf1616682', 'mkpsf1616683',
+                                                  'step11616681', 'step11616682', 'step11616683'))
+        assert_that(summary, equal_to({scheduler.DONE: 1,
+                                       scheduler.SUCCEEDED: 4,
+                                       scheduler.FAILED: 1,
+                                       scheduler.BLOCKED: 1}))
+
+
+if __name__ == '__main__':
+    unittest.main()
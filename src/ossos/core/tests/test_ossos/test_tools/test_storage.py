@@ -3,9 +3,10 @@ from astropy.io import fits
 
 __author__ = "David Rusk <drusk@uvic.ca>"
 
+import os
 import unittest
 from astropy import units
-from mock import patch
+from mock import Mock, patch
 #from hamcrest import assert_that, equal_to
 from astropy import table
 
@@ -107,5 +108,268 @@ class ObjectCountTest(unittest.TestCase):
                                              ossos_base=True)
 
 
+class GetImagesTest(unittest.TestCase):
+
+    @patch("ossos.storage.get_image")
+    def test_get_images_returns_each_ccd(self, get_image):
+        get_image.side_effect = lambda expnum, ccd, **kwargs: "{}p{:02d}.fits".format(expnum, ccd)
+
+        filenames = storage.get_images(1616681, [0, 1, 2], jobs=2)
+
+        self.assertEqual(filenames, {0: "1616681p00.fits", 1: "1616681p01.fits", 2: "1616681p02.fits"})
+
+    @patch("ossos.storage.get_image")
+    def test_iter_images_gives_up_without_retrying(self, get_image):
+        def fetch(expnum, ccd, **kwargs):
+            if ccd == 1:
+                raise IOError("VOSpace unavailable")
+            return "{}p{:02d}.fits".format(expnum, ccd)
+        get_image.side_effect = fetch
+
+        result = list(storage.iter_images(1616681, [0, 1, 2], jobs=2))
+
+        self.assertEqual(result, [(0, "1616681p00.fits"), (1, None), (2, "1616681p02.fits")])
+        # the transfers are retried by storage.copy, not again for each image.
+        self.assertEqual(get_image.call_count, 3)
+
+    @patch("ossos.retry.time.sleep")
+    @patch("ossos.storage.client")
+    def test_get_image_transfer_retried_once_per_layer(self, client, sleep):
+        client.copy.side_effect = IOError("VOSpace unavailable")
+
+        with self.assertRaises(IOError):
+            storage.get_image(1616681, ccd=22, version='p')
+
+        self.assertEqual(client.copy.call_count, storage.copy_policy.max_attempts)
+
+
+class StreamHDUListTest(unittest.TestCase):
+
+    @patch("ossos.storage.client")
+    def test_stream_hdulist_memory_maps_data(self, client):
+        import io
+        import numpy
+        data = numpy.arange(40 * 20, dtype='uint16').reshape(40, 20)
+        buffer = io.BytesIO()
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data)]).writeto(buffer)
+        buffer.seek(0)
+        client.open.return_value = buffer
+
+        hdulist = storage.stream_hdulist("vos:OSSOS/dbimages/1616681/1616681p.fits", view='cutout', cutout='[1]')
+
+        self.assertEqual(len(hdulist), 2)
+        self.assertTrue(hdulist[1]._file.memmap)
+        self.assertTrue(numpy.array_equal(hdulist[1].data, data))
+
+    @patch("ossos.storage.client")
+    def test_local_file_not_used_for_cutout(self, client):
+        import io
+        import shutil
+        import tempfile
+        import numpy
+        directory = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            fits.HDUList([fits.PrimaryHDU(numpy.zeros((100, 100), dtype='uint16'))]).writeto('1616681p.fits')
+            buffer = io.BytesIO()
+            fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(numpy.ones((10, 10), dtype='uint16'))]).writeto(buffer)
+            buffer.seek(0)
+            client.open.return_value = buffer
+
+            hdulist = storage.stream_hdulist("vos:OSSOS/dbimages/1616681/1616681p.fits",
+                                             view='cutout', cutout='[1][1:10,1:10]')
+            self.assertEqual(hdulist[1].data.shape, (10, 10))
+
+            hdulist = storage.stream_hdulist("vos:OSSOS/dbimages/1616681/1616681p.fits")
+            self.assertEqual(hdulist[0].data.shape, (100, 100))
+            self.assertEqual(client.open.call_count, 1)
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+
+
+class TileCutoutTest(unittest.TestCase):
+
+    def setUp(self):
+        import numpy
+        header = fits.Header()
+        for keyword, value in (('CTYPE1', 'RA---TAN'), ('CTYPE2', 'DEC--TAN'),
+                               ('CRPIX1', 50.0), ('CRPIX2', 50.0), ('CRVAL1', 10.0), ('CRVAL2', 5.0),
+                               ('CD1_1', -5.0e-5), ('CD1_2', 0.0), ('CD2_1', 0.0), ('CD2_2', 5.0e-5),
+                               ('XOFFSET', 1000), ('YOFFSET', 2000), ('EXTNO', 3), ('DATASEC', '[1:100,1:100]')):
+            header[keyword] = value
+        data = numpy.arange(100 * 100, dtype='float32').reshape(100, 100)
+        self.tile = fits.ImageHDU(data=data, header=header)
+        self.centre = SkyCoord(10.0 * units.degree, 5.0 * units.degree)
+
+    def test_cutout_from_tile(self):
+        storage._mark_tile_edges(self.tile.header, self.centre, 8 * units.arcsec)
+        hdu = storage._cutout_from_tile(self.tile, self.centre, 3 * units.arcsec)
+
+        self.assertEqual(hdu.data.shape, (33, 33))
+        self.assertEqual(hdu.header['XOFFSET'], 1033)
+        self.assertEqual(hdu.header['YOFFSET'], 2033)
+        self.assertEqual(hdu.header['DATASEC'], '[1:33,1:33]')
+        self.assertEqual(hdu.data[0, 0], self.tile.data[33, 33])
+        x, y = hdu.wcs.sky2xy(10.0, 5.0)
+        self.assertAlmostEqual(x, 17.0, 6)
+        self.assertAlmostEqual(y, 17.0, 6)
+        self.assertNotIn('TILEEDGE', hdu.header)
+
+    def test_cutout_outside_tile_not_served(self):
+        storage._mark_tile_edges(self.tile.header, self.centre, 8 * units.arcsec)
+        self.assertIsNone(storage._cutout_from_tile(self.tile, self.centre, 20 * units.arcsec))
+
+
+class TagBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        storage.tags.clear()
+        self.props = {}
+        self.node = Mock(props=self.props)
+
+    def tearDown(self):
+        storage.tags.clear()
+
+    @patch("ossos.storage.client")
+    def test_batch_writes_once_per_exposure(self, client):
+        client.get_node.return_value = self.node
+        with storage.TagBatch():
+            for ccd in range(3):
+                storage.set_status('step1', '', 1616681, 'p', ccd, storage.SUCCESS)
+            self.assertTrue(storage.get_status('step1', '', 1616681, 'p', 2))
+            self.assertEqual(client.add_props.call_count, 0)
+
+        self.assertEqual(client.add_props.call_count, 1)
+        self.assertEqual(self.props[storage.tag_uri('step1_p02')], storage.SUCCESS)
+
+    @patch("ossos.storage.client")
+    def test_prefetched_tags_answer_get_status(self, client):
+        self.props[storage.tag_uri('mkpsf_p00')] = storage.SUCCESS
+        client.get_node.return_value = self.node
+        storage.prefetch_tags([1616681, 1616682])
+        self.assertEqual(client.get_node.call_count, 2)
+
+        self.assertTrue(storage.get_status('mkpsf', '', 1616681, 'p', 0))
+        self.assertEqual(client.get_node.call_count, 2)
+        # a missing tag is always looked for in VOSpace.
+        self.assertFalse(storage.get_status('step1', '', 1616682, 'p', 0))
+        self.assertEqual(client.get_node.call_count, 3)
+
+    @patch("ossos.storage.client")
+    def test_tag_set_after_prefetch_is_seen(self, client):
+        client.get_node.side_effect = lambda uri, force=False: Mock(props=dict(self.props))
+        storage.prefetch_tags([1616681])
+        self.assertFalse(storage.get_status('mkpsf', '', 1616681, 'p', 0))
+
+        # another worker records the dependency as run.
+        self.props[storage.tag_uri('mkpsf_p00')] = storage.SUCCESS
+        self.assertTrue(storage.get_status('mkpsf', '', 1616681, 'p', 0))
+
+
+class ListDBImagesTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from ossos.cache import PersistentCache
+        self.directory = tempfile.mkdtemp()
+        self.cache = PersistentCache(directory=self.directory)
+        storage.dbimages_index.clear()
+        self.date = '2026-01-01T00:00:00.000'
+
+    def tearDown(self):
+        import shutil
+        storage.dbimages_index.clear()
+        shutil.rmtree(self.directory)
+
+    @patch("ossos.storage.listdir")
+    @patch("ossos.storage.get_node_date")
+    def test_listing_reused(self, get_node_date, listdir):
+        get_node_date.side_effect = lambda uri: self.date
+        listdir.return_value = ['1616681', '1616682']
+        with patch("ossos.storage.header_cache", self.cache):
+            names = storage.list_dbimages('vos:OSSOS/dbimages')
+            self.assertEqual(names, frozenset(['1616681', '1616682']))
+            storage.list_dbimages('vos:OSSOS/dbimages')
+            self.assertEqual(listdir.call_count, 1)
+
+            # a new process finds the listing in the persistent cache.
+            storage.dbimages_index.clear()
+            self.assertIn('1616682', storage.list_dbimages('vos:OSSOS/dbimages'))
+            self.assertEqual(listdir.call_count, 1)
+
+    @patch("ossos.storage.listdir")
+    @patch("ossos.storage.get_node_date")
+    def test_stale_listing_revalidated(self, get_node_date, listdir):
+        get_node_date.side_effect = lambda uri: self.date
+        listdir.return_value = ['1616681']
+        with patch("ossos.storage.header_cache", self.cache), patch("ossos.storage.config.read") as read:
+            read.return_value = 0
+            storage.list_dbimages('vos:OSSOS/dbimages')
+            # unchanged container, not listed again.
+            storage.list_dbimages('vos:OSSOS/dbimages')
+            self.assertEqual(listdir.call_count, 1)
+
+            self.date = '2026-01-02T00:00:00.000'
+            listdir.return_value = ['1616681', '1616682']
+            self.assertIn('1616682', storage.list_dbimages('vos:OSSOS/dbimages'))
+            self.assertEqual(listdir.call_count, 2)
+
+    @patch("ossos.storage.client")
+    @patch("ossos.storage.mkdir")
+    @patch("ossos.storage.listdir")
+    @patch("ossos.storage.get_node_date")
+    def test_populate_drops_listing(self, get_node_date, listdir, mkdir, client):
+        get_node_date.side_effect = lambda uri: self.date
+        listdir.return_value = ['1616681']
+        with patch("ossos.storage.header_cache", self.cache):
+            self.assertNotIn('1616682', storage.list_dbimages(storage.DBIMAGES))
+
+            # the container's date is unchanged, yet the new exposure is listed.
+            storage.populate('1616682')
+            listdir.return_value = ['1616681', '1616682']
+            self.assertIn('1616682', storage.list_dbimages(storage.DBIMAGES))
+            self.assertEqual(listdir.call_count, 2)
+
+
+class HeaderCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        from ossos.cache import PersistentCache
+        self.directory = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.cache = PersistentCache(directory=self.directory)
+        storage.mopheaders.clear()
+        self.uri = storage.dbimages_uri(1616681, ccd=22, version='p', ext='.mopheader')
+
+    def tearDown(self):
+        import shutil
+        os.chdir(self.cwd)
+        storage.mopheaders.clear()
+        shutil.rmtree(self.directory)
+
+    @patch("ossos.storage.get_fwhm")
+    @patch("ossos.storage.get_node_date")
+    def test_local_mopheader_not_shadowed_by_cache(self, get_node_date, get_fwhm):
+        get_fwhm.return_value = 3.0
+        stale = fits.Header()
+        stale['PIXSCALE'] = 0.1
+        self.cache.put(self.uri, stale, mtime='2026-01-01T00:00:00.000')
+        header = fits.Header()
+        header['PIXSCALE'] = 0.185
+        header['MOP_VER'] = 1.2
+        header['MJD-OBSC'] = 56000.5
+        fits.PrimaryHDU(header=header).writeto(os.path.basename(self.uri))
+
+        with patch("ossos.storage.header_cache", self.cache):
+            mopheader = storage.get_mopheader(1616681, 22)
+
+        self.assertEqual(mopheader['PIXSCALE'], 0.185)
+        get_node_date.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+from copy import deepcopy
+
+import mp_ephem
+import numpy
+from astropy import units
+from hamcrest import assert_that, equal_to, close_to
+from mock import Mock, patch
+
+from ossos.pipeline import update_astrometry
+
+LINES = {
+    'L3XO.mpc': ["     L3XO     C2013 09 29.38812 00 48 17.721+03 06 57.86         24.44r      568"
+                 " O 1656895p20 L3XO Y 299.3 4304.7 0.20 0 24.44 0.16 % ",
+                 "     L3XO     C2013 09 29.43193 00 48 17.524+03 06 56.57         24.70r      568"
+                 " O 1656906p20 L3XO Y 311.2 4298.9 0.20 0 24.70 0.23 % "],
+    'L3XP.mpc': ["     L3XP     C2013 09 29.38812 00 48 10.000+03 06 50.00         24.10r      568"
+                 " O 1656895p20 L3XP Y 1020.0 2100.0 0.20 0 24.10 0.10 % "],
+}
+
+
+class RunBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.mpc_files = []
+        for name in sorted(LINES):
+            filename = os.path.join(self.directory, name)
+            with open(filename, 'w') as fobj:
+                fobj.write("\n".join(LINES[name]) + "\n")
+            self.mpc_files.append(filename)
+        self.frames = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def remeasure_frame(self, key, observations, skip_mags=False, skip_centroids=False):
+        self.frames.append((key, len(observations)))
+        result = []
+        for mpc_in in observations:
+            mpc_obs = deepcopy(mpc_in)
+            mpc_obs.comment.x = float(mpc_obs.comment.x) + 1
+            result.append(mpc_obs)
+        return result
+
+    def test_one_remeasure_per_frame(self):
+        with patch("ossos.pipeline.update_astrometry.remeasure_frame", self.remeasure_frame):
+            update_astrometry.run_batch(self.mpc_files, result_dir=self.directory, jobs=1)
+
+        assert_that(self.frames, equal_to([((1656895, 'p', 20), 2), ((1656906, 'p', 20), 1)]))
+        for mpc_file in self.mpc_files:
+            tlf = os.path.splitext(mpc_file)[0] + ".tlf"
+            observations = mp_ephem.EphemerisReader().read(tlf)
+            assert_that(len(observations), equal_to(len(LINES[os.path.basename(mpc_file)])))
+            for mpc_obs, line in zip(observations, LINES[os.path.basename(mpc_file)]):
+                assert_that(float(mpc_obs.comment.x), close_to(float(line.split()[-7]) + 1, 1e-6))
+
+
+class RemeasureAllTest(unittest.TestCase):
+
+    def setUp(self):
+        filename = tempfile.NamedTemporaryFile(suffix='.mpc', mode='w', delete=False)
+        filename.write(LINES['L3XO.mpc'][0] + "\n" + LINES['L3XP.mpc'][0] + "\n")
+        filename.close()
+        self.observations = mp_ephem.EphemerisReader().read(filename.name)
+        os.unlink(filename.name)
+
+    def test_one_wcs_call_per_frame(self):
+        ra = numpy.array([obs.coordinate.ra.degree for obs in self.observations]) * units.degree
+        dec = numpy.array([obs.coordinate.dec.degree for obs in self.observations]) * units.degree
+        frame = Mock()
+        frame.header = {'PIXSCAL1': 0.185, 'ASTERR': 0.1, 'ASTLEVEL': 3, 'NAXIS1': 2112, 'NAXIS2': 4644}
+        frame.fwhm = 4.0
+        frame.wcs.xy2sky.return_value = (ra, dec)
+
+        result = update_astrometry._remeasure_all(self.observations, frame)
+
+        assert_that(frame.wcs.xy2sky.call_count, equal_to(1))
+        assert_that(list(frame.wcs.xy2sky.call_args[0][0]), equal_to([299.3, 1020.0]))
+        for mpc_in, mpc_obs in zip(self.observations, result):
+            assert_that(mpc_obs.coordinate.separation(mpc_in.coordinate).to('arcsec').value, close_to(0, 1e-3))
+            assert_that(mpc_obs.comment.plate_uncertainty,
+                        close_to((0.1 ** 2 + (float(mpc_in.comment.mag_uncertainty) * 4.0 * 0.185) ** 2) ** 0.5,
+                                 1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
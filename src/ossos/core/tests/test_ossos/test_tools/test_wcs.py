@@ -101,6 +101,108 @@ class WCSTest(unittest.TestCase):
         assert_that(x, almost_equal(15000.066582252624, SIGFIGS))
         assert_that(y, almost_equal(19999.992539886229, SIGFIGS))
 
+    def test_sky2xy_array_matches_scalar(self):
+        import numpy
+        crpix1 = -7535.57493517
+        crpix2 = 9808.40914361
+        crval1 = 176.486157083
+        crval2 = 8.03697351091
+        dc = [[19550.08417778, 269.58539826],
+              [-48.85428173, -19520.05812122]]
+        pv = [[-7.030338745606E-03, 1.01755337222, 8.262429361142E-03,
+               0.00000000000, -5.910145454849E-04, -7.494178330178E-04,
+               -3.470178516657E-04, -2.331150605755E-02, -8.187062772669E-06,
+               -2.325429510806E-02, 1.135299506292E-04],
+              [-6.146513090656E-03, 1.01552885426, 8.259666421752E-03,
+               0.00000000000, -4.567030382243E-04, -6.978676921999E-04,
+               -3.732572951216E-04, -2.332572754467E-02, -2.354317291723E-05,
+               -2.329623852891E-02, 1.196394469003E-04]]
+        nord = 3
+        ra = numpy.array([177.62042274595882, 177.5, 177.7])
+        dec = numpy.array([7.5256071336988679, 7.4, 7.6])
+
+        x, y = wcs.sky2xypv_array(ra, dec, crpix1, crpix2, crval1, crval2, dc, pv, nord)
+
+        assert_that(x, has_length(3))
+        for idx in range(len(ra)):
+            xs, ys = wcs.sky2xypv(ra[idx], dec[idx], crpix1, crpix2, crval1, crval2, dc, pv, nord)
+            assert_that(x[idx], almost_equal(xs, 8))
+            assert_that(y[idx], almost_equal(ys, 8))
+
+    def test_xy2sky_array_round_trip(self):
+        import numpy
+        crpix1 = -7535.57493517
+        crpix2 = 9808.40914361
+        crval1 = 176.486157083
+        crval2 = 8.03697351091
+        cd = [[5.115244026718E-05, 7.064503033578E-07],
+              [-1.280229655229E-07, -5.123112374523E-05]]
+        pv = [[-7.030338745606E-03, 1.01755337222, 8.262429361142E-03,
+               0.00000000000, -5.910145454849E-04, -7.494178330178E-04,
+               -3.470178516657E-04, -2.331150605755E-02, -8.187062772669E-06,
+               -2.325429510806E-02, 1.135299506292E-04],
+              [-6.146513090656E-03, 1.01552885426, 8.259666421752E-03,
+               0.00000000000, -4.567030382243E-04, -6.978676921999E-04,
+               -3.732572951216E-04, -2.332572754467E-02, -2.354317291723E-05,
+               -2.329623852891E-02, 1.196394469003E-04]]
+        nord = 3
+        x = numpy.array([15000.0, 14000.0, 16000.0])
+        y = numpy.array([20000.0, 21000.0, 19500.0])
+
+        ra, dec = wcs.xy2skypv_array(x, y, crpix1, crpix2, crval1, crval2, cd, pv, nord)
+        x2, y2 = wcs.sky2xypv_array(ra.to('deg').value, dec.to('deg').value,
+                                    crpix1, crpix2, crval1, crval2,
+                                    numpy.linalg.inv(cd), pv, nord)
+
+        assert_that(ra.to('deg').value[0], almost_equal(177.62041959006154, SIGFIGS))
+        for idx in range(len(x)):
+            assert_that(x2[idx], almost_equal(x[idx], 8))
+            assert_that(y2[idx], almost_equal(y[idx], 8))
+
+
+    crpix1 = -7535.57493517
+    crpix2 = 9808.40914361
+    crval1 = 176.486157083
+    crval2 = 8.03697351091
+    cd = [[5.115244026718E-05, 7.064503033578E-07],
+          [-1.280229655229E-07, -5.123112374523E-05]]
+
+    def test_nord_negative_scalar_matches_array(self):
+        import numpy
+        x = numpy.array([15000.0, 14000.0])
+        y = numpy.array([20000.0, 21000.0])
+
+        # with no PV the pixels are projected by the CD matrix alone, the scalar version took them as degrees.
+        ra, dec = wcs.xy2skypv_array(x, y, self.crpix1, self.crpix2, self.crval1, self.crval2, self.cd, None, -1)
+        for idx in range(len(x)):
+            ras, decs = wcs.xy2skypv(x[idx], y[idx], self.crpix1, self.crpix2, self.crval1, self.crval2,
+                                     self.cd, None, -1)
+            assert_that(ras.to('deg').value, almost_equal(ra.to('deg').value[idx], SIGFIGS))
+            assert_that(decs.to('deg').value, almost_equal(dec.to('deg').value[idx], SIGFIGS))
+            xs, ys = wcs.sky2xypv(ras.to('deg').value, decs.to('deg').value, self.crpix1, self.crpix2,
+                                  self.crval1, self.crval2, numpy.linalg.inv(self.cd), None, -1)
+            assert_that(xs, almost_equal(x[idx], 8))
+            assert_that(ys, almost_equal(y[idx], 8))
+
+    def test_eta_cubic_jacobian_scalar_matches_array(self):
+        import numpy
+        # the scalar Jacobian of eta used PV1_8 where PV2_8 belongs, so make them differ a lot.
+        pv = [[0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+              [0.0, 1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.5, 0.0, 0.0]]
+        x = numpy.array([15000.0, 14000.0])
+        y = numpy.array([20000.0, 21000.0])
+
+        ra, dec = wcs.xy2skypv_array(x, y, self.crpix1, self.crpix2, self.crval1, self.crval2, self.cd, pv, 3)
+        xa, ya = wcs.sky2xypv_array(ra.to('deg').value, dec.to('deg').value, self.crpix1, self.crpix2,
+                                    self.crval1, self.crval2, numpy.linalg.inv(self.cd), pv, 3, maxiter=5)
+        for idx in range(len(x)):
+            xs, ys = wcs.sky2xypv(ra.to('deg').value[idx], dec.to('deg').value[idx], self.crpix1, self.crpix2,
+                                  self.crval1, self.crval2, numpy.linalg.inv(self.cd), pv, 3, maxiter=5)
+            assert_that(xs, almost_equal(x[idx], 8))
+            assert_that(ys, almost_equal(y[idx], 8))
+            assert_that(xa[idx], almost_equal(xs, 8))
+            assert_that(ya[idx], almost_equal(ys, 8))
+
 
 class WCSParseTest(FileReadingTestCase):
     def setUp(self):
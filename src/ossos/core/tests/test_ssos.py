@@ -1,8 +1,12 @@
 
 
 __author__ = 'jjk'
+import unittest
 from unittest import TestCase
-from ossos import mpc
+from mock import patch
+from ossos import mpc, ssos
+from astropy import units
+from astropy.coordinates import SkyCoord
 from astropy.time import Time
 
 
@@ -62,6 +66,68 @@ class MPCParserTest(TestCase):
         print(ssos_data.get_reading_count())
 
 
+class FakeOrbit(object):
+    """An orbit moving 1 arcsec/day in RA, that counts its predictions."""
+
+    def __init__(self, observations):
+        self.dates = []
+
+    def predict(self, date):
+        self.dates.append(date.mjd)
+        self.coordinate = SkyCoord((10.0 + (date.mjd - 56000) / 3600.0) * units.degree, 5.0 * units.degree)
+        self.pa = 30.0 * units.degree
+        self.dra = 2.0 * units.arcsec
+        self.ddec = (date.mjd > 56100 and 3000.0 or 1.0) * units.arcsec
+
+
+class SSOSParserTest(TestCase):
+
+    HEADER = "Image\tExt\tX\tY\tMJD\tFilter\tExptime\tObject_RA\tObject_Dec\tImage_target"
+
+    def setUp(self):
+        self.lines = [self.HEADER,
+                      "1616681p\t23\t100.0\t200.0\t56010.0\tR.MP9601\t287\t10.1\t5.0\tO13AE",
+                      "1616681p\t24\t100.0\t200.0\t56010.0\tR.MP9601\t287\t10.1\t5.0\tO13AE",
+                      "1616682p\t23\t110.0\t200.0\t56010.0\tR.MP9601\t287\t10.1\t5.0\tO13AE",
+                      "1616683p\t23\t120.0\t200.0\t56020.0\tR.MP9601\t287\t10.1\t5.0\tWP_TEST",
+                      "1616684p\t23\t130.0\t200.0\t56030.0\tg.MP9401\t287\t10.1\t5.0\tO13AE",
+                      "1616685p\t23\t140.0\t200.0\t56040.0\tR.MP9601\t287\t10.1\t5.0\tO13AE",
+                      "1616686p\t23\t150.0\t200.0\t56200.0\tR.MP9601\t287\t10.1\t5.0\tO13AE"]
+        mpc_line = "     HL7j2    C2013 04 03.62926 17 12 01.16 +04 13 33.3          24.1 R      568"
+        self.observations = [mpc.Observation.from_string(mpc_line)]
+        self.orbit = FakeOrbit(self.observations)
+
+    @patch("ossos.ssos.storage.list_dbimages")
+    def test_parse(self, list_dbimages):
+        list_dbimages.return_value = ['1616681', '1616682', '1616683', '1616684', '1616686']
+        with patch("ossos.ssos.Orbfit", return_value=self.orbit):
+            data = ssos.SSOSParser('HL7j2').parse(self.lines, mpc_observations=self.observations)
+
+        # WP targets, other filters, exposures not in dbimages and large uncertainties are dropped,
+        # as are repeated rows of an exposure.
+        self.assertEqual([observation.expnum for observation in data.observations], ['1616681', '1616682'])
+        self.assertEqual(data.observations[0].ccdnum, '22')
+        # each epoch is predicted once.
+        self.assertEqual(sorted(self.orbit.dates), [56010.0, 56200.0])
+        reading = data.get_sources()[0].get_reading(0)
+        self.assertAlmostEqual(reading.ra, 10.0 + 10 / 3600.0, 9)
+        self.assertAlmostEqual(reading.uncertainty_ellipse.pa.to(units.degree).value, 30.0)
+
+    @patch("ossos.ssos.storage.list_dbimages")
+    def test_row_on_a_ccd_preferred(self, list_dbimages):
+        list_dbimages.return_value = ['1616681', '1616682']
+        lines = [self.HEADER,
+                 "1616681p\t0\t100.0\t200.0\t56010.0\tR.MP9601\t287\t10.1\t5.0\tO13AE",
+                 "1616681p\t23\t100.0\t200.0\t56010.0\tR.MP9601\t287\t10.1\t5.0\tO13AE",
+                 "1616682p\t0\t110.0\t200.0\t56010.0\tR.MP9601\t287\t10.1\t5.0\tO13AE"]
+        with patch("ossos.ssos.Orbfit", return_value=self.orbit):
+            data = ssos.SSOSParser('HL7j2').parse(lines, mpc_observations=self.observations)
+
+        self.assertEqual([observation.expnum for observation in data.observations], ['1616681', '1616682'])
+        self.assertEqual(data.observations[0].ccdnum, '22')
+        # an exposure SSOIS could not place on a CCD is still examined.
+        self.assertEqual(data.observations[1].ccdnum, None)
+
 
 if __name__ == '__main__':
     unittest.main()
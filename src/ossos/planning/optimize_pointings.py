@@ -24,6 +24,14 @@ cfht.date = '2021/09/01 10:00:00'
 sun = ephem.Sun()
 fb = ephem.FixedBody()
 
+# step (degrees) of the grid of pointing offsets searched by optimize and the number of offsets tested at once.
+GRID_STEP = 1 / 60.0
+GRID_CHUNK = 1024
+
+
+# sun rise and set times at CFHT, keyed by the iso date they were computed for, see is_up.
+sun_times = {}
+
 
 def is_up(coordinate, current_time):
     """
@@ -34,10 +42,12 @@ def is_up(coordinate, current_time):
     @return: True/False
     """
     cfht.date = current_time.iso.replace('-', '/')
-    cfht.horizon = math.radians(-7)
-    sun.compute(cfht)
-    sun_rise = Time(str(sun.rise_time).replace('/', '-'))
-    sun_set = Time(str(sun.set_time).replace('/', '-'))
+    if current_time.iso not in sun_times:
+        cfht.horizon = math.radians(-7)
+        sun.compute(cfht)
+        sun_times[current_time.iso] = (Time(str(sun.rise_time).replace('/', '-')),
+                                       Time(str(sun.set_time).replace('/', '-')))
+    sun_rise, sun_set = sun_times[current_time.iso]
 
     if current_time < sun_set or current_time > sun_rise:
         return False
@@ -55,7 +65,52 @@ def is_up(coordinate, current_time):
     return True
 
 
-def create_ephemeris_file(name, camera, kbos, orbits, pointing_date, runid, ephem_format="CFHT API"):
+class EphemerisCache(object):
+    """
+    The locations of the orbits on the time grid shared by all the pointings of a run.
+
+    Each orbit is predicted once per time, the first time it is asked for, and the values kept as
+    the floats the orbit returned so that sums over them are the same as summing the predictions directly.
+    """
+
+    def __init__(self, orbits, pointing_date):
+        """
+        @param orbits: dictionary of orbits, by name.
+        @param pointing_date: the date of the pointings.
+        """
+        self.orbits = orbits
+        self.pointing_date = mpc.Time(pointing_date)
+        start_date = self.pointing_date - TimeDelta(0.1 * units.hour)
+        end_date = start_date + TimeDelta(2 * units.hour)
+        time_step = TimeDelta(1.5 * units.hour)
+        self.times = []
+        today = start_date
+        while today < end_date:
+            today += time_step
+            self.times.append(today)
+        self._locations = {}
+
+    def __getitem__(self, name):
+        """
+        The predicted locations of an orbit.
+
+        @param name: the name of the orbit.
+        @return: (ra, dec) at pointing_date and a list of (ra, dec, r_mag) at each of times, ra/dec in radians.
+        """
+        if name not in self._locations:
+            kbo = self.orbits[name]
+            kbo.predict(self.pointing_date)
+            centre = kbo.coordinate.ra.radian, kbo.coordinate.dec.radian
+            steps = []
+            for today in self.times:
+                kbo.predict(today)
+                steps.append((kbo.coordinate.ra.radian, kbo.coordinate.dec.radian, kbo.r_mag))
+            self._locations[name] = centre, steps
+        return self._locations[name]
+
+
+def create_ephemeris_file(name, camera, kbos, orbits, pointing_date, runid, ephem_format="CFHT API",
+                          ephemeris=None):
     """
 
     @param name: name of the pointing
@@ -65,43 +120,38 @@ def create_ephemeris_file(name, camera, kbos, orbits, pointing_date, runid, ephe
     @param pointing_date: data of pointing associated with camera object
     @param runid:  The CFHT RunID that will be used to observer the target.
     @param ephem_format: What format to write the pointing list out in.
+    @param ephemeris: EphemerisCache of the orbits for pointing_date, shared between the pointings of a run.
     @return: None
     """
 
     et = EphemTarget(name, ephem_format=ephem_format, runid=runid)
+    if ephemeris is None:
+        ephemeris = EphemerisCache(orbits, pointing_date)
     # determine the mean motion of target KBOs in this field.
     field_kbos = []
     center_ra = 0
     center_dec = 0
 
-    pointing_date = mpc.Time(pointing_date)
-    start_date = pointing_date - TimeDelta(0.1 * units.hour)
-    end_date = start_date + TimeDelta(2 * units.hour)
-    time_step = TimeDelta(1.5 * units.hour)
+    pointing_date = ephemeris.pointing_date
 
     # Compute the mean position of KBOs in the field on current date.
     for kbo_name in kbos:
-        kbo = orbits[kbo_name]
-        kbo.predict(pointing_date)
-        ra = kbo.coordinate.ra
-        dec = kbo.coordinate.dec
-        field_kbos.append(kbo)
-        center_ra += ra.radian
-        center_dec += dec.radian
-
-    today = start_date
-    while today < end_date:
-        today += time_step
+        (ra, dec), steps = ephemeris[kbo_name]
+        field_kbos.append(steps)
+        center_ra += ra
+        center_dec += dec
+
+    for idx, today in enumerate(ephemeris.times):
         mean_motion = (0, 0)
         max_mag = 0.0
         if len(field_kbos) > 0:
             current_ra = 0
             current_dec = 0
-            for kbo in field_kbos:
-                kbo.predict(today)
-                max_mag = max(max_mag, kbo.r_mag)
-                current_ra += kbo.coordinate.ra.radian
-                current_dec += kbo.coordinate.dec.radian
+            for steps in field_kbos:
+                ra, dec, r_mag = steps[idx]
+                max_mag = max(max_mag, r_mag)
+                current_ra += ra
+                current_dec += dec
             mean_motion = ((current_ra - center_ra) / len(field_kbos),
                            (current_dec - center_dec) / len(field_kbos))
         ra = camera.coordinate.ra.radian + mean_motion[0]
@@ -122,6 +172,31 @@ def create_ephemeris_file(name, camera, kbos, orbits, pointing_date, runid, ephe
     return
 
 
+def _grid(q, bbox, start, stop):
+    """
+    The origins of the pointings searched around q, stepping GRID_STEP degrees, in the order they are searched.
+
+    @param q: the location of the required target.
+    @param bbox: bounding box of the camera footprint centred on q.
+    @param start: extra offset (degrees) removed from the start of the search in both directions.
+    @param stop: extra offset (degrees) removed from the end of the search in both directions.
+    @return: ra, dec arrays (degrees), ra wrapped into [0, 360).
+    """
+    dx = np.arange(q.ra.degree - bbox[0] - start, bbox[1] - q.ra.degree - stop, GRID_STEP)
+    dy = np.arange(q.dec.degree - bbox[2] - start, bbox[3] - q.dec.degree - stop, GRID_STEP)
+    dx, dy = np.meshgrid(dx, dy, indexing='ij')
+    return (q.ra.degree + dx.ravel()) % 360.0, q.dec.degree + dy.ravel()
+
+
+def _coverage(ra, dec, target_ra, target_dec, camera_name):
+    """
+    Camera.coverage of the pointings, in chunks to bound the memory used.
+    """
+    return np.concatenate([Camera.coverage(ra[start:start + GRID_CHUNK], dec[start:start + GRID_CHUNK],
+                                           target_ra, target_dec, camera=camera_name)
+                           for start in range(0, len(ra), GRID_CHUNK)] or [np.zeros((0, len(target_ra)), bool)])
+
+
 def optimize(orbits, required, locations, tokens, camera_name="DEIMOS"):
     """
 
@@ -137,10 +212,8 @@ def optimize(orbits, required, locations, tokens, camera_name="DEIMOS"):
     token_order = np.random.permutation(required)
     optimal_pointings = {}
     covered = []  # the objects that have already been covered by a planned pointing.
-    search_order = [0, ]
-    # search_order = [22 + 4]
-    # search_order.extend(range(len(Camera.names)))
- # For each required target find the pointing that will include the largest number of other required targets
+    required = np.array(required)
+    # For each required target find the pointing that will include the largest number of other required targets
     # and then tweak that specific pointing to include the maximum number of secondary targets.
     for token in token_order:
         if token in covered:
@@ -150,73 +223,48 @@ def optimize(orbits, required, locations, tokens, camera_name="DEIMOS"):
             logging.error("No orbit available for: {}".format(token))
             continue
         obj = orbits[token]
-     q = SkyCoord(obj.coordinate.ra,
+        q = SkyCoord(obj.coordinate.ra,
                      obj.coordinate.dec)
         pointing = Camera(q, camera=camera_name, name=token)
         bbox = pointing.polygon.boundingBox()
         radius = (max((bbox[1]-bbox[0])**2, (bbox[3]-bbox[2])**2)*2)**0.5
         separations = obj.coordinate.separation(locations)
         logging.info(f"Seaching within {radius} degrees of {token}")
-        possible_tokens = tokens[separations < radius * units.degree]
+        nearby = separations < radius * units.degree
+        possible_tokens = tokens[nearby]
         best_coverage = [token]
         optimal_pointing = pointing
         if len(possible_tokens) == 1:
             continue
-        for dx in np.arange((q.ra.degree-bbox[0]-1/60.0), (bbox[1] - q.ra.degree), 1/60.0):
-            for dy in np.arange((q.dec.degree-bbox[2]-1/60.0), (bbox[3] - q.dec.degree), 1/60.0):
-                p = SkyCoord(obj.coordinate.ra + dx*units.degree,
-                             obj.coordinate.dec + dy*units.degree)
-                pointing = Camera(p, camera=camera_name, name=token)
-                this_required = []
-                for this_token in required:
-                    if this_token in possible_tokens:
-                        this_required.append(this_token)
-                logging.debug(f"Field {token} near required targets {this_required}")
-                # This object is not inside the existing coverage.
-                if len(this_required) == 1:
-                    continue
-                else:
-                    logging.debug("Finding required targets within pointing")
-                    this_coverage = []
-                    for this_token in this_required:
-                        if this_token in covered:
-                            continue
-                        if pointing.polygon.isInside(orbits[this_token].coordinate.ra.degree, orbits[this_token].coordinate.dec.degree):
-                            logging.debug(f"Adding {this_token} to pointing {token}")
-                            this_coverage.append(this_token)
-                    if len(this_coverage) > len(best_coverage):
-                        logging.info(f"Best {token} pointing is {pointing.coordinate} with {len(this_coverage)} targets.")
-                        best_coverage = this_coverage
-                        optimal_pointing = pointing
-
-        optimal_coverage = []
-
-        for dx in np.arange((q.ra.degree - bbox[0] - 2 / 60.0), (bbox[1] - q.ra.degree - 1/60.0), 1 / 60.0):
-            for dy in np.arange((q.dec.degree - bbox[2] - 2 / 60.0), (bbox[3] - q.dec.degree - 1/60.0), 1 / 60.0):
-                p = SkyCoord(obj.coordinate.ra + dx * units.degree,
-                             obj.coordinate.dec + dy * units.degree)
-                pointing = Camera(p, camera=camera_name, name=token)
-                # Skip offset if we loose required object.
-                exclude = False
-                for this_token in best_coverage:
-                    if not pointing.polygon.isInside(orbits[this_token].coordinate.ra.degree, orbits[this_token].coordinate.dec.degree):
-                        exclude = True
-                        break
-                if exclude:
-                    continue
-
-                this_coverage = []
-
-                for this_token in possible_tokens:
-                    if this_token in covered:
-                        continue
-                    if pointing.polygon.isInside(orbits[this_token].coordinate.ra.degree, orbits[this_token].coordinate.dec.degree):
-                        this_coverage.append(this_token)
-
-                if len(this_coverage) > len(optimal_coverage):
-                    print(pointing.polygon.isInside(orbits[token].coordinate.ra.degree, orbits[token].coordinate.dec.degree))
-                    optimal_coverage = this_coverage
-                    optimal_pointing = pointing
+        possible_ra = locations.ra.degree[nearby]
+        possible_dec = locations.dec.degree[nearby]
+        not_covered = ~np.isin(possible_tokens, covered)
+
+        # The first pointing that covers the largest number of required targets.
+        this_required = np.isin(possible_tokens, required)
+        logging.debug(f"Field {token} near required targets {possible_tokens[this_required]}")
+        if this_required.sum() > 1:
+            ra, dec = _grid(q, bbox, 1 / 60.0, 0)
+            inside = _coverage(ra, dec, possible_ra, possible_dec, camera_name) & this_required & not_covered
+            counts = inside.sum(axis=1)
+            if len(counts) > 0 and counts.max() > len(best_coverage):
+                best = counts.argmax()
+                best_coverage = list(possible_tokens[inside[best]])
+                optimal_pointing = Camera(SkyCoord(ra[best] * units.degree, dec[best] * units.degree),
+                                          camera=camera_name, name=token)
+                logging.info(f"Best {token} pointing is {optimal_pointing.coordinate} "
+                             f"with {len(best_coverage)} targets.")
+
+        # Then shift that pointing to cover the most targets while keeping all of those.
+        ra, dec = _grid(q, bbox, 2 / 60.0, 1 / 60.0)
+        inside = _coverage(ra, dec, possible_ra, possible_dec, camera_name)
+        keeps_best = inside[:, np.isin(possible_tokens, best_coverage)].all(axis=1)
+        counts = np.where(keeps_best, (inside & not_covered).sum(axis=1), 0)
+        if len(counts) > 0 and counts.max() > 0:
+            best = counts.argmax()
+            optimal_pointing = Camera(SkyCoord(ra[best] * units.degree, dec[best] * units.degree),
+                                      camera=camera_name, name=token)
+            logging.debug(f"Optimal {token} pointing is {optimal_pointing.coordinate} with {counts[best]} targets.")
 
         # remove all sources covered by optimal_pointing from further consideration.
         unique_coverage_list = []
@@ -308,6 +356,7 @@ def main():
             minimum_number_of_pointings = len(pointings)
             best_pointing_list = deepcopy(pointings)
 
+    ephemeris = EphemerisCache(orbits, pointing_date)
     with open(pointings_filename, 'w') as pobj:
         pobj.write("index {}\n".format(pointing_date))
         pointing_number = 0
@@ -319,7 +368,8 @@ def main():
                                                    len(best_pointing_list[token][1])))
             pointing_number += 1
             create_ephemeris_file(token, best_pointing_list[token][0], best_pointing_list[token][1], orbits,
-                                  pointing_date, args.runid, ephem_format=args.ephem_format.replace("_", " "))
+                                  pointing_date, args.runid, ephem_format=args.ephem_format.replace("_", " "),
+                                  ephemeris=ephemeris)
 
 
 if __name__ == '__main__':
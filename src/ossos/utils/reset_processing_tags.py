@@ -41,15 +41,17 @@ def clear_tags(expnum, ops_set, my_ccds, dry_run=True):
     """
 
     status = None
-    for ops in ops_set:
-      for prefix in ops[0]:
-        for task in ops[1]:
-          for version in ops[2]:
-            for ccd in my_ccds:
-                if not dry_run:
-                    storage.set_status(task, prefix, expnum, version, ccd, status)
-                else:
-                    sys.stdout.write("{} {} {} {} {} {}\n".format(task, prefix, expnum, version, ccd, status))
+    # all the tags of the exposure are cleared in a single update of the dbimages node.
+    with storage.TagBatch():
+      for ops in ops_set:
+        for prefix in ops[0]:
+          for task in ops[1]:
+            for version in ops[2]:
+              for ccd in my_ccds:
+                  if not dry_run:
+                      storage.set_status(task, prefix, expnum, version, ccd, status)
+                  else:
+                      sys.stdout.write("{} {} {} {} {} {}\n".format(task, prefix, expnum, version, ccd, status))
 
 
 if __name__ == '__main__':
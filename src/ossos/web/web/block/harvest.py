@@ -0,0 +1,127 @@
+"""
+Harvest the processing and blinking status of the images in a block from the VOSpace tags into ossuary,
+so the web pages can aggregate the status with SQL rather than asking VOSpace about every image.
+
+Run in the background, eg.
+
+    python -m web.block.harvest 15AP 15AM --interval 600
+"""
+
+import argparse
+import logging
+import os
+import re
+import time
+
+import sqlalchemy as sa
+from ossos import storage
+
+from web.block.queries import BlockQuery
+from web.overview.ossuary import OssuaryTable
+
+CANDIDATES = re.compile(r'^(?:(?P<prefix>fk)_)?(?P<field>.+)_[ps]?(?P<ccd>\d\d)\.'
+                        r'(?:measure3\.cands\.astrom|no_candidates)$')
+DONE = 'done'
+LOCKED = 'locked'
+WAITING = 'waiting'
+
+
+class StatusHarvester(object):
+    def __init__(self, jobs=8, measure3=storage.MEASURE3):
+        """
+        A StatusHarvester refreshes proc_status and blink_status for the images and fields of a block.
+
+        @param jobs: number of VOSpace nodes to read concurrently.
+        @param measure3: the VOSpace directory holding the candidate files that get blinked.
+        """
+        self.blocks = BlockQuery()
+        self.images = self.blocks.bk
+        self.conn = self.images.conn
+        self.blink_status = OssuaryTable('blink_status').table
+        self.jobs = jobs
+        self.measure3 = measure3
+
+    def block_images(self, blockID):
+        it = self.images.images
+        ss = sa.select([it.c.image_id], it.c.cfht_field.like('{0}%'.format(blockID)))
+
+        return [row[0] for row in self.conn.execute(ss)]
+
+    def harvest_block(self, blockID):
+        start = time.time()
+        image_ids = self.block_images(blockID)
+        n_images = self.images.refresh_status(image_ids, jobs=self.jobs)
+        empty_units, fields = self.blocks.fields_in_block(blockID)
+        n_ccds = self.harvest_blinks(fields)
+        logging.info("{}: tags of {}/{} images and {} candidate files in {:.1f}s".format(
+            blockID, n_images, len(image_ids), n_ccds, time.time() - start))
+
+    def harvest_blinks(self, fields):
+        # one listing of measure3, then the tags of the candidate files of these fields, several at once.
+        wanted = {}
+        for filename in storage.listdir(self.measure3, force=True):
+            match = CANDIDATES.match(filename)
+            if match is not None and match.group('field') in fields:
+                wanted[filename] = match
+
+        def fetch(filename):
+            return storage.client.get_node(os.path.join(self.measure3, filename), force=True).props
+
+        rows = {}
+        for filename, props in storage.prefetch(fetch, sorted(wanted), jobs=self.jobs):
+            if props is None:
+                continue
+            match = wanted[filename]
+            row = self.blink_row(match.group('field'), match.group('prefix') or '', int(match.group('ccd')), props)
+            # a ccd with both a no_candidates and a cands.astrom file counts once, blinked if either is.
+            key = (row['cfht_field'], row['prefix'], row['ccd'])
+            if key not in rows or rows[key]['status'] != DONE:
+                rows[key] = row
+
+        for field in fields:
+            with self.conn.begin():
+                self.conn.execute(self.blink_status.delete(self.blink_status.c.cfht_field == field))
+                field_rows = [row for row in rows.values() if row['cfht_field'] == field]
+                if len(field_rows) > 0:
+                    self.conn.execute(self.blink_status.insert(), field_rows)
+
+        return len(rows)
+
+    def blink_row(self, field, prefix, ccd, props):
+        done = props.get(storage.tag_uri('done'), None)
+        holder = props.get(storage.tag_uri('lock_holder'), None)
+        if done is not None:
+            status, holder = DONE, done
+        elif holder is not None:
+            status = LOCKED
+        else:
+            status = WAITING
+
+        return {'cfht_field': field, 'prefix': prefix, 'ccd': ccd, 'status': status, 'holder': holder}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Harvest the processing and blinking status of blocks into ossuary")
+    parser.add_argument('blocks', nargs='+', help="blocks to harvest, eg. 15AP")
+    parser.add_argument('--jobs', type=int, default=8, help="number of VOSpace nodes to read at once")
+    parser.add_argument('--measure3', default=storage.MEASURE3, help="VOSpace directory of the candidate files")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="harvest again after this many seconds, forever [default: harvest once]")
+    parser.add_argument('--verbose', action='store_true')
+    opt = parser.parse_args()
+
+    logging.basicConfig(level=opt.verbose and logging.INFO or logging.WARNING)
+    harvester = StatusHarvester(jobs=opt.jobs, measure3=opt.measure3)
+    while True:
+        for blockID in opt.blocks:
+            try:
+                harvester.harvest_block(blockID)
+            except Exception as ex:
+                logging.error("{}: {}".format(blockID, ex))
+        if opt.interval <= 0:
+            break
+        time.sleep(opt.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -183,56 +183,38 @@ class BlockQuery(object):
 
 
     def block_blinking_status(self, blockID):
-        # 36*21*2 = 1512 (or 1440 if it's a 20-field block.)
-        # combine.py makes a given prefix-field-ccd (type doesn't seem to be included)
-        # real files have either a .measure3.cands.astrom or a .no_candidates file.
-        # fk files have more stuff. And there's a lot more of them, because every ccd gets one.
-        #
-        # sometimes weird stuff gets in there. So check on a field-by-field basis, I think.
-        empty_units, fields = self.fields_in_block(blockID)
-        for field in fields:
-            uris = [os.path.join(storage.MEASURE3, str(field), '.measure3.cands.astrom'),
-                    os.path.join(storage.MEASURE3, str(field), '.no_candidates')]
-            for uri in uris:
-                if storage.exists(uri):
-                    node = storage.vospace.get_node(uri, force=force).props
-
-            done = storage.tag_uri('done')
-        # get_tags is built to obtain tags on the dbimages
-
-        # RIGHT. There can be 'done' tags without there being a corresponding 'reals' file.
-        # this is NOT IDEAL...
-
-        # vtag vos:OSSOS/measure3/fk_E+3-1_17.measure3.cands.astrom
-        # shows
-        # 'ivo://canfar.uvic.ca/ossos#done': 'michele'
-        # when done, but will show
-        # 'ivo://canfar.uvic.ca/ossos#lock_holder': 'michele'
-        # when someone has it out to blink.
-
-        # if no ccds blinked, show 'Not started'
-        # if some, show who has locks on those, group by lock_holder
-        # if all ccds show 'done', show 'Completed'.
-
-        # for the blocks page, just show 'x/36' under 'Blinked.'
-        # has to show that for both fk and real.
-
-        return None
-
-    # def get_cands_tags():
+        # how many ccds of the block's fields are blinked ('done'), out to someone ('locked') or 'waiting',
+        # for the real ('') and the planted ('fk') candidates, as harvested into blink_status.
+        # 36 ccds * 21 fields (or 20) for each of real and fk.
+        ss = sa.text("""
+			select prefix, status, count(*) from blink_status
+			where cfht_field like :block
+			group by prefix, status
+			order by prefix, status;""")
+        pp = {'block': '{0}%'.format(blockID)}
+        retval = OrderedDict()
+        for prefix, status, count in self.bk.conn.execute(ss, pp):
+            retval.setdefault(prefix, {})[status] = count
 
+        return retval
 
 
     def block_processing_status(self, blockID):
-        try:
-            self.bk.get_processing_status(self.block_discovery_triples(blockID))
-        except:
-            print('bother')
-
-        return None
-
-
-
-
-
+        # number of ccds of the block's images at each status, for each step in pipeline order,
+        # as harvested into proc_status.
+        ss = sa.text("""
+			select s.step, s.status, count(*) from proc_status s
+			join images i on i.image_id = s.image_id
+			where i.cfht_field like :block
+			group by s.step, s.status;""")
+        pp = {'block': '{0}%'.format(blockID)}
+        counts = {}
+        for step, status, count in self.bk.conn.execute(ss, pp):
+            counts.setdefault(step, {})[status] = count
+
+        retval = OrderedDict()
+        for step in self.bk.steps:
+            if step in counts:
+                retval[step] = counts[step]
 
+        return retval
@@ -1,5 +1,3 @@
-import pickle
-
 import sqlalchemy as sa
 import ephem
 import datetime
@@ -16,6 +14,8 @@ class ImagesQuery(object):
         ot = OssuaryTable('images')
         self.images = ot.table
         self.conn = ot.conn
+        self.proc_status = OssuaryTable('proc_status').table
+        self.proc_harvest = OssuaryTable('proc_harvest').table
         self.field_triplets = {}
         self.steps = ['preproc', 'preproc_o', 'update_header', 'update_header_p', 'mkpsf', 'mkpsf_p',
                       'step1', 'step1_p', 'step2', 'step2_p', 'step3', 'step3_p', 'combine', 'combine_p',
@@ -54,61 +54,100 @@ class ImagesQuery(object):
 
     def image_errors(self, image_id):
         # Retrieve existing information on processing errors from the db.
-        retval = ''
-        it = self.images
-        cols = [it.c.image_id, it.c.proc_status]
-        ss = sa.select(cols)
-        ss.append_whereclause(it.c.image_id == image_id)
-        ims_query = self.conn.execute(ss)
-        for row in ims_query:
-            if row[1] is None:
-                # Go and get it anew (this also adds it to the db for next time)
-                retval = self.check_VOSpace_for_proc_status(image_id)
-            else:
-                retval = pickle.loads(str(row[1]))
+        retval = self.status_by_image([image_id]).get(image_id, None)
+        if retval is None:
+            # Go and get it anew (this also adds it to the db for next time)
+            retval = self.check_VOSpace_for_proc_status(image_id)
 
         return retval
 
 
-    def add_err_to_db(self, image_id, ordered_errors):
-        # Turn the list/dict object of errors into a linear string, save that in the db
-        strerr = pickle.dumps(ordered_errors)
-        ss = self.images.update(self.images.c.image_id == image_id)
-        params = {'proc_status': strerr}
-        self.conn.execute(ss, params)  # , self.images.c.proc_status=strerr)
+    def check_VOSpace_for_proc_status(self, image_id):
+        self.refresh_status([image_id])
 
-        return
+        return self.status_by_image([image_id]).get(image_id, [])
 
 
-    def check_VOSpace_for_proc_status(self, image_id):
-        proc_keys = self.clean_keys(image_id)
-        errors = self.collate_errors(proc_keys)
-        ordered_errors = self.order_errors_in_pipeline(errors)
-        self.add_err_to_db(image_id, ordered_errors)
+    def refresh_status(self, image_ids, jobs=8):
+        # read the tags of the images from VOSpace, several at once, and replace their rows in proc_status.
+        # proc_harvest records that the image was read, so one with no ccd tags is not read again on every view.
+        harvested = storage.prefetch_tags(image_ids, jobs=jobs)
+        for image_id, node in list(harvested.items()):
+            rows = self.status_rows(int(image_id), self.clean_keys(image_id, node=node))
+            with self.conn.begin():
+                self.conn.execute(self.proc_status.delete(self.proc_status.c.image_id == int(image_id)))
+                if len(rows) > 0:
+                    self.conn.execute(self.proc_status.insert(), rows)
+                self.conn.execute(self.proc_harvest.delete(self.proc_harvest.c.image_id == int(image_id)))
+                self.conn.execute(self.proc_harvest.insert(), {'image_id': int(image_id)})
 
-        return ordered_errors
+        return len(harvested)
+
+
+    def status_rows(self, image_id, proc_keys):
+        # one proc_status row per step and ccd: tags without a ccd are not kept.
+        rows = []
+        for key, val in proc_keys:
+            root, ccd = key[0:len(key) - 2].strip('_'), key[-2:]
+            if not ccd.isdigit():
+                continue
+            rows.append({'image_id': image_id, 'step': root, 'ccd': int(ccd), 'status': val})
+
+        return rows
+
+
+    def status_by_image(self, image_ids):
+        # [vtag, vtag:{error:[ccds]}] for each image that has been harvested, from one aggregate over proc_status.
+        if len(image_ids) == 0:
+            return {}
+        # an image harvested without any ccd tags comes back as a single row with no step.
+        ss = sa.text("""
+			select h.image_id, s.step, s.status, array_agg(s.ccd order by s.ccd)
+			from proc_harvest h left join proc_status s on s.image_id = h.image_id
+			where h.image_id in :image_ids
+			group by h.image_id, s.step, s.status;""").bindparams(sa.bindparam('image_ids', expanding=True))
+        pp = {'image_ids': [int(image_id) for image_id in image_ids]}
+        errors = {}
+        for image_id, step, status, ccds in self.conn.execute(ss, pp):
+            image_errors = errors.setdefault(image_id, {})
+            if step is None:
+                continue
+            tag = image_errors.setdefault(step, {})
+            if not status == 'success':
+                tag[status] = ['%02d' % ccd for ccd in ccds]
+
+        retval = {}
+        for image_id, image_errors in list(errors.items()):
+            retval[image_id] = self.order_errors_in_pipeline(image_errors)
+
+        return retval
 
 
     def processing_status(self, ret_images, update=False):
         # want to show: [vtag, vtag:{error:[ccds] sorted in ascending ccd order}]
         # where the vtags are shown in their order of processing.
+        images = [row[2] for row in ret_images]
+        if update:  # retrieve new data from VOSpace
+            self.refresh_status(images)
+        statuses = self.status_by_image(images)
+        missing = [image for image in images if image not in statuses]
+        if len(missing) > 0:  # not harvested yet, so get those anew
+            self.refresh_status(missing)
+            statuses.update(self.status_by_image(missing))
+
         retval = []
         for row in ret_images:
-            image = row[2]
             retrow = row
-            if update:  # retrieve new data from VOSpace
-                ordered_errors = self.check_VOSpace_for_proc_status(image)
-            else:  # retrieve existing data from local database
-                ordered_errors = self.image_errors(image)
-            retrow.append(ordered_errors)
+            retrow.append(statuses.get(row[2], []))
             retval.append(retrow)
 
         return retval
 
 
-    def clean_keys(self, image_id):
+    def clean_keys(self, image_id, node=None):
         # first retrieve and clean off the keys
-        node = storage.get_tags(image_id, force=True)
+        if node is None:
+            node = storage.get_tags(image_id, force=True)
         unwanted = ['creator', 'date', 'groupread', 'groupwrite', 'ispublic', 'length']
         proc_keys = []
         for vtag, value in list(node.items()):
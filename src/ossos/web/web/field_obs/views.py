@@ -86,7 +86,7 @@ class Field(object):
     @Lazy
     def observations(self):
         rv = self.imagesQuery.field_images(self.fieldId)
-        proc_rv = self.imagesQuery.processing_status(rv, update=True)  # use this to trigger renewal
+        proc_rv = self.imagesQuery.processing_status(rv)  # kept fresh by web.block.harvest
 
         # format the errors in html with links to their joblogs
         retproc = []
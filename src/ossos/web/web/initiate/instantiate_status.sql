@@ -0,0 +1,44 @@
+-- instantiates the tables 'proc_status', 'proc_harvest' and 'blink_status' within the db ossuary
+-- proc_status: one row per processing step and ccd of each image, harvested from the VOSpace tags on dbimages
+-- proc_harvest: one row per image whose tags have been harvested, including those with no rows in proc_status
+-- blink_status: one row per ccd of each field's candidates, harvested from the VOSpace tags on measure3
+--
+-- the web pages aggregate these rather than asking VOSpace for the tags of every image they show.
+
+
+CREATE TABLE proc_status (
+  image_id     BIGINT                   NOT NULL REFERENCES images (image_id), -- EXPNUM the tag is on
+  step         TEXT                     NOT NULL, -- process and version, eg. 'mkpsf_p'
+  ccd          SMALLINT                 NOT NULL, -- 0..35
+  status       TEXT                     NOT NULL, -- 'success' or the error the step left
+  harvested    TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (image_id, step, ccd)
+);
+
+-- for the block aggregates
+CREATE INDEX proc_status_step_index ON proc_status (step, status);
+
+
+CREATE TABLE proc_harvest (
+  image_id     BIGINT                   NOT NULL REFERENCES images (image_id), -- EXPNUM whose tags were read
+  harvested    TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (image_id)
+);
+
+
+CREATE TABLE blink_status (
+  cfht_field   TEXT                     NOT NULL, -- OBJECT of the images the candidates came from
+  prefix       TEXT                     NOT NULL, -- '' for the real candidates, 'fk' for the planted ones
+  ccd          SMALLINT                 NOT NULL, -- 0..35
+  status       TEXT                     NOT NULL, -- 'done', 'locked' or 'waiting'
+  holder       TEXT                     NULL, -- who blinked, or is blinking, the ccd
+  harvested    TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+  PRIMARY KEY (cfht_field, prefix, ccd)
+);
+
+-- for selecting the fields of a block: cfht_field LIKE 'block%'
+CREATE INDEX images_field_index ON images (cfht_field text_pattern_ops);
+CREATE INDEX blink_status_field_index ON blink_status (cfht_field text_pattern_ops);
+ANALYZE proc_status;
+ANALYZE proc_harvest;
+ANALYZE blink_status;